@@ -21,6 +21,7 @@
 import os
 import os.path
 import shutil
+import stat
 import tempfile
 import re
 
@@ -93,6 +94,16 @@ options:
     required: false
     default: null
     version_added: "2.0"
+  manifest:
+    description:
+      - Path to a file on the remote host used to record the name, size, modification time
+        and digest of every fragment, along with the checksum and identity of C(dest).
+        When no fragment changed since the last run and C(dest) was not modified, the
+        module exits without assembling anything. Fragments whose modification time
+        changed are re-hashed rather than assumed to be different.
+    required: false
+    default: null
+    version_added: "2.1"
 author: "Stephen Fromm (@sfromm)"
 extends_documentation_fragment:
     - files
@@ -107,42 +118,158 @@ EXAMPLES = '''
 
 # Copy a new "sshd_config" file into place, after passing validation with sshd
 - assemble: src=/etc/ssh/conf.d/ dest=/etc/ssh/sshd_config validate='/usr/sbin/sshd -t -f %s'
+
+# Skip reassembling a large file while none of its fragments changed
+- assemble: src=/etc/someapp/fragments dest=/etc/someapp/someapp.conf manifest=/var/cache/someapp.manifest
 '''
 
 # ===========================================
 # Support method
 
-def assemble_from_fragments(src_path, delimiter=None, compiled_regexp=None, ignore_hidden=False):
-    ''' assemble a file from a directory of fragments '''
-    tmpfd, temp_path = tempfile.mkstemp()
-    tmp = os.fdopen(tmpfd,'w')
-    delimit_me = False
-    add_newline = False
+BUFSIZE = 65536
+
+def stat_key(st):
+    ''' dev, inode, size and mtime in ns, how dest and the fragments are recognised between runs '''
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(st.st_mtime * 1000000000)
+    return [st.st_dev, st.st_ino, st.st_size, mtime_ns]
 
+def list_fragments(src_path, compiled_regexp=None, ignore_hidden=False):
+    ''' return the sorted (name, path, stat) of the fragments to assemble '''
+    fragments = []
     for f in sorted(os.listdir(src_path)):
         if compiled_regexp and not compiled_regexp.search(f):
             continue
+        if ignore_hidden and f.startswith('.'):
+            continue
         fragment = "%s/%s" % (src_path, f)
-        if not os.path.isfile(fragment) or (ignore_hidden and os.path.basename(fragment).startswith('.')):
+        try:
+            st = os.stat(fragment)
+        except OSError:
             continue
+        if not stat.S_ISREG(st.st_mode):
+            continue
+        fragments.append((f, fragment, st))
+    return fragments
+
+def fragment_entry(name, st, digest):
+    ''' the manifest record of a fragment: name, size, mtime_ns and sha1 '''
+    return [name] + stat_key(st)[2:] + [digest]
+
+def fragment_digest(path):
+    digest = AVAILABLE_HASH_ALGORITHMS['sha1']()
+    infile = open(path, 'rb')
+    try:
+        block = infile.read(BUFSIZE)
+        while block:
+            digest.update(block)
+            block = infile.read(BUFSIZE)
+    finally:
+        infile.close()
+    return digest.hexdigest()
+
+def load_manifest(path):
+    ''' the manifest of the previous run, or {} when it is missing or cannot be parsed '''
+    try:
+        infile = open(path, 'r')
+        try:
+            manifest = json.load(infile)
+        finally:
+            infile.close()
+    except (IOError, ValueError):
+        return {}
+    if not isinstance(manifest, dict):
+        return {}
+    return manifest
+
+def save_manifest(path, manifest):
+    ''' write the manifest through a rename; if that fails the next run reads every fragment again '''
+    try:
+        (fd, tmppath) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    except (IOError, OSError):
+        return
+    try:
+        outfile = os.fdopen(fd, 'w')
+        try:
+            json.dump(manifest, outfile)
+        finally:
+            outfile.close()
+        os.rename(tmppath, path)
+    except (IOError, OSError):
+        try:
+            os.unlink(tmppath)
+        except OSError:
+            pass
+
+def unchanged_fragments(fragments, recorded):
+    '''
+    compare the fragments with the ones recorded in the manifest, re-hashing
+    those whose mtime changed but not their size. Returns the up to date
+    manifest records, or None if any fragment changed.
+    '''
+    if not isinstance(recorded, list) or len(recorded) != len(fragments):
+        return None
+    entries = []
+    for (name, path, st), entry in zip(fragments, recorded):
+        current = fragment_entry(name, st, None)
+        if not isinstance(entry, list) or len(entry) != 4 or entry[:2] != current[:2]:
+            return None
+        if entry[2] == current[2]:
+            digest = entry[3]
+        else:
+            digest = fragment_digest(path)
+            if digest != entry[3]:
+                return None
+        entries.append(fragment_entry(name, st, digest))
+    return entries
+
+def assemble_from_fragments(src_path, delimiter=None, compiled_regexp=None, ignore_hidden=False, fragments=None):
+    '''
+    assemble a file from a directory of fragments. Returns the path of the
+    assembled file, its sha1 and md5 (None when md5 is not available) computed
+    while writing it, and the manifest records of the fragments.
+    '''
+    tmpfd, temp_path = tempfile.mkstemp()
+    tmp = os.fdopen(tmpfd,'w')
+    delimit_me = False
+    add_newline = False
+
+    digests = [AVAILABLE_HASH_ALGORITHMS['sha1']()]
+    try:
+        digests.append(AVAILABLE_HASH_ALGORITHMS['md5']())
+    except (KeyError, ValueError):
+        # md5 is not available in FIPS mode
+        pass
+
+    def write(data):
+        tmp.write(data)
+        for digest in digests:
+            digest.update(data)
+
+    if fragments is None:
+        fragments = list_fragments(src_path, compiled_regexp, ignore_hidden)
+    entries = []
+    for (f, fragment, st) in fragments:
         fragment_content = file(fragment).read()
+        entries.append(fragment_entry(f, st, AVAILABLE_HASH_ALGORITHMS['sha1'](fragment_content).hexdigest()))
 
         # always put a newline between fragments if the previous fragment didn't end with a newline.
         if add_newline:
-            tmp.write('\n')
+            write('\n')
 
         # delimiters should only appear between fragments
         if delimit_me:
             if delimiter:
                 # un-escape anything like newlines
                 delimiter = delimiter.decode('unicode-escape')
-                tmp.write(delimiter)
+                write(delimiter)
                 # always make sure there's a newline after the
                 # delimiter, so lines don't run together
                 if delimiter[-1] != '\n':
-                    tmp.write('\n')
+                    write('\n')
 
-        tmp.write(fragment_content)
+        write(fragment_content)
         delimit_me = True
         if fragment_content.endswith('\n'):
             add_newline = False
@@ -150,7 +277,10 @@ def assemble_from_fragments(src_path, delimiter=None, compiled_regexp=None, igno
             add_newline = True
 
     tmp.close()
-    return temp_path
+    path_md5 = None
+    if len(digests) > 1:
+        path_md5 = digests[1].hexdigest()
+    return temp_path, digests[0].hexdigest(), path_md5, entries
 
 # ==============================================================
 # main
@@ -168,6 +298,7 @@ def main():
             regexp = dict(required=False),
             ignore_hidden = dict(default=False, type='bool'),
             validate = dict(required=False, type='str'),
+            manifest = dict(required=False, type='path'),
         ),
         add_file_common_args=True
     )
@@ -184,6 +315,7 @@ def main():
     compiled_regexp = None
     ignore_hidden = module.params['ignore_hidden']
     validate = module.params.get('validate', None)
+    manifest_path = module.params['manifest']
 
     if not os.path.exists(src):
         module.fail_json(msg="Source (%s) does not exist" % src)
@@ -197,10 +329,34 @@ def main():
         except re.error, e:
             module.fail_json(msg="Invalid Regexp (%s) in \"%s\"" % (e, regexp))
 
-    path = assemble_from_fragments(src, delimiter, compiled_regexp, ignore_hidden)
-    path_hash = module.sha1(path)
+    fragments = list_fragments(src, compiled_regexp, ignore_hidden)
 
+    manifest = {}
+    dest_key = None
+    settings = dict(src=src, dest=dest, delimiter=delimiter, regexp=regexp)
+    if manifest_path:
+        manifest = load_manifest(manifest_path)
+        if manifest.get('settings') != settings:
+            manifest = {}
     if os.path.exists(dest):
+        dest_key = stat_key(os.stat(dest))
+
+    if manifest and dest_key is not None and manifest.get('dest') == dest_key:
+        # dest is the file written by the last run, so its checksum is known
+        dest_hash = manifest.get('checksum')
+        entries = unchanged_fragments(fragments, manifest.get('fragments'))
+        if entries is not None:
+            if entries != manifest['fragments']:
+                manifest['fragments'] = entries
+                save_manifest(manifest_path, manifest)
+            file_args = module.load_file_common_arguments(module.params)
+            changed = module.set_fs_attributes_if_different(file_args, False)
+            module.exit_json(src=src, dest=dest, md5sum=manifest.get('md5sum'),
+                             checksum=dest_hash, changed=changed, msg="OK")
+
+    path, path_hash, pathmd5, entries = assemble_from_fragments(src, delimiter, fragments=fragments)
+
+    if dest_key is not None and dest_hash is None:
         dest_hash = module.sha1(dest)
 
     if path_hash != dest_hash:
@@ -216,14 +372,13 @@ def main():
         shutil.copy(path, dest)
         changed = True
 
-    # Backwards compat.  This won't return data if FIPS mode is active
-    try:
-        pathmd5 = module.md5(path)
-    except ValueError:
-        pathmd5 = None
-
     os.remove(path)
 
+    if manifest_path:
+        save_manifest(manifest_path, dict(settings=settings, fragments=entries,
+                                          dest=stat_key(os.stat(dest)),
+                                          checksum=path_hash, md5sum=pathmd5))
+
     file_args = module.load_file_common_arguments(module.params)
     changed = module.set_fs_attributes_if_different(file_args, changed)
     # Mission complete
@@ -232,5 +387,5 @@ def main():
 # import module snippets
 from ansible.module_utils.basic import *
 
-main()
-
+if __name__ == '__main__':
+    main()
@@ -19,7 +19,11 @@
 # along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import Queue
+import shutil
+import stat
 import tempfile
+import threading
 
 DOCUMENTATION = '''
 ---
@@ -84,6 +88,59 @@ options:
     required: false
     default: "False"
     version_added: "2.0"
+  checksum_algorithm:
+    description:
+      - Additional algorithm to compute alongside sha1 and md5 while the source is read.
+        The digest is returned as C(<algorithm>sum), e.g. C(sha256sum). All digests are
+        computed in a single pass over the source file.
+    required: false
+    choices: [ 'sha1', 'sha224', 'sha256', 'sha384', 'sha512' ]
+    default: sha1
+    aliases: [ 'checksum_algo' ]
+    version_added: "2.1"
+  checksum_cache:
+    description:
+      - Path to a file on the remote host used to cache destination checksums between runs.
+        Entries are keyed by destination path and only reused while the device, inode, size
+        and modification time of the destination are unchanged, so converged files are not
+        re-hashed. A destination whose size differs from the source is always considered
+        changed without being hashed, whether or not a cache is used.
+    required: false
+    default: null
+    version_added: "2.1"
+  files:
+    description:
+      - A list of files to copy in one module run. Requires C(remote_src=yes), the sources must
+        already be on the remote host. C(src) and C(dest) are then the directories that relative
+        paths in the list are resolved against.
+      - Each item is a dictionary with a C(src) key and optional C(dest), C(mode), C(owner) and
+        C(group) keys, which override the module level options for that file. C(dest) defaults
+        to the C(src) of the item. Files are compared and copied to temporary files concurrently,
+        and the changed status of every file is returned in C(results). C(validate) runs on each
+        changed file before it is moved into place.
+    required: false
+    default: null
+    version_added: "2.1"
+  workers:
+    description:
+      - Number of threads used to hash and copy the items of C(files).
+    required: false
+    default: 4
+    version_added: "2.1"
+  delta:
+    description:
+      - When C(remote_src) is set and the destination already exists, compare it with the source
+        block by block while copying, instead of hashing both files first. Source and destination
+        are each read once and nothing is written while the blocks match, which suits large files
+        such as VM images that change in a few places.
+      - From the first block that differs, the new file is assembled in a temporary file next to
+        the destination and moved into place atomically, as without C(delta). Blocks are compared
+        at the same offsets, so data inserted or removed near the start makes every later block
+        count as changed. Ignored in check mode.
+    required: false
+    choices: [ "yes", "no" ]
+    default: "no"
+    version_added: "2.1"
 extends_documentation_fragment:
     - files
     - validate
@@ -110,6 +167,17 @@ EXAMPLES = '''
 
 # Copy a new "sudoers" file into place, after passing validation with visudo
 - copy: src=/mine/sudoers dest=/etc/sudoers validate='visudo -cf %s'
+
+# Copy a set of files already present on the remote host in a single run
+- copy:
+    remote_src: yes
+    src: /opt/staging
+    dest: /etc/app
+    files:
+      - { src: app.conf, mode: "0640", owner: app }
+      - { src: log.conf }
+      - { src: logrotate.conf, dest: /etc/logrotate.d/app }
+    workers: 8
 '''
 
 RETURN = '''
@@ -133,6 +201,22 @@ checksum:
     returned: success
     type: string
     sample: "6e642bb8dd5c2e027bf21dd923337cbb4214f827"
+sha256sum:
+    description: digest of the file in the algorithm selected by checksum_algorithm (the key is named after it)
+    returned: when checksum_algorithm is not sha1
+    type: string
+    sample: "b5bb9d8014a0f9b1d61e21e796d78dccdf1352f23cd32812f4850b878ae4944c"
+delta:
+    description: block statistics of a delta update
+    returned: when delta is used
+    type: dictionary
+    sample: { "blocks": 16384, "changed_blocks": 3, "truncated": false }
+results:
+    description: per file outcome when C(files) is used, each with src, dest, changed, checksum and md5sum
+    returned: when files is used
+    type: list of dictionaries
+    sample: [ { "src": "/opt/staging/app.conf", "dest": "/etc/app/app.conf", "changed": true,
+                "checksum": "6e642bb8dd5c2e027bf21dd923337cbb4214f827", "md5sum": "2a5aeecc61dc98c4d780b14b330e3282" } ]
 backup_file:
     description: name of backup file created
     returned: changed and if backup=yes
@@ -175,6 +259,436 @@ state:
     sample: "file"
 '''
 
+BUFSIZE = 64 * 1024
+
+
+def new_digests(algorithms):
+    '''
+    Return a dict of fresh hash objects, one per algorithm. Algorithms the host
+    cannot use (md5 on FIPS-140 compliant systems) map to None.
+    '''
+
+    digests = {}
+    for algorithm in algorithms:
+        try:
+            digests[algorithm] = AVAILABLE_HASH_ALGORITHMS[algorithm]()
+        except (KeyError, ValueError):
+            digests[algorithm] = None
+    return digests
+
+
+def hexdigests(digests):
+    '''
+    Return the hex digest of each hash object, keeping None for unusable algorithms.
+    '''
+
+    result = {}
+    for algorithm, hasher in digests.items():
+        if hasher is None:
+            result[algorithm] = None
+        else:
+            result[algorithm] = hasher.hexdigest()
+    return result
+
+
+def multi_digest(filename, algorithms, outfile=None):
+    '''
+    Compute every requested digest of filename in a single chunked read.
+    If outfile is given, each chunk is also written to it, so that copying
+    and hashing a file costs one read and one write.
+    '''
+
+    digests = new_digests(algorithms)
+    hashers = [ d for d in digests.values() if d is not None ]
+    infile = open(filename, 'rb')
+    try:
+        block = infile.read(BUFSIZE)
+        while block:
+            for hasher in hashers:
+                hasher.update(block)
+            if outfile is not None:
+                outfile.write(block)
+            block = infile.read(BUFSIZE)
+    finally:
+        infile.close()
+
+    return hexdigests(digests)
+
+
+def stat_key(st):
+    '''
+    The device, inode, size and mtime in nanoseconds of a destination, the
+    identity its cached checksum is stored under.
+    '''
+
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(st.st_mtime * 1000000000)
+    return [st.st_dev, st.st_ino, st.st_size, mtime_ns]
+
+
+def load_checksum_cache(path):
+    '''
+    Read the checksum cache. A missing or corrupt cache reads as empty, which
+    only means destinations get hashed.
+    '''
+
+    try:
+        infile = open(path, 'r')
+        try:
+            cache = json.load(infile)
+        finally:
+            infile.close()
+    except (IOError, ValueError):
+        return {}
+    if not isinstance(cache, dict):
+        return {}
+    return cache
+
+
+def save_checksum_cache(path, cache):
+    '''
+    Write the checksum cache to a temporary file renamed over the old one.
+    Errors are ignored, the next run hashes the destinations again.
+    '''
+
+    try:
+        (fd, tmppath) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    except (IOError, OSError):
+        return
+    try:
+        outfile = os.fdopen(fd, 'w')
+        try:
+            json.dump(cache, outfile)
+        finally:
+            outfile.close()
+        os.rename(tmppath, path)
+    except (IOError, OSError):
+        try:
+            os.unlink(tmppath)
+        except OSError:
+            pass
+
+
+def cached_checksum(cache, path, st):
+    '''
+    Return the cached sha1 of path if its stat identity has not changed.
+    '''
+
+    entry = cache.get(path)
+    if entry and entry[:4] == stat_key(st):
+        return entry[4]
+    return None
+
+
+def remember_checksum(cache, path, checksum):
+    '''
+    Record the checksum of path in the cache, returning True if the cache changed.
+    '''
+
+    if checksum is None:
+        return False
+    st = os.stat(path)
+    if not stat.S_ISREG(st.st_mode):
+        return False
+    entry = stat_key(st) + [checksum]
+    if cache.get(path) == entry:
+        return False
+    cache[path] = entry
+    return True
+
+
+def dest_checksum(src, dest, cache=None):
+    '''
+    Return the sha1 of dest, or None when dest is a regular file whose size
+    differs from src, in which case the contents cannot match and hashing
+    is skipped.
+    '''
+
+    dest_st = os.stat(dest)
+    if stat.S_ISREG(dest_st.st_mode) and dest_st.st_size != os.stat(src).st_size:
+        return None
+    checksum = None
+    if cache is not None:
+        checksum = cached_checksum(cache, dest, dest_st)
+    if checksum is None:
+        checksum = multi_digest(dest, ['sha1'])['sha1']
+    return checksum
+
+
+def start_delta(dest, length):
+    '''
+    Start the temporary file of a delta update next to dest with the first
+    length bytes of dest, which are known to match the source.
+    '''
+
+    (fd, tmpdest) = tempfile.mkstemp(dir=os.path.dirname(dest))
+    outfile = os.fdopen(fd, 'wb')
+    try:
+        infile = open(dest, 'rb')
+        try:
+            while length > 0:
+                block = infile.read(min(BUFSIZE, length))
+                if not block:
+                    break
+                outfile.write(block)
+                length -= len(block)
+        finally:
+            infile.close()
+    except:
+        outfile.close()
+        os.unlink(tmpdest)
+        raise
+    return (tmpdest, outfile)
+
+
+def delta_update(src, dest, algorithms):
+    '''
+    Compare src with dest block by block, computing the digests of src on
+    the way. From the first block that differs, the rest of src is copied
+    to a temporary file started from the matching blocks of dest. Returns
+    the temporary path, or None when dest already matches src, along with
+    the digests and statistics about the update.
+    '''
+
+    digests = new_digests(algorithms)
+    hashers = [ d for d in digests.values() if d is not None ]
+    stats = dict(blocks=0, changed_blocks=0, truncated=False)
+    tmpdest = None
+    outfile = None
+    infile = open(src, 'rb')
+    try:
+        try:
+            destfile = open(dest, 'rb')
+            try:
+                offset = 0
+                block = infile.read(BUFSIZE)
+                while block:
+                    for hasher in hashers:
+                        hasher.update(block)
+                    stats['blocks'] += 1
+                    if destfile.read(len(block)) != block:
+                        stats['changed_blocks'] += 1
+                        if outfile is None:
+                            (tmpdest, outfile) = start_delta(dest, offset)
+                    if outfile is not None:
+                        outfile.write(block)
+                    offset += len(block)
+                    block = infile.read(BUFSIZE)
+                if destfile.read(1):
+                    stats['truncated'] = True
+                    if outfile is None:
+                        (tmpdest, outfile) = start_delta(dest, offset)
+            finally:
+                destfile.close()
+            if outfile is not None:
+                outfile.close()
+                outfile = None
+                shutil.copystat(src, tmpdest)
+        except:
+            if outfile is not None:
+                outfile.close()
+            if tmpdest is not None:
+                os.unlink(tmpdest)
+            raise
+    finally:
+        infile.close()
+
+    return (tmpdest, hexdigests(digests), stats)
+
+
+def copy_with_digests(src, dest, algorithms):
+    '''
+    Copy src to a temporary file in the directory of dest, hashing the data
+    as it is written. Returns the temporary path and the digests of src.
+    '''
+
+    (fd, tmpdest) = tempfile.mkstemp(dir=os.path.dirname(dest))
+    try:
+        outfile = os.fdopen(fd, 'wb')
+        try:
+            digests = multi_digest(src, algorithms, outfile)
+        finally:
+            outfile.close()
+        shutil.copystat(src, tmpdest)
+    except:
+        os.unlink(tmpdest)
+        raise
+    return (tmpdest, digests)
+
+
+def run_in_pool(func, items, workers):
+    '''
+    Call func on every entry of a batch from up to workers threads. Results
+    come back in the order of items, with any exception func raised in place
+    of its result so the entry can be reported as failed.
+    '''
+
+    results = [None] * len(items)
+    work = Queue.Queue()
+    for index in range(len(items)):
+        work.put(index)
+
+    def worker():
+        while True:
+            try:
+                index = work.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[index] = func(items[index])
+            except Exception, e:
+                results[index] = e
+
+    threads = []
+    for i in range(max(1, min(workers, len(items)))):
+        t = threading.Thread(target=worker)
+        t.setDaemon(True)
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+    return results
+
+
+def prepare_entry(entry, algorithms, force, cache, check_mode):
+    '''
+    Compare one batch entry with its destination and, when it differs, copy
+    the source to a temporary file next to the destination. Runs in a worker
+    thread, so it reports problems in the returned dict instead of failing
+    the module.
+    '''
+
+    src = entry['src']
+    dest = entry['dest']
+    result = dict(src=src, dest=dest, tmpdest=None, digests=None, changed=False)
+
+    if not os.path.exists(src):
+        result['msg'] = "Source %s does not exist" % src
+        return result
+    if not os.access(src, os.R_OK):
+        result['msg'] = "Source %s not readable" % src
+        return result
+    if os.path.isdir(dest):
+        dest = os.path.join(dest, os.path.basename(src))
+        result['dest'] = dest
+    dirname = os.path.dirname(dest)
+    if not os.path.isdir(dirname):
+        result['msg'] = "Destination directory %s does not exist" % dirname
+        return result
+    if not os.access(dirname, os.W_OK):
+        result['msg'] = "Destination %s not writable" % dirname
+        return result
+
+    checksum_dest = None
+    if os.path.lexists(dest):
+        if not force:
+            result['digests'] = multi_digest(src, algorithms)
+            return result
+        if os.access(dest, os.R_OK) and not os.path.islink(dest):
+            checksum_dest = dest_checksum(src, dest, cache)
+
+    if checksum_dest is not None or check_mode:
+        result['digests'] = multi_digest(src, algorithms)
+        if result['digests']['sha1'] == checksum_dest:
+            return result
+        result['changed'] = True
+        if check_mode:
+            return result
+
+    (result['tmpdest'], result['digests']) = copy_with_digests(src, dest, algorithms)
+    result['changed'] = True
+    return result
+
+
+def copy_files(module, algorithms, cache):
+    '''
+    Copy every entry of the files list in a single module run. Hashing and
+    copying into temporary files happen in a pool of worker threads, then
+    validation, the atomic moves and attribute changes are applied here.
+    '''
+
+    validate = module.params['validate']
+    if validate and "%s" not in validate:
+        module.fail_json(msg="validate must contain %%s: %s" % (validate))
+
+    if not module.params['remote_src'] or not module.params['src']:
+        module.fail_json(msg="files requires remote_src=yes and a src directory")
+    src = os.path.expanduser(module.params['src'])
+    dest = os.path.expanduser(module.params['dest'])
+
+    entries = []
+    for entry in module.params['files']:
+        if not isinstance(entry, dict) or not entry.get('src'):
+            module.fail_json(msg="each item in files needs a src: %s" % entry)
+        entry = entry.copy()
+        entry['dest'] = os.path.join(dest, os.path.expanduser(entry.get('dest') or entry['src']))
+        entry['src'] = os.path.join(src, os.path.expanduser(entry['src']))
+        entries.append(entry)
+
+    prepared = run_in_pool(
+        lambda entry: prepare_entry(entry, algorithms, module.params['force'], cache, module.check_mode),
+        entries, module.params['workers'])
+
+    results = []
+    failed = False
+    cache_changed = False
+    for entry, prepared_entry in zip(entries, prepared):
+        if isinstance(prepared_entry, Exception):
+            results.append(dict(src=entry['src'], dest=entry['dest'], failed=True,
+                                msg="failed to copy: %s to %s: %s" % (entry['src'], entry['dest'], str(prepared_entry))))
+            failed = True
+            continue
+        res = dict(src=prepared_entry['src'], dest=prepared_entry['dest'], changed=prepared_entry['changed'])
+        if 'msg' in prepared_entry:
+            res.update(failed=True, msg=prepared_entry['msg'])
+            results.append(res)
+            failed = True
+            continue
+
+        dest = res['dest']
+        digests = prepared_entry['digests']
+        res['checksum'] = digests['sha1']
+        res['md5sum'] = digests['md5']
+        if prepared_entry['tmpdest']:
+            if validate:
+                # some validations depend on the mode of the file
+                mode = entry.get('mode', module.params['mode'])
+                if mode is not None:
+                    module.set_mode_if_different(prepared_entry['tmpdest'], mode, False)
+                (rc, out, err) = module.run_command(validate % prepared_entry['tmpdest'])
+                if rc != 0:
+                    os.unlink(prepared_entry['tmpdest'])
+                    res.update(failed=True, msg="failed to validate: rc:%s error:%s" % (rc, err))
+                    results.append(res)
+                    failed = True
+                    continue
+            if module.params['backup'] and os.path.exists(dest):
+                res['backup_file'] = module.backup_local(dest)
+            if os.path.islink(dest):
+                os.unlink(dest)
+            module.atomic_move(prepared_entry['tmpdest'], dest)
+
+        if not module.check_mode or os.path.exists(dest):
+            module.params['dest'] = dest
+            file_args = module.load_file_common_arguments(module.params)
+            for key in ('mode', 'owner', 'group'):
+                if entry.get(key) is not None:
+                    file_args[key] = entry[key]
+            res['changed'] = module.set_fs_attributes_if_different(file_args, res['changed'])
+        if cache is not None and not module.check_mode:
+            cache_changed = remember_checksum(cache, dest, res['checksum']) or cache_changed
+        results.append(res)
+
+    if cache_changed:
+        save_checksum_cache(module.params['checksum_cache'], cache)
+
+    changed = len([ r for r in results if r.get('changed') ]) > 0
+    if failed:
+        module.fail_json(msg="failed to copy one or more files", results=results, changed=changed)
+    module.exit_json(results=results, changed=changed)
+
+
 def split_pre_existing_dir(dirname):
     '''
     Return the first pre-existing directory and a list of the new directories that will be created.
@@ -216,11 +730,33 @@ def main():
             validate          = dict(required=False, type='str'),
             directory_mode    = dict(required=False),
             remote_src        = dict(required=False, type='bool'),
+            checksum_algorithm = dict(default='sha1', type='str', choices=['sha1', 'sha224', 'sha256', 'sha384', 'sha512'], aliases=['checksum_algo']),
+            checksum_cache    = dict(required=False, type='path'),
+            files             = dict(required=False, type='list'),
+            workers           = dict(default=4, type='int'),
+            delta             = dict(default=False, type='bool'),
         ),
+        mutually_exclusive=[['content', 'files']],
         add_file_common_args=True,
         supports_check_mode=True,
     )
 
+    checksum_algorithm = module.params['checksum_algorithm']
+    checksum_cache = module.params['checksum_cache']
+
+    # sha1 is the checksum compared by the action plugin, md5 is backwards
+    # compat only and will be None in FIPS mode.
+    algorithms = ['sha1', 'md5']
+    if checksum_algorithm not in algorithms:
+        algorithms.append(checksum_algorithm)
+
+    cache = None
+    if checksum_cache:
+        cache = load_checksum_cache(checksum_cache)
+
+    if module.params['files']:
+        copy_files(module, algorithms, cache)
+
     src    = os.path.expanduser(module.params['src'])
     dest   = os.path.expanduser(module.params['dest'])
     backup = module.params['backup']
@@ -230,19 +766,16 @@ def main():
     follow = module.params['follow']
     mode   = module.params['mode']
     remote_src = module.params['remote_src']
+    # delta updates compare while copying, there is nothing to copy in check mode
+    delta  = module.params['delta'] and remote_src and not module.check_mode
 
     if not os.path.exists(src):
         module.fail_json(msg="Source %s failed to transfer" % (src))
     if not os.access(src, os.R_OK):
         module.fail_json(msg="Source %s not readable" % (src))
 
-    checksum_src = module.sha1(src)
+    digests_src = None
     checksum_dest = None
-    # Backwards compat only.  This will be None in FIPS mode
-    try:
-        md5sum_src = module.md5(src)
-    except ValueError:
-        md5sum_src = None
 
     changed = False
 
@@ -271,9 +804,16 @@ def main():
             if original_basename:
                 basename = original_basename
             dest = os.path.join(dest, basename)
-        if os.access(dest, os.R_OK):
-            checksum_dest = module.sha1(dest)
+        if delta and os.path.isfile(dest) and not os.path.islink(dest) and os.access(dest, os.R_OK):
+            # compared block by block while it is copied below
+            pass
+        elif os.access(dest, os.R_OK):
+            checksum_dest = dest_checksum(src, dest, cache)
+            delta = False
+        else:
+            delta = False
     else:
+        delta = False
         if not os.path.exists(os.path.dirname(dest)):
             try:
                 # os.path.exists() can return false in some
@@ -288,51 +828,85 @@ def main():
     if not os.access(os.path.dirname(dest), os.W_OK):
         module.fail_json(msg="Destination %s not writable" % (os.path.dirname(dest)))
 
-    backup_file = None
-    if checksum_src != checksum_dest or os.path.islink(dest):
+    # When the source has to be copied on the remote side and there is no
+    # destination to compare against, it is hashed while being copied below.
+    delta_stats = None
+    tmpdest = None
+    if delta:
         try:
-            if backup:
-                if os.path.exists(dest):
-                    backup_file = module.backup_local(dest)
-            # allow for conversion from symlink.
-            if os.path.islink(dest):
-                os.unlink(dest)
-                open(dest, 'w').close()
-            if validate:
-                # if we have a mode, make sure we set it on the temporary
-                # file source as some validations may require it
-                # FIXME: should we do the same for owner/group here too?
-                if mode is not None:
-                    module.set_mode_if_different(src, mode, False)
-                if "%s" not in validate:
-                    module.fail_json(msg="validate must contain %%s: %s" % (validate))
-                (rc,out,err) = module.run_command(validate % src)
-                if rc != 0:
-                    module.fail_json(msg="failed to validate: rc:%s error:%s" % (rc,err))
-            if remote_src:
-                tmpdest = tempfile.mkstemp(dir=os.basedir(dest))
-                shutil.copy2(src, tmpdest)
-                module.atomic_move(tmpdest, dest)
-            else:
-                module.atomic_move(src, dest)
-        except IOError:
+            (tmpdest, digests_src, delta_stats) = delta_update(src, dest, algorithms)
+        except (IOError, OSError):
             module.fail_json(msg="failed to copy: %s to %s" % (src, dest))
+        if tmpdest is None:
+            checksum_dest = digests_src['sha1']
+    elif checksum_dest is not None or not remote_src:
+        digests_src = multi_digest(src, algorithms)
+
+    backup_file = None
+    if digests_src is None or digests_src['sha1'] != checksum_dest or os.path.islink(dest):
+        if module.check_mode:
+            # nothing is written in check mode, the source only has to be hashed
+            if digests_src is None:
+                digests_src = multi_digest(src, algorithms)
+        else:
+            try:
+                if backup:
+                    if os.path.exists(dest):
+                        backup_file = module.backup_local(dest)
+                # allow for conversion from symlink.
+                if os.path.islink(dest):
+                    os.unlink(dest)
+                    open(dest, 'w').close()
+                if validate:
+                    # if we have a mode, make sure we set it on the temporary
+                    # file source as some validations may require it
+                    # FIXME: should we do the same for owner/group here too?
+                    if mode is not None:
+                        module.set_mode_if_different(src, mode, False)
+                    if "%s" not in validate:
+                        if tmpdest is not None:
+                            os.unlink(tmpdest)
+                        module.fail_json(msg="validate must contain %%s: %s" % (validate))
+                    (rc,out,err) = module.run_command(validate % src)
+                    if rc != 0:
+                        if tmpdest is not None:
+                            os.unlink(tmpdest)
+                        module.fail_json(msg="failed to validate: rc:%s error:%s" % (rc,err))
+                if tmpdest is not None:
+                    module.atomic_move(tmpdest, dest)
+                elif remote_src:
+                    (tmpdest, digests_src) = copy_with_digests(src, dest, algorithms)
+                    module.atomic_move(tmpdest, dest)
+                else:
+                    module.atomic_move(src, dest)
+            except IOError:
+                module.fail_json(msg="failed to copy: %s to %s" % (src, dest))
         changed = True
     else:
         changed = False
 
     res_args = dict(
-        dest = dest, src = src, md5sum = md5sum_src, checksum = checksum_src, changed = changed
+        dest = dest, src = src, md5sum = digests_src['md5'], checksum = digests_src['sha1'], changed = changed
     )
+    if checksum_algorithm != 'sha1':
+        res_args['%ssum' % checksum_algorithm] = digests_src[checksum_algorithm]
     if backup_file:
         res_args['backup_file'] = backup_file
+    if delta_stats is not None:
+        res_args['delta'] = delta_stats
 
-    module.params['dest'] = dest
-    file_args = module.load_file_common_arguments(module.params)
-    res_args['changed'] = module.set_fs_attributes_if_different(file_args, res_args['changed'])
+    if not module.check_mode or os.path.exists(dest):
+        module.params['dest'] = dest
+        file_args = module.load_file_common_arguments(module.params)
+        res_args['changed'] = module.set_fs_attributes_if_different(file_args, res_args['changed'])
+
+    if cache is not None and not module.check_mode and remember_checksum(cache, dest, digests_src['sha1']):
+        save_checksum_cache(checksum_cache, cache)
 
     module.exit_json(**res_args)
 
 # import module snippets
 from ansible.module_utils.basic import *
-main()
+
+if __name__ == '__main__':
+    main()
@@ -19,10 +19,10 @@
 # along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
 
 import errno
-import shutil
 import stat
 import grp
 import pwd
+import threading
 try:
     import selinux
     HAVE_SELINUX=True
@@ -49,9 +49,21 @@ options:
   path:
     description:
       - 'path to the file being managed.  Aliases: I(dest), I(name)'
-    required: true
+      - Required unless C(paths) is used.
+    required: false
     default: []
     aliases: ['dest', 'name']
+  paths:
+    description:
+      - A list of paths to manage in one run, instead of C(path), with C(state) set to
+        C(directory), C(touch), C(link) or C(hard). Items are either paths or dictionaries with a
+        C(path) key and optional C(state), C(src), C(mode), C(owner) and C(group) keys overriding
+        the module options for that path. The module level C(mode) is not applied to links.
+        Paths are processed in the order given, missing parent directories of C(directory) items
+        are created, and the changed status of each path is returned in C(results).
+    required: false
+    default: null
+    version_added: "2.1"
   state:
     description:
       - If C(directory), all immediate subdirectories will be created if they
@@ -79,6 +91,26 @@ options:
     version_added: "1.1"
     description:
       - recursively set the specified file attributes (applies only to state=directory)
+      - When only C(owner), C(group) and an octal C(mode) are given, each entry below C(path) is
+        checked with a single lstat and only changed on a mismatch, from a pool of C(workers)
+        threads. The number of entries examined and changed is returned in C(recurse_examined)
+        and C(recurse_changed).
+  workers:
+    required: false
+    default: 4
+    version_added: "2.1"
+    description:
+      - Number of threads used to apply attributes to directories with C(recurse), and to
+        remove the contents of directories with C(state=absent).
+  remove_in_background:
+    required: false
+    default: "no"
+    choices: [ "yes", "no" ]
+    version_added: "2.1"
+    description:
+      - With C(state=absent), rename a directory to a hidden name next to it and remove it from a
+        detached background process, so the task returns as soon as C(path) is gone. The temporary
+        name is returned as C(removing). Failures of the background removal are not reported.
   force:
     required: false
     default: "no"
@@ -107,6 +139,20 @@ EXAMPLES = '''
 # create a directory if it doesn't exist
 - file: path=/etc/some_directory state=directory mode=0755
 
+# create several directories and links in one task
+- file:
+    state: directory
+    owner: app
+    mode: 0755
+    paths:
+      - /srv/app
+      - /srv/app/releases
+      - /srv/app/shared
+      - { path: /srv/app/current, state: link, src: /srv/app/releases/1.0 }
+
+# remove a large cache directory without waiting for it to be deleted
+- file: path=/var/cache/app state=absent remove_in_background=yes
+
 '''
 
 
@@ -148,24 +194,459 @@ def recursive_set_attributes(module, path, follow, file_args):
                     changed |= module.set_fs_attributes_if_different(tmp_file_args, changed)
     return changed
 
+def parallel_walk(roots, visit, workers):
+    '''
+    Call visit(dirpath) for the roots and for every directory visit returns,
+    from a pool of worker threads. The first exception visit raises is
+    raised once the walk is over.
+    '''
+    pending = list(roots)
+    # the number of directories being visited, which may still add to pending
+    busy = [0]
+    done = threading.Condition()
+    errors = []
+
+    def worker():
+        while True:
+            done.acquire()
+            try:
+                while not pending and busy[0]:
+                    done.wait()
+                if not pending:
+                    return
+                dirpath = pending.pop()
+                busy[0] += 1
+            finally:
+                done.release()
+            subdirs = []
+            try:
+                try:
+                    subdirs = visit(dirpath)
+                except Exception, e:
+                    errors.append(e)
+            finally:
+                done.acquire()
+                try:
+                    pending.extend(subdirs)
+                    busy[0] -= 1
+                    done.notifyAll()
+                finally:
+                    done.release()
+
+    threads = []
+    for i in range(max(1, workers)):
+        t = threading.Thread(target=worker)
+        t.setDaemon(True)
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+
+def parallel_rmtree(path, workers):
+    '''
+    Remove a directory tree. The contents of directories are unlinked from a
+    pool of worker threads, then the emptied directories are removed deepest
+    first. Returns a list of errors.
+    '''
+    dirs = [(0, path)]
+    errors = []
+    lock = threading.Lock()
+
+    def visit(item):
+        (depth, dirpath) = item
+        subdirs = []
+        try:
+            names = os.listdir(dirpath)
+        except OSError, e:
+            errors.append('%s: %s' % (dirpath, e.strerror))
+            return subdirs
+        for name in names:
+            fsname = os.path.join(dirpath, name)
+            try:
+                if stat.S_ISDIR(os.lstat(fsname).st_mode):
+                    subdirs.append((depth + 1, fsname))
+                else:
+                    os.unlink(fsname)
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    errors.append('%s: %s' % (fsname, e.strerror))
+        lock.acquire()
+        try:
+            dirs.extend(subdirs)
+        finally:
+            lock.release()
+        return subdirs
+
+    parallel_walk([(0, path)], visit, workers)
+    if errors:
+        return errors
+
+    dirs.sort()
+    dirs.reverse()
+    for (depth, dirpath) in dirs:
+        try:
+            os.rmdir(dirpath)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                errors.append('%s: %s' % (dirpath, e.strerror))
+    return errors
+
+def rmtree_in_background(path, workers):
+    '''
+    Rename a directory out of the way and remove it from a detached process.
+    Returns the temporary name the directory is being removed under.
+    '''
+    tmppath = os.path.join(os.path.dirname(path), ".%s.%s.%s.removing" % (os.path.basename(path), os.getpid(), time.time()))
+    os.rename(path, tmppath)
+
+    # double fork so the removal is not a child of the module, and detach it
+    # from the output the connection plugin waits on
+    pid = os.fork()
+    if pid:
+        os.waitpid(pid, 0)
+        return tmppath
+    try:
+        os.setsid()
+        if os.fork():
+            os._exit(0)
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        parallel_rmtree(tmppath, workers)
+    finally:
+        os._exit(0)
+
+class RecursiveAttributes(object):
+    '''
+    Enforce a precomputed uid, gid and octal mode on everything below a
+    directory. Each entry costs one lstat, and lchown/chmod are only called
+    on a mismatch. Directories are processed by a pool of worker threads.
+    '''
+
+    def __init__(self, uid, gid, mode, follow, check_mode):
+        self.uid = uid
+        self.gid = gid
+        self.mode = mode
+        self.follow = follow
+        self.check_mode = check_mode
+        self.examined = 0
+        self.changed = 0
+        self.errors = []
+        self.seen = set()
+        self.lock = threading.Lock()
+
+    def first_visit(self, st):
+        '''guard against symlink loops when following links'''
+        self.lock.acquire()
+        try:
+            key = (st.st_dev, st.st_ino)
+            if key in self.seen:
+                return False
+            self.seen.add(key)
+            return True
+        finally:
+            self.lock.release()
+
+    def fix(self, path, st):
+        '''bring one entry in line, returns True if it had to be changed'''
+        changed = False
+        uid = -1
+        gid = -1
+        if self.uid is not None and st.st_uid != self.uid:
+            uid = self.uid
+        if self.gid is not None and st.st_gid != self.gid:
+            gid = self.gid
+        if uid != -1 or gid != -1:
+            changed = True
+            if not self.check_mode:
+                os.lchown(path, uid, gid)
+
+        if self.mode is not None and stat.S_IMODE(st.st_mode) != self.mode:
+            if not stat.S_ISLNK(st.st_mode):
+                changed = True
+                if not self.check_mode:
+                    os.chmod(path, self.mode)
+            elif hasattr(os, 'lchmod') and not self.check_mode:
+                # most platforms have no permissions on links themselves
+                try:
+                    os.lchmod(path, self.mode)
+                    changed = True
+                except OSError, e:
+                    if e.errno not in (errno.ENOTSUP, errno.EOPNOTSUPP):
+                        raise
+        return changed
+
+    def visit(self, dirpath):
+        examined = 0
+        changed = 0
+        errors = []
+        subdirs = []
+        try:
+            names = os.listdir(dirpath)
+        except OSError, e:
+            names = []
+            errors.append('%s: %s' % (dirpath, e.strerror))
+
+        for name in names:
+            fsname = os.path.join(dirpath, name)
+            try:
+                st = os.lstat(fsname)
+                examined += 1
+                if self.fix(fsname, st):
+                    changed += 1
+                if stat.S_ISDIR(st.st_mode):
+                    if not self.follow or self.first_visit(st):
+                        subdirs.append(fsname)
+                elif stat.S_ISLNK(st.st_mode) and self.follow:
+                    target = os.path.join(dirpath, os.readlink(fsname))
+                    target_st = os.stat(target)
+                    examined += 1
+                    if self.fix(target, target_st):
+                        changed += 1
+                    if stat.S_ISDIR(target_st.st_mode) and self.first_visit(target_st):
+                        subdirs.append(target)
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    errors.append('%s: %s' % (fsname, e.strerror))
+
+        self.lock.acquire()
+        try:
+            self.examined += examined
+            self.changed += changed
+            self.errors.extend(errors)
+        finally:
+            self.lock.release()
+        return subdirs
+
+    def run(self, path, workers):
+        if self.follow:
+            self.first_visit(os.stat(path))
+        parallel_walk([path], self.visit, workers)
+
+def fast_recursive_attributes(module, file_args):
+    '''
+    Return a RecursiveAttributes for file_args, or None when they need the
+    generic code path (symbolic modes or SELinux contexts).
+    '''
+    for context in file_args.get('secontext') or []:
+        if context is not None:
+            return None
+
+    mode = file_args['mode']
+    if mode is not None and not isinstance(mode, int):
+        try:
+            mode = int(mode, 8)
+        except ValueError:
+            return None
+
+    uid = None
+    owner = file_args['owner']
+    if owner is not None:
+        try:
+            uid = int(owner)
+        except ValueError:
+            try:
+                uid = pwd.getpwnam(owner).pw_uid
+            except KeyError:
+                module.fail_json(path=file_args['path'], msg='chown failed: failed to look up user %s' % owner)
+
+    gid = None
+    group = file_args['group']
+    if group is not None:
+        try:
+            gid = int(group)
+        except ValueError:
+            try:
+                gid = grp.getgrnam(group).gr_gid
+            except KeyError:
+                module.fail_json(path=file_args['path'], msg='chgrp failed: failed to look up group %s' % group)
+
+    return RecursiveAttributes(uid, gid, mode, module.params['follow'], module.check_mode)
+
+BATCH_STATES = ['directory', 'touch', 'link', 'hard']
+
+def batch_directory(module, path, file_args):
+    '''create path and any missing parents, returns whether anything changed'''
+    prev_state = get_state(path)
+    if prev_state == 'directory':
+        return module.set_fs_attributes_if_different(file_args, False)
+    if prev_state != 'absent':
+        raise ValueError('%s already exists as a %s' % (path, prev_state))
+    if module.check_mode:
+        return True
+
+    missing = []
+    curpath = path
+    while curpath and not os.path.exists(curpath):
+        missing.insert(0, curpath)
+        curpath = os.path.dirname(curpath)
+    for curpath in missing:
+        try:
+            os.mkdir(curpath)
+        except OSError, e:
+            if not (e.errno == errno.EEXIST and os.path.isdir(curpath)):
+                raise
+        tmp_file_args = file_args.copy()
+        tmp_file_args['path'] = curpath
+        module.set_fs_attributes_if_different(tmp_file_args, True)
+    return True
+
+def batch_touch(module, path, file_args):
+    '''create path or update its timestamps, which always counts as a change'''
+    prev_state = get_state(path)
+    if prev_state not in ['absent', 'file', 'directory', 'hard']:
+        raise ValueError('Cannot touch other than files, directories, and hardlinks (%s is %s)' % (path, prev_state))
+    if not module.check_mode:
+        if prev_state == 'absent':
+            open(path, 'w').close()
+        else:
+            os.utime(path, None)
+        module.set_fs_attributes_if_different(file_args, True)
+    return True
+
+def batch_link(module, path, src, state, file_args):
+    '''create or replace a symbolic or hard link at path'''
+    if src is None:
+        raise ValueError('src is required for creating links')
+    force = module.params['force']
+    # a relative src is relative to a directory path, as in single path mode
+    if os.path.isdir(path) and not os.path.islink(path):
+        relpath = path
+    else:
+        relpath = os.path.dirname(path)
+    absrc = os.path.join(relpath, src)
+    if not os.path.exists(absrc) and not force:
+        raise ValueError('src file does not exist, use "force=yes" if you really want to create the link: %s' % absrc)
+
+    prev_state = get_state(path)
+    if state == 'hard':
+        if not os.path.isabs(src):
+            raise ValueError('absolute paths are required')
+    elif prev_state == 'directory':
+        if not force:
+            raise ValueError('refusing to convert between %s and %s for %s' % (prev_state, state, path))
+        elif len(os.listdir(path)) > 0:
+            raise ValueError('the directory %s is not empty, refusing to convert it' % path)
+    elif prev_state in ['file', 'hard'] and not force:
+        raise ValueError('refusing to convert between %s and %s for %s' % (prev_state, state, path))
+
+    if prev_state == 'absent':
+        changed = True
+    elif prev_state == 'link':
+        changed = os.readlink(path) != src
+    elif prev_state == 'hard':
+        changed = not (state == 'hard' and os.stat(path).st_ino == os.stat(src).st_ino)
+        if changed and not force:
+            raise ValueError('Cannot link, different hard link exists at destination: %s' % path)
+    elif prev_state in ['file', 'directory']:
+        changed = True
+        if not force:
+            raise ValueError('Cannot link, %s exists at destination: %s' % (prev_state, path))
+    else:
+        raise ValueError('unexpected position reached for %s' % path)
+
+    if changed and not module.check_mode:
+        # replace atomically
+        tmppath = os.path.join(os.path.dirname(path), ".%s.%s.tmp" % (os.getpid(), time.time()))
+        try:
+            if prev_state == 'directory':
+                os.rmdir(path)
+            if state == 'hard':
+                os.link(src, tmppath)
+            else:
+                os.symlink(src, tmppath)
+            os.rename(tmppath, path)
+        except OSError:
+            if os.path.lexists(tmppath):
+                os.unlink(tmppath)
+            raise
+
+    if module.check_mode and not os.path.lexists(path):
+        return changed
+    return module.set_fs_attributes_if_different(file_args, changed)
+
+def batch_paths(module):
+    '''apply state and attributes to every item of paths and exit'''
+    params = module.params
+    items = []
+    for item in params['paths']:
+        if not isinstance(item, dict):
+            item = dict(path=item)
+        if not item.get('path'):
+            module.fail_json(msg="each item in paths needs a path: %s" % item)
+        item = item.copy()
+        item['path'] = os.path.expanduser(item['path'])
+        item['state'] = item.get('state') or params['state'] or 'directory'
+        if item['state'] not in BATCH_STATES:
+            module.fail_json(msg="state must be one of %s with paths, got %s for %s" % (', '.join(BATCH_STATES), item['state'], item['path']))
+        items.append(item)
+
+    results = []
+    failed = False
+    for item in items:
+        path = item['path']
+        state = item['state']
+        params['path'] = path
+        file_args = module.load_file_common_arguments(params)
+        file_args['path'] = path
+        if state in ['link', 'hard']:
+            # a mode meant for the directories and files of the batch is
+            # not applied to links unless the item asks for it
+            file_args['mode'] = None
+        for key in ('mode', 'owner', 'group'):
+            if item.get(key) is not None:
+                file_args[key] = item[key]
+
+        result = dict(path=path, state=state)
+        try:
+            if state == 'directory':
+                result['changed'] = batch_directory(module, path, file_args)
+            elif state == 'touch':
+                result['changed'] = batch_touch(module, path, file_args)
+            else:
+                src = item.get('src', params['src'])
+                if src is not None:
+                    src = os.path.expanduser(src)
+                result['src'] = src
+                result['changed'] = batch_link(module, path, src, state, file_args)
+        except (ValueError, IOError, OSError), e:
+            result.update(changed=False, failed=True, msg=str(e))
+            failed = True
+        results.append(result)
+
+    changed = len([ r for r in results if r['changed'] ]) > 0
+    if failed:
+        module.fail_json(msg="one or more paths failed", results=results, changed=changed)
+    module.exit_json(results=results, changed=changed)
+
 def main():
 
     module = AnsibleModule(
         argument_spec = dict(
             state = dict(choices=['file','directory','link','hard','touch','absent'], default=None),
-            path  = dict(aliases=['dest', 'name'], required=True),
+            path  = dict(aliases=['dest', 'name'], required=False),
+            paths = dict(required=False, type='list'),
             original_basename = dict(required=False), # Internal use only, for recursive ops
             recurse  = dict(default=False, type='bool'),
             force = dict(required=False, default=False, type='bool'),
             diff_peek = dict(default=None),
             validate = dict(required=False, default=None),
             src = dict(required=False, default=None),
+            workers = dict(default=4, type='int'),
+            remove_in_background = dict(default=False, type='bool'),
         ),
+        required_one_of=[['path', 'paths']],
+        mutually_exclusive=[['path', 'paths']],
         add_file_common_args=True,
         supports_check_mode=True
     )
 
     params = module.params
+    if params['paths'] is not None:
+        batch_paths(module)
+
     state  = params['state']
     force = params['force']
     diff_peek = params['diff_peek']
@@ -231,11 +712,16 @@ def main():
     if state == 'absent':
         if state != prev_state:
             if not module.check_mode:
-                if prev_state == 'directory':
+                if prev_state == 'directory' and params['remove_in_background']:
                     try:
-                        shutil.rmtree(path, ignore_errors=False)
-                    except Exception, e:
-                        module.fail_json(msg="rmtree failed: %s" % str(e))
+                        tmppath = rmtree_in_background(path, params['workers'])
+                    except OSError, e:
+                        module.fail_json(path=path, msg="moving the directory out of the way failed: %s" % str(e))
+                    module.exit_json(path=path, changed=True, removing=tmppath)
+                elif prev_state == 'directory':
+                    errors = parallel_rmtree(path, params['workers'])
+                    if errors:
+                        module.fail_json(msg="rmtree failed: %s" % '; '.join(errors[:10]))
                 else:
                     try:
                         os.unlink(path)
@@ -303,7 +789,17 @@ def main():
         changed = module.set_fs_attributes_if_different(file_args, changed)
 
         if recurse:
-            changed |= recursive_set_attributes(module, file_args['path'], follow, file_args)
+            engine = fast_recursive_attributes(module, file_args)
+            if engine is None:
+                changed |= recursive_set_attributes(module, file_args['path'], follow, file_args)
+            else:
+                engine.run(file_args['path'], params['workers'])
+                if engine.errors:
+                    module.fail_json(path=path, msg='failed to set attributes: %s' % '; '.join(engine.errors[:10]),
+                                     recurse_examined=engine.examined, recurse_changed=engine.changed)
+                changed |= engine.changed > 0
+                module.exit_json(path=path, changed=changed,
+                                 recurse_examined=engine.examined, recurse_changed=engine.changed)
 
         module.exit_json(path=path, changed=changed)
 
@@ -25,6 +25,22 @@ import stat
 import fnmatch
 import time
 import re
+import heapq
+import threading
+import Queue
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 DOCUMENTATION = '''
 ---
@@ -52,11 +68,37 @@ options:
             - The patterns restrict the list of files to be returned to those whose basenames match at
               least one of the patterns specified. Multiple patterns can be specified using a list.
         aliases: ['pattern']
+    excludes:
+        required: false
+        default: null
+        version_added: "2.1"
+        aliases: ['exclude', 'prune']
+        description:
+            - One or more (shell or regex, see C(use_regex)) patterns matched against basenames.
+              Matching files are not returned and matching directories are neither returned nor
+              descended into, so large uninteresting subtrees (C(.git), C(node_modules), snapshot
+              directories) are never scanned.
     contains:
         required: false
         default: null
         description:
             - One or more re patterns which should be matched against the file content
+            - Files are read in bounded chunks, and the searches run in a pool of C(workers) processes.
+    contains_max_bytes:
+        required: false
+        default: null
+        version_added: "2.1"
+        description:
+            - Only search the first part of each file for C(contains), up to this size. Accepts
+              the same units as C(size). By default whole files are searched.
+    contains_skip_binary:
+        required: false
+        default: "False"
+        choices: [ True, False ]
+        version_added: "2.1"
+        description:
+            - Do not search files for C(contains) when they look binary, that is when a NUL byte
+              appears near the start of the file.
     paths:
         required: true
         aliases: [ "name", "path" ]
@@ -74,6 +116,51 @@ options:
         choices: [ "yes", "no" ]
         description:
             - If target is a directory, recursively descend into the directory looking for files.
+    max_depth:
+        required: false
+        default: null
+        version_added: "2.1"
+        description:
+            - Maximum number of directory levels to descend when C(recurse) is set, counting the
+              contents of each path as level 1. By default there is no limit.
+    limit:
+        required: false
+        default: null
+        version_added: "2.1"
+        description:
+            - Return at most this many matches, the first ones in the order of C(sort_by), or by path
+              when it is not set. They are kept in a bounded heap while walking, so memory use does
+              not grow with the number of matches. With 0 no files are returned, and only C(matched)
+              is counted.
+    sort_by:
+        required: false
+        default: null
+        choices: [ "path", "size", "mtime", "atime", "ctime" ]
+        version_added: "2.1"
+        description:
+            - Order the returned files by this property. Files are ordered by path by default.
+    sort_order:
+        required: false
+        default: "ascending"
+        choices: [ "ascending", "descending" ]
+        version_added: "2.1"
+        description:
+            - Direction of C(sort_by), and so which end of the order C(limit) keeps.
+    fields:
+        required: false
+        default: null
+        version_added: "2.1"
+        description:
+            - Only return these keys for each file (for example C(mtime) or C(size)), to keep the
+              result small. C(path) is always returned. By default all stat keys are returned.
+    workers:
+        required: false
+        default: 4
+        version_added: "2.1"
+        description:
+            - Number of threads used to walk directories concurrently. Each directory found while
+              recursing is handed to the next free thread, so both multiple C(paths) and deep trees
+              are scanned in parallel.
     size:
         required: false
         default: null
@@ -106,7 +193,38 @@ options:
         default: "False"
         choices: [ True, False ]
         description:
-            - Set this to true to retrieve a file's sha1 checksum
+            - Set this to true to retrieve a file's checksum (sha1 by default)
+            - Matched files are hashed concurrently, see C(checksum_workers).
+    checksum_algorithm:
+        required: false
+        default: sha1
+        choices: [ 'sha1', 'sha224', 'sha256', 'sha384', 'sha512' ]
+        aliases: [ 'checksum_algo' ]
+        version_added: "2.1"
+        description:
+            - Algorithm used for C(get_checksum). Will fail if the host is unable to use it.
+    checksum_max_size:
+        required: false
+        default: null
+        version_added: "2.1"
+        description:
+            - Do not fully hash files larger than this, using the same units as C(size). Such files
+              get no checksum, unless C(checksum_sample) is set.
+    checksum_sample:
+        required: false
+        default: "False"
+        choices: [ True, False ]
+        version_added: "2.1"
+        description:
+            - For files above C(checksum_max_size), return a checksum of the file size and of
+              64KB blocks from its start, middle and end, and set C(checksum_sampled) on the file.
+              Sampled checksums only detect changes within those blocks or to the size.
+    checksum_workers:
+        required: false
+        default: null
+        version_added: "2.1"
+        description:
+            - Number of files hashed concurrently for C(get_checksum). Defaults to C(workers).
     use_regex:
         required: false
         default: "False"
@@ -120,6 +238,9 @@ EXAMPLES = '''
 # Recursively find /tmp files older than 2 days
 - find: paths="/tmp" age="2d" recurse=yes
 
+# Find /var/log files at most two directory levels deep
+- find: paths="/var/log" recurse=yes max_depth=2
+
 # Recursively find /tmp files older than 4 weeks and equal or greater than 1 megabyte
 - find: paths="/tmp" age="4w" size="1m" recurse=yes
 
@@ -129,6 +250,12 @@ EXAMPLES = '''
 # find /var/log files equal or greater than 10 megabytes ending with .old or .log.gz
 - find: paths="/var/tmp" patterns="'*.old','*.log.gz'" size="10m"
 
+# find logs older than a week under /var without descending into docker or .git directories
+- find: paths="/var" patterns="*.log" age="7d" recurse=yes excludes="docker,.git"
+
+# find the 10 oldest backups, returning only their path and mtime
+- find: paths="/srv/backups" patterns="*.tar.gz" recurse=yes sort_by=mtime limit=10 fields=mtime
+
 # find /var/log files equal or greater than 10 megabytes ending with .old or .log.gz via regex
 - find: paths="/var/tmp" patterns="^.*?\.(?:old|log\.gz)$" size="10m" use_regex=True
 '''
@@ -149,7 +276,7 @@ files:
         },
         ]
 matched:
-    description: number of matches
+    description: number of files that matched, before limit is applied
     returned: success
     type: string
     sample: 14
@@ -160,23 +287,221 @@ examined:
     sample: 34
 '''
 
-def pfilter(f, patterns=None, use_regex=False):
-    '''filter using glob patterns'''
-
-    if patterns is None:
-        return True
+class DirEntry(object):
+    '''
+    Minimal stand-in for the scandir DirEntry, used when neither os.scandir nor
+    the scandir module is available. Stat results are cached like scandir does.
+    '''
+
+    def __init__(self, dirpath, name):
+        self.name = name
+        self.path = os.path.join(dirpath, name)
+        self._stat = None
+        self._lstat = None
+
+    def stat(self, follow_symlinks=True):
+        if follow_symlinks:
+            if self._stat is None:
+                self._stat = os.stat(self.path)
+            return self._stat
+        if self._lstat is None:
+            self._lstat = os.lstat(self.path)
+        return self._lstat
+
+    def is_symlink(self):
+        try:
+            return stat.S_ISLNK(self.stat(follow_symlinks=False).st_mode)
+        except OSError:
+            return False
+
+    def is_file(self, follow_symlinks=True):
+        try:
+            return stat.S_ISREG(self.stat(follow_symlinks=follow_symlinks).st_mode)
+        except OSError:
+            return False
+
+    def is_dir(self, follow_symlinks=True):
+        try:
+            return stat.S_ISDIR(self.stat(follow_symlinks=follow_symlinks).st_mode)
+        except OSError:
+            return False
+
+
+def scan(dirpath):
+    '''return the entries of a directory, with cached type and stat information'''
+    if scandir is not None:
+        return list(scandir(dirpath))
+    return [ DirEntry(dirpath, name) for name in os.listdir(dirpath) ]
+
+
+def parallel_walk(roots, visit, workers):
+    '''
+    Call visit(dirpath, depth) for the roots and every directory visit returns,
+    using a pool of worker threads. visit returns a list of (dirpath, depth)
+    tuples to descend into.
+    '''
+    pending = [ (root, 1) for root in roots ]
+    # the number of directories being visited, which may still add to pending
+    busy = [0]
+    done = threading.Condition()
+    errors = []
+
+    def worker():
+        while True:
+            done.acquire()
+            try:
+                while not pending and busy[0]:
+                    done.wait()
+                if not pending:
+                    return
+                item = pending.pop()
+                busy[0] += 1
+            finally:
+                done.release()
+            children = []
+            try:
+                try:
+                    children = visit(*item)
+                except Exception, e:
+                    errors.append(e)
+            finally:
+                done.acquire()
+                try:
+                    pending.extend(children)
+                    busy[0] -= 1
+                    done.notifyAll()
+                finally:
+                    done.release()
+
+    threads = []
+    for i in range(max(1, workers)):
+        t = threading.Thread(target=worker)
+        t.setDaemon(True)
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+
+
+BACKREFERENCE = re.compile(r'\\\d|\(\?P=')
+INLINE_FLAGS = re.compile(r'\(\?[aiLmsux]')
+
+def compile_patterns(patterns, use_regex=False):
+    '''
+    Return a list of compiled regexes for glob or regex patterns, usually a
+    single one combining all of them, or None if the patterns match
+    everything.
+    '''
+
+    if not patterns:
+        return None
 
     if use_regex:
         for p in patterns:
-            r =  re.compile(p)
-            if r.match(f):
-                return True
-    else:
-
-        for p in patterns:
-            if fnmatch.fnmatch(f, p):
-                return True
+            if BACKREFERENCE.search(p) or INLINE_FLAGS.search(p):
+                # flags and group numbers would leak into the other patterns
+                return [ re.compile(p) for p in patterns ]
+        return [ re.compile('|'.join([ '(?:%s)' % p for p in patterns ])) ]
+
+    if '*' in patterns:
+        return None
+    regexes = []
+    for p in patterns:
+        r = fnmatch.translate(p)
+        # python 2 appends the flags, which are applied to the whole pattern below
+        if r.endswith('(?ms)'):
+            r = r[:-5]
+        regexes.append(r)
+
+    return [ re.compile('|'.join([ '(?:%s)' % regex for regex in regexes ]), re.M | re.S) ]
+
+
+SORT_KEYS = {
+    'path'  : lambda path, st: path,
+    'size'  : lambda path, st: st.st_size,
+    'mtime' : lambda path, st: st.st_mtime,
+    'atime' : lambda path, st: st.st_atime,
+    'ctime' : lambda path, st: st.st_ctime,
+}
+
+
+class Inverted(object):
+    '''wraps a heap item so that heapq keeps the largest item at the root'''
+
+    __slots__ = ('item',)
+
+    def __init__(self, item):
+        self.item = item
+
+    def __lt__(self, other):
+        return other.item < self.item
+
+    def __le__(self, other):
+        return other.item <= self.item
+
+
+class Collector(object):
+    '''
+    Thread safe accumulator of (path, stat) matches. With a limit only the
+    first matches in sort order, by path unless a sort key is given, are
+    kept in a heap bounded by the limit, so which matches are kept does not
+    depend on the order threads find them in.
+    '''
+
+    def __init__(self, limit=None, sort_by=None, descending=False):
+        self.limit = limit
+        self.descending = descending
+        self.key = SORT_KEYS[sort_by or 'path']
+        self.items = []
+        self.matched = 0
+        self.lock = threading.Lock()
+
+    def add(self, found):
+        self.lock.acquire()
+        try:
+            for (path, st) in found:
+                self.matched += 1
+                item = (self.key(path, st), path, st)
+                if self.limit is None:
+                    self.items.append(item)
+                elif self.limit == 0:
+                    # only counted
+                    pass
+                elif len(self.items) < self.limit:
+                    if self.descending:
+                        heapq.heappush(self.items, item)
+                    else:
+                        heapq.heappush(self.items, Inverted(item))
+                elif self.descending:
+                    if item > self.items[0]:
+                        heapq.heapreplace(self.items, item)
+                elif item < self.items[0].item:
+                    heapq.heapreplace(self.items, Inverted(item))
+        finally:
+            self.lock.release()
+
+    def results(self):
+        '''the collected (path, stat) matches in sort order'''
+        items = self.items
+        if self.limit is not None and not self.descending:
+            items = [ i.item for i in items ]
+        items.sort()
+        if self.descending:
+            items.reverse()
+        return [ (path, st) for (key, path, st) in items ]
+
+
+def pfilter(f, matcher=None):
+    '''filter using a matcher from compile_patterns'''
+
+    if matcher is None:
+        return True
 
+    for r in matcher:
+        if r.match(f):
+            return True
     return False
 
 
@@ -200,24 +525,192 @@ def sizefilter(st, size):
 
     return False
 
-def contentfilter(fsname, pattern):
-    '''filter files which contain the given expression'''
-    if pattern is None: return True
+CHUNK_SIZE = 1024 * 1024
+MAX_LINE_OVERLAP = 64 * 1024
+BINARY_PROBE_SIZE = 8192
+
+
+def line_match(prog, quick, buf, start, end):
+    '''
+    whether a line of buf[start:end], which starts and ends on line
+    boundaries, starts with a match of prog. quick, the same pattern anchored
+    at each line with re.M, skips in one search the lines that cannot match.
+    '''
+    pos = start
+    while pos < end:
+        if quick is not None:
+            m = quick.search(buf, pos, end)
+            # past the last newline there is no line left
+            if m is None or m.start() == end:
+                return False
+            pos = m.start()
+        stop = buf.find('\n', pos, end) + 1 or end
+        if prog.match(buf[pos:stop]):
+            return True
+        pos = stop
+    return False
+
+
+def contentfilter(fsname, prog, quick=None, max_bytes=None, skip_binary=False):
+    '''
+    filter files with a line starting with a match of prog, reading the
+    file in bounded chunks. Each line is matched on its own, as when the file
+    was read line by line.
+    '''
+    if prog is None: return True
+
+    try:
+        f = open(fsname, 'rb')
+    except (IOError, OSError):
+        return False
 
     try:
-       f = open(fsname)
-       prog = re.compile(pattern)
-       for line in f:
-           if prog.match (line):
-               f.close()
-               return True
+        read = 0
+        tail = ''
+        in_long_line = False
+        while max_bytes is None or read < max_bytes:
+            size = CHUNK_SIZE
+            if max_bytes is not None:
+                size = min(size, max_bytes - read)
+            chunk = f.read(size)
+            if not chunk:
+                break
+            if read == 0 and skip_binary and '\0' in chunk[:BINARY_PROBE_SIZE]:
+                return False
+            read += len(chunk)
+
+            # the incomplete last line of the previous chunk is searched
+            # together with its continuation
+            buf = tail + chunk
+            pos = 0
+            if in_long_line:
+                pos = buf.find('\n') + 1
+                if pos == 0:
+                    continue
+                in_long_line = False
+            end = buf.rfind('\n') + 1
+            if end > pos and line_match(prog, quick, buf, pos, end):
+                return True
 
-       f.close() 
-    except:
-       pass
+            tail = buf[max(pos, end):]
+            if len(tail) > MAX_LINE_OVERLAP:
+                # lines this long are not carried over, only their start
+                # is searched
+                if line_match(prog, quick, tail, 0, len(tail)):
+                    return True
+                tail = ''
+                in_long_line = True
+
+        # the last line, without a newline
+        if tail and line_match(prog, quick, tail, 0, len(tail)):
+            return True
+    finally:
+        f.close()
 
     return False
 
+
+def contentfilter_worker(args):
+    '''run contentfilter in a pool process'''
+    return contentfilter(*args)
+
+
+def contentfilter_all(fsnames, prog, quick, max_bytes, skip_binary, workers):
+    '''
+    run contentfilter on every file, spread over a pool of processes when
+    there is more than one worker and multiprocessing is available
+    '''
+    jobs = [ (fsname, prog, quick, max_bytes, skip_binary) for fsname in fsnames ]
+    if workers > 1 and len(jobs) > 1 and multiprocessing is not None:
+        try:
+            pool = multiprocessing.Pool(min(workers, len(jobs)))
+        except (OSError, ImportError):
+            pool = None
+        if pool is not None:
+            try:
+                return pool.map(contentfilter_worker, jobs, max(1, len(jobs) // (workers * 4)))
+            finally:
+                pool.terminate()
+    return [ contentfilter_worker(job) for job in jobs ]
+
+def parse_size(value):
+    '''convert a size with an optional b, k, m, g or t unit to bytes, None if invalid'''
+    m = re.match("^(-?\d+)(b|k|m|g|t)?$", value.lower())
+    bytes_per_unit = {"b": 1, "k": 1024, "m": 1024**2, "g": 1024**3, "t": 1024**4}
+    if not m:
+        return None
+    return int(m.group(1)) * bytes_per_unit.get(m.group(2), 1)
+
+
+HASH_BLOCK_SIZE = 64 * 1024
+
+
+def checksum(fsname, algorithm, max_size=None, sample=False):
+    '''
+    digest of a file, or None if it cannot be read. Files larger than max_size
+    are skipped, or when sample is set only their size and a block from the
+    start, middle and end are hashed. Returns the digest and whether it was
+    sampled.
+    '''
+    digest = AVAILABLE_HASH_ALGORITHMS[algorithm]()
+    try:
+        f = open(fsname, 'rb')
+    except (IOError, OSError):
+        return (None, False)
+
+    try:
+        size = os.fstat(f.fileno()).st_size
+        if max_size is not None and size > max_size:
+            if not sample:
+                return (None, False)
+            digest.update(str(size))
+            for offset in (0, size // 2, max(0, size - HASH_BLOCK_SIZE)):
+                f.seek(offset)
+                digest.update(f.read(HASH_BLOCK_SIZE))
+            return (digest.hexdigest(), True)
+
+        block = f.read(HASH_BLOCK_SIZE)
+        while block:
+            digest.update(block)
+            block = f.read(HASH_BLOCK_SIZE)
+    finally:
+        f.close()
+
+    return (digest.hexdigest(), False)
+
+
+def run_in_pool(func, items, workers):
+    '''
+    call func on every matched file from a pool of threads, returning the
+    results in order, with any exception func raised in place of its result
+    '''
+    results = [None] * len(items)
+    pending = Queue.Queue()
+    for index in range(len(items)):
+        pending.put(index)
+
+    def worker():
+        while True:
+            try:
+                index = pending.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[index] = func(items[index])
+            except Exception, e:
+                results[index] = e
+
+    threads = []
+    for i in range(max(1, min(workers, len(items)))):
+        t = threading.Thread(target=worker)
+        t.setDaemon(True)
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+    return results
+
+
 def statinfo(st):
     return {
         'mode'     : "%04o" % stat.S_IMODE(st.st_mode),
@@ -257,6 +750,8 @@ def main():
             paths         = dict(required=True, aliases=['name','path'], type='list'),
             patterns      = dict(default=['*'], type='list', aliases=['pattern']),
             contains      = dict(default=None, type='str'),
+            contains_max_bytes = dict(default=None, type='str'),
+            contains_skip_binary = dict(default=False, type='bool'),
             file_type     = dict(default="file", choices=['file', 'directory'], type='str'),
             age           = dict(default=None, type='str'),
             age_stamp     = dict(default="mtime", choices=['atime','mtime','ctime'], type='str'),
@@ -265,7 +760,18 @@ def main():
             hidden        = dict(default="False", type='bool'),
             follow        = dict(default="False", type='bool'),
             get_checksum  = dict(default="False", type='bool'),
+            checksum_algorithm = dict(default='sha1', type='str', choices=['sha1', 'sha224', 'sha256', 'sha384', 'sha512'], aliases=['checksum_algo']),
+            checksum_max_size = dict(default=None, type='str'),
+            checksum_sample = dict(default=False, type='bool'),
+            checksum_workers = dict(default=None, type='int'),
             use_regex     = dict(default="False", type='bool'),
+            excludes      = dict(default=None, type='list', aliases=['exclude', 'prune']),
+            max_depth     = dict(default=None, type='int'),
+            limit         = dict(default=None, type='int'),
+            sort_by       = dict(default=None, choices=['path', 'size', 'mtime', 'atime', 'ctime'], type='str'),
+            sort_order    = dict(default='ascending', choices=['ascending', 'descending'], type='str'),
+            fields        = dict(default=None, type='list'),
+            workers       = dict(default=4, type='int'),
         ),
         supports_check_mode=True,
     )
@@ -288,63 +794,178 @@ def main():
     if params['size'] is None:
         size = None
     else:
-        # convert size to bytes:
-        m = re.match("^(-?\d+)(b|k|m|g|t)?$", params['size'].lower())
-        bytes_per_unit = {"b": 1, "k": 1024, "m": 1024**2, "g": 1024**3, "t": 1024**4}
-        if m:
-            size = int(m.group(1)) * bytes_per_unit.get(m.group(2), 1)
-        else:
+        size = parse_size(params['size'])
+        if size is None:
             module.fail_json(size=params['size'], msg="failed to process size")
 
+    if params['contains_max_bytes'] is None:
+        contains_max_bytes = None
+    else:
+        contains_max_bytes = parse_size(params['contains_max_bytes'])
+        if contains_max_bytes is None or contains_max_bytes < 0:
+            module.fail_json(contains_max_bytes=params['contains_max_bytes'], msg="failed to process contains_max_bytes")
+
+    if params['limit'] is not None and params['limit'] < 0:
+        module.fail_json(limit=params['limit'], msg="limit must not be negative")
+
+    checksum_algorithm = params['checksum_algorithm']
+    if params['get_checksum'] and checksum_algorithm not in AVAILABLE_HASH_ALGORITHMS:
+        module.fail_json(msg="Could not hash file with the %s algorithm, not available on this host" % checksum_algorithm)
+
+    if params['checksum_max_size'] is None:
+        checksum_max_size = None
+    else:
+        checksum_max_size = parse_size(params['checksum_max_size'])
+        if checksum_max_size is None or checksum_max_size < 0:
+            module.fail_json(checksum_max_size=params['checksum_max_size'], msg="failed to process checksum_max_size")
+
+    try:
+        patterns = compile_patterns(params['patterns'], params['use_regex'])
+        excludes = compile_patterns(params['excludes'], params['use_regex'])
+        contains = None
+        contains_quick = None
+        if params['contains'] is not None:
+            contains = re.compile(params['contains'])
+            # look-behinds and \A would see past the start of the line
+            if '(?<' not in params['contains'] and '\\A' not in params['contains']:
+                contains_quick = re.compile('^(?:%s)' % params['contains'], re.M)
+    except re.error, e:
+        module.fail_json(msg="invalid pattern: %s" % str(e))
+
     now = time.time()
     msg = ''
-    looked = 0
-    for npath in params['paths']:
-        if os.path.isdir(npath):
-
-            ''' ignore followlinks for python version < 2.6 '''
-            for root,dirs,files in (sys.version_info < (2,6,0) and os.walk(npath)) or \
-                                    os.walk( npath, followlinks=params['follow']):
-                looked = looked + len(files) + len(dirs)
-                for fsobj in (files + dirs):
-                    fsname=os.path.normpath(os.path.join(root, fsobj))
 
-                    if os.path.basename(fsname).startswith('.') and not params['hidden']:
-                       continue
+    max_depth = params['max_depth']
+    if not params['recurse']:
+        max_depth = 1
 
+    # file contents are only checked after the walk, so the limit has to be
+    # applied once that is done
+    if contains is None:
+        collector = Collector(params['limit'], params['sort_by'], params['sort_order'] == 'descending')
+    else:
+        collector = Collector()
+
+    def visit(dirpath, depth):
+        try:
+            entries = scan(dirpath)
+        except OSError:
+            return []
+
+        found = []
+        skipped = ''
+        subdirs = []
+        # filters run cheapest first: names, then the file type scandir
+        # already knows, then stat based filters, then file contents
+        for entry in entries:
+            if excludes is not None and pfilter(entry.name, excludes):
+                continue
+
+            if (max_depth is None or depth < max_depth) and entry.is_dir() and \
+               (params['follow'] or not entry.is_symlink()):
+                subdirs.append((entry.path, depth + 1))
+
+            if entry.name.startswith('.') and not params['hidden']:
+                continue
+
+            if not pfilter(entry.name, patterns):
+                continue
+
+            if params['file_type'] == 'directory':
+                wanted = entry.is_dir()
+            else:
+                wanted = entry.is_file()
+            if not wanted:
+                if entry.is_symlink():
                     try:
-                        st = os.stat(fsname)
-                    except:
-                        msg+="%s was skipped as it does not seem to be a valid file or it cannot be accessed\n" % fsname
-                        continue
-
-                    r = {'path': fsname}
-                    if stat.S_ISDIR(st.st_mode) and params['file_type'] == 'directory':
-                        if pfilter(fsobj, params['patterns'], params['use_regex']) and agefilter(st, now, age, params['age_stamp']):
-
-                            r.update(statinfo(st))
-                            filelist.append(r)
-
-                    elif stat.S_ISREG(st.st_mode) and params['file_type'] == 'file':
-                        if pfilter(fsobj, params['patterns'], params['use_regex']) and \
-                           agefilter(st, now, age, params['age_stamp']) and \
-                           sizefilter(st, size) and \
-                           contentfilter(fsname, params['contains']):
-
-                            r.update(statinfo(st))
-                            if params['get_checksum']:
-                                r['checksum'] = module.sha1(fsname)
-                            filelist.append(r)
-
-                if not params['recurse']:
-                    break
+                        entry.stat()
+                    except OSError:
+                        skipped += "%s was skipped as it does not seem to be a valid file or it cannot be accessed\n" % entry.path
+                continue
+
+            try:
+                st = entry.stat()
+            except OSError:
+                skipped += "%s was skipped as it does not seem to be a valid file or it cannot be accessed\n" % entry.path
+                continue
+
+            if not agefilter(st, now, age, params['age_stamp']):
+                continue
+
+            if stat.S_ISREG(st.st_mode) and not sizefilter(st, size):
+                continue
+
+            found.append((entry.path, st))
+
+        collector.add(found)
+        lock.acquire()
+        try:
+            results['looked'] += len(entries)
+            results['msg'] += skipped
+        finally:
+            lock.release()
+        return subdirs
+
+    lock = threading.Lock()
+    results = dict(looked=0, msg='')
+    roots = []
+    for npath in params['paths']:
+        if os.path.isdir(npath):
+            roots.append(os.path.normpath(npath))
         else:
             msg+="%s was skipped as it does not seem to be a valid directory or it cannot be accessed\n" % npath
 
-    matched = len(filelist)
+    parallel_walk(roots, visit, params['workers'])
+    looked = results['looked']
+    msg += results['msg']
+    found = collector.results()
+    matched = collector.matched
+
+    if contains is not None:
+        # only regular files have contents to search, other matches are kept
+        to_search = [ path for (path, st) in found if stat.S_ISREG(st.st_mode) ]
+        matches = contentfilter_all(to_search, contains, contains_quick, contains_max_bytes,
+                                    params['contains_skip_binary'], params['workers'])
+        matches = dict(zip(to_search, matches))
+        found = [ (path, st) for (path, st) in found if matches.get(path, True) ]
+        matched = len(found)
+        if params['limit'] is not None:
+            collector = Collector(params['limit'], params['sort_by'], params['sort_order'] == 'descending')
+            collector.add(found)
+            found = collector.results()
+
+    checksums = {}
+    if params['get_checksum']:
+        to_hash = [ path for (path, st) in found if stat.S_ISREG(st.st_mode) ]
+        digests = run_in_pool(lambda path: checksum(path, checksum_algorithm, checksum_max_size, params['checksum_sample']),
+                              to_hash, params['checksum_workers'] or params['workers'])
+        for (path, digest) in zip(to_hash, digests):
+            # a file that fails while it is read gets no checksum, like one
+            # that cannot be opened
+            if isinstance(digest, Exception):
+                digest = (None, False)
+            checksums[path] = digest
+
+    fields = params['fields']
+    filelist = []
+    for (path, st) in found:
+        r = {'path': path}
+        r.update(statinfo(st))
+        if path in checksums:
+            (r['checksum'], sampled) = checksums[path]
+            if sampled:
+                r['checksum_sampled'] = True
+        if fields:
+            keep = ['path']
+            if 'checksum' in fields:
+                keep.append('checksum_sampled')
+            r = dict([ (k, v) for (k, v) in r.items() if k in keep or k in fields ])
+        filelist.append(r)
+
     module.exit_json(files=filelist, changed=False, msg=msg, matched=matched, examined=looked)
 
 # import module snippets
 from ansible.module_utils.basic import *
-main()
 
+if __name__ == '__main__':
+    main()
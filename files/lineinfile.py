@@ -21,6 +21,7 @@
 
 import re
 import os
+import filecmp
 import pipes
 import tempfile
 
@@ -118,6 +119,20 @@ options:
      description:
        - Create a backup file including the timestamp information so you can
          get the original file back if you somehow clobbered it incorrectly.
+  lines:
+     required: false
+     default: null
+     version_added: "2.1"
+     description:
+       - A list of lines to manage in the file with a single read and a single write, instead of
+         C(line) and C(regexp). Each item is either a line, or a dictionary with C(line), C(regexp),
+         C(state), C(insertafter), C(insertbefore) and C(backrefs) keys that work like the module
+         options of the same names. The module options C(state), C(insertafter), C(insertbefore)
+         and C(backrefs) are the defaults of every item. C(validate) and C(backup) run once for
+         the whole set.
+       - Items are applied in order, each one against the file as the items before it left it,
+         as if every item was a task of its own. When several items change the same line the
+         last one wins.
   others:
      description:
        - All arguments accepted by the M(file) module also work here.
@@ -143,16 +158,29 @@ EXAMPLES = r"""
 
 - lineinfile: dest=/opt/jboss-as/bin/standalone.conf regexp='^(.*)Xms(\d+)m(.*)$' line='\1Xms${xms}m\3' backrefs=yes
 
+# Manage several sshd settings with a single rewrite and validation of the file
+- lineinfile:
+    dest: /etc/ssh/sshd_config
+    validate: "sshd -t -f %s"
+    lines:
+      - { regexp: "^PermitRootLogin ", line: "PermitRootLogin no" }
+      - { regexp: "^PasswordAuthentication ", line: "PasswordAuthentication no" }
+      - { regexp: "^UseDNS ", state: absent }
+
 # Validate the sudoers file before saving
 - lineinfile: dest=/etc/sudoers state=present regexp='^%ADMIN ALL\=' line='%ADMIN ALL=(ALL) NOPASSWD:ALL' validate='visudo -cf %s'
 """
 
-def write_changes(module,lines,dest):
-
+def write_temp(lines):
     tmpfd, tmpfile = tempfile.mkstemp()
     f = os.fdopen(tmpfd,'wb')
     f.writelines(lines)
     f.close()
+    return tmpfile
+
+def write_changes(module,lines,dest):
+
+    tmpfile = write_temp(lines)
 
     validate = module.params.get('validate', None)
     valid = not validate
@@ -180,102 +208,366 @@ def check_file_attrs(module, changed, message):
     return message, changed
 
 
-def present(module, dest, regexp, line, insertafter, insertbefore, create,
-            backup, backrefs):
+class LineReader(object):
+    '''
+    Iterate over the lines of an open file one at a time, closing the file
+    once the last line has been read.
+    '''
 
-    if not os.path.exists(dest):
-        if not create:
-            module.fail_json(rc=257, msg='Destination %s does not exist !' % dest)
-        destpath = os.path.dirname(dest)
-        if not os.path.exists(destpath) and not module.check_mode:
-            os.makedirs(destpath)
-        lines = []
-    else:
-        f = open(dest, 'rb')
-        lines = f.readlines()
-        f.close()
+    def __init__(self, f):
+        self.f = f
 
-    msg = ""
+    def __iter__(self):
+        return self
 
-    if regexp is not None:
-        mre = re.compile(regexp)
+    def next(self):
+        if self.f is None:
+            raise StopIteration
+        cur_line = self.f.readline()
+        if not cur_line:
+            self.close()
+            raise StopIteration
+        return cur_line
 
-    if insertafter not in (None, 'BOF', 'EOF'):
-        insre = re.compile(insertafter)
-    elif insertbefore not in (None, 'BOF'):
-        insre = re.compile(insertbefore)
-    else:
-        insre = None
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+def read_lines(dest):
+    '''
+    Return the lines of dest one at a time, so that files are never held in
+    memory as a whole.
+    '''
+
+    if not os.path.exists(dest):
+        return []
+    return LineReader(open(dest, 'rb'))
+
+
+def edited_lines(dest, edits):
+    '''
+    Yield the lines of dest with edits applied. In edits, replace maps line
+    numbers to the line replacing them, before maps line numbers to the lines
+    inserted before them (the number past the last line for the lines
+    inserted after it), remove holds the line numbers to drop and the lines
+    in tail are added at the end. Lines added after the last line always
+    start on a line of their own.
+    '''
+
+    last_line = None
+    nlines = 0
+    for lineno, cur_line in enumerate(read_lines(dest)):
+        nlines = lineno + 1
+        for new_line in edits['before'].get(lineno, []):
+            last_line = new_line
+            yield new_line
+        if lineno not in edits['remove']:
+            last_line = edits['replace'].get(lineno, cur_line)
+            yield last_line
+    added = edits['before'].get(nlines, []) + edits['tail']
+    if added and last_line is not None and \
+       not (last_line.endswith('\n') or last_line.endswith('\r')):
+        yield os.linesep
+    for new_line in added:
+        yield new_line
+
+
+class LineRule(object):
+    '''
+    A line to keep present or absent. A rule looks at the original lines of
+    the file one at a time, then adds the edits it needs, so that several
+    rules can share one pass over the file and one write. It also records
+    the lines it looked at and the lines it writes, to tell when its edits
+    overlap with those of other rules.
+    '''
+
+    def __init__(self, state='present', regexp=None, line=None,
+                 insertafter=None, insertbefore=None, backrefs=False):
+        self.state = state
+        self.regexp = regexp
+        self.line = line
+        self.backrefs = backrefs
+
+        # Deal with the insertafter default value manually, to avoid errors
+        # because of the mutually_exclusive mechanism.
+        if insertbefore is None and insertafter is None:
+            insertafter = 'EOF'
+        self.insertafter = insertafter
+        self.insertbefore = insertbefore
 
-    # index[0] is the line num where regexp has been found
-    # index[1] is the line num where insertafter/inserbefore has been found
-    index = [-1, -1]
-    m = None
-    for lineno, cur_line in enumerate(lines):
+        self.mre = None
         if regexp is not None:
-            match_found = mre.search(cur_line)
+            self.mre = re.compile(regexp)
+
+        if insertafter not in (None, 'BOF', 'EOF'):
+            self.insre = re.compile(insertafter)
+        elif insertbefore not in (None, 'BOF'):
+            self.insre = re.compile(insertbefore)
         else:
-            match_found = line == cur_line.rstrip('\r\n')
-        if match_found:
-            index[0] = lineno
-            m = match_found
-        elif insre is not None and insre.search(cur_line):
-            if insertafter:
+            self.insre = None
+
+        self.reset()
+
+    def reset(self):
+        # index[0] is the line num where regexp has been found
+        # index[1] is the line num where insertafter/inserbefore has been found
+        self.index = [-1, -1]
+        self.anchor = -1
+        self.m = None
+        self.matched_line = None
+        self.found = []
+        self.msg = ''
+        self.changed = False
+        # line numbers the plan depends on, line numbers it replaces or
+        # removes, places it inserts at and the lines it writes
+        self.observed = set()
+        self.touched = set()
+        self.slots = set()
+        self.written = []
+
+    def patterns(self):
+        '''the regular expressions this rule searches lines for'''
+        return [ p for p in (self.regexp, self.insre and self.insre.pattern) if p is not None ]
+
+    def concerns(self, cur_line):
+        '''whether cur_line would make a difference to this rule'''
+        if self.regexp is not None:
+            if self.mre.search(cur_line):
+                return True
+        elif self.line == cur_line.rstrip('\r\n'):
+            return True
+        return self.insre is not None and self.insre.search(cur_line) is not None
+
+    def scan(self, lineno, cur_line):
+        if self.regexp is not None:
+            match_found = self.mre.search(cur_line)
+        else:
+            match_found = self.line == cur_line.rstrip('\r\n')
+
+        if self.state == 'absent':
+            if match_found:
+                self.found.append(lineno)
+        elif match_found:
+            self.index[0] = lineno
+            self.m = match_found
+            self.matched_line = cur_line
+        elif self.insre is not None and self.insre.search(cur_line):
+            self.anchor = lineno
+            if self.insertafter:
                 # + 1 for the next line
-                index[1] = lineno + 1
-            if insertbefore:
+                self.index[1] = lineno + 1
+            if self.insertbefore:
                 # + 1 for the previous line
-                index[1] = lineno
-
-    msg = ''
-    changed = False
-    # Regexp matched a line in the file
-    if index[0] != -1:
-        if backrefs:
-            new_line = m.expand(line)
+                self.index[1] = lineno
+
+    def plan(self, edits):
+        if self.state == 'absent':
+            self.observed.update(self.found)
+            if self.found:
+                self.touched.update(self.found)
+                edits['remove'].update(self.found)
+                self.msg = "%s line(s) removed" % len(self.found)
+                self.changed = True
+            return
+
+        line = self.line
+        # Regexp matched a line in the file
+        if self.index[0] != -1:
+            self.observed.add(self.index[0])
+            if self.backrefs:
+                new_line = self.m.expand(line)
+            else:
+                # Don't do backref expansion if not asked.
+                new_line = line
+
+            if not new_line.endswith(os.linesep):
+                new_line += os.linesep
+
+            if self.matched_line != new_line:
+                self.touched.add(self.index[0])
+                self.written.append(new_line)
+                edits['replace'][self.index[0]] = new_line
+                self.msg = 'line replaced'
+                self.changed = True
+        elif self.backrefs:
+            # Do absolutely nothing, since it's not safe generating the line
+            # without the regexp matching to populate the backrefs.
+            pass
+        # Add it to the beginning of the file
+        elif self.insertbefore == 'BOF' or self.insertafter == 'BOF':
+            self.insert(0, line + os.linesep, edits)
+            self.msg = 'line added'
+            self.changed = True
+        # Add it to the end of the file if requested or
+        # if insertafter/insertbefore didn't match anything
+        # (so default behaviour is to add at the end)
+        elif self.insertafter == 'EOF' or self.index[1] == -1:
+            self.written.append(line + os.linesep)
+            edits['tail'].append(line + os.linesep)
+            self.msg = 'line added'
+            self.changed = True
+        # insert* matched, but not the regexp
         else:
-            # Don't do backref expansion if not asked.
-            new_line = line
-
-        if not new_line.endswith(os.linesep):
-            new_line += os.linesep
-
-        if lines[index[0]] != new_line:
-            lines[index[0]] = new_line
-            msg = 'line replaced'
-            changed = True
-    elif backrefs:
-        # Do absolutely nothing, since it's not safe generating the line
-        # without the regexp matching to populate the backrefs.
-        pass
-    # Add it to the beginning of the file
-    elif insertbefore == 'BOF' or insertafter == 'BOF':
-        lines.insert(0, line + os.linesep)
-        msg = 'line added'
-        changed = True
-    # Add it to the end of the file if requested or
-    # if insertafter/insertbefore didn't match anything
-    # (so default behaviour is to add at the end)
-    elif insertafter == 'EOF' or index[1] == -1:
-
-        # If the file is not empty then ensure there's a newline before the added line
-        if len(lines)>0 and not (lines[-1].endswith('\n') or lines[-1].endswith('\r')):
-            lines.append(os.linesep)
-
-        lines.append(line + os.linesep)
-        msg = 'line added'
-        changed = True
-    # insert* matched, but not the regexp
-    else:
-        lines.insert(index[1], line + os.linesep)
-        msg = 'line added'
-        changed = True
-
+            self.observed.add(self.anchor)
+            self.insert(self.index[1], line + os.linesep, edits)
+            self.msg = 'line added'
+            self.changed = True
+
+    def insert(self, lineno, new_line, edits):
+        self.slots.add(lineno)
+        self.written.append(new_line)
+        edits['before'].setdefault(lineno, []).append(new_line)
+
+
+def overlapping(rules):
+    '''
+    Return whether any rule depends on a line that an earlier rule edits,
+    inserts at the same place as an earlier rule, or would match a line an
+    earlier rule writes. The edits planned against the original file cannot
+    simply be combined then.
+    '''
+
+    touched = set()
+    slots = set()
+    written = []
+    for rule in rules:
+        if rule.observed & touched or rule.slots & slots:
+            return True
+        for new_line in written:
+            if rule.concerns(new_line):
+                return True
+        touched.update(rule.touched)
+        slots.update(rule.slots)
+        written.extend(rule.written)
+    return False
+
+
+BACKREFERENCE = re.compile(r'\\\d|\(\?P=')
+INLINE_FLAGS = re.compile(r'\(\?[aiLmsux]')
+
+def combined_matcher(rules):
+    '''
+    Return one regex matching every line that any of the regexp rules could
+    care about, so the other lines are skipped with a single search. Returns
+    None when the patterns cannot be combined safely.
+    '''
+
+    patterns = []
+    for rule in rules:
+        patterns.extend(rule.patterns())
+    if not patterns:
+        return None
+    for pattern in patterns:
+        # group numbers shift once patterns are combined, and inline flags
+        # would apply to the other patterns as well
+        if BACKREFERENCE.search(pattern) or INLINE_FLAGS.search(pattern):
+            return None
+    try:
+        return re.compile('|'.join([ '(?:%s)' % p for p in patterns ]))
+    except re.error:
+        return None
+
+
+def new_edits():
+    return dict(replace={}, before={}, remove=set(), tail=[])
+
+
+def scan_lines(dest, rules):
+    matcher = None
+    plain_lines = set()
+    if len(rules) > 1:
+        matcher = combined_matcher(rules)
+        plain_lines = set([ r.line for r in rules if r.regexp is None ])
+
+    for lineno, cur_line in enumerate(read_lines(dest)):
+        if matcher is not None and not matcher.search(cur_line) and \
+           cur_line.rstrip('\r\n') not in plain_lines:
+            continue
+        for rule in rules:
+            rule.scan(lineno, cur_line)
+
+
+def apply_in_order(module, dest, rules, backup):
+    '''
+    Apply the rules one after the other, each one against the file as the
+    rules before it left it, for rules whose edits overlap. This costs a pass
+    over the file and a temporary file for every rule that changes it.
+    '''
+
+    tmpfiles = []
+    try:
+        src = dest
+        for rule in rules:
+            rule.reset()
+            scan_lines(src, [rule])
+            edits = new_edits()
+            rule.plan(edits)
+            if rule.changed:
+                src = write_temp(edited_lines(src, edits))
+                tmpfiles.append(src)
+
+        # the rules may have undone each other
+        changed = src != dest
+        if changed and os.path.exists(dest) and filecmp.cmp(src, dest, False):
+            changed = False
+            for rule in rules:
+                rule.changed = False
+                rule.msg = ''
+
+        backupdest = ""
+        if changed and not module.check_mode:
+            if backup and os.path.exists(dest):
+                backupdest = module.backup_local(dest)
+            write_changes(module, read_lines(src), dest)
+    finally:
+        for tmpfile in tmpfiles:
+            os.unlink(tmpfile)
+    return changed, backupdest
+
+
+def apply_rules(module, dest, rules, backup):
+    '''
+    Scan dest once for all the rules, then write and validate the result
+    once if any rule changed it. Returns whether the file changed and the
+    backup file name.
+    '''
+
+    scan_lines(dest, rules)
+    edits = new_edits()
+    for rule in rules:
+        rule.plan(edits)
+
+    if len(rules) > 1 and overlapping(rules):
+        return apply_in_order(module, dest, rules, backup)
+
+    changed = len([ r for r in rules if r.changed ]) > 0
     backupdest = ""
     if changed and not module.check_mode:
         if backup and os.path.exists(dest):
             backupdest = module.backup_local(dest)
-        write_changes(module, lines, dest)
+        write_changes(module, edited_lines(dest, edits), dest)
+    return changed, backupdest
+
+
+def ensure_dest(module, dest, create):
+    if not os.path.exists(dest):
+        if not create:
+            module.fail_json(rc=257, msg='Destination %s does not exist !' % dest)
+        destpath = os.path.dirname(dest)
+        if not os.path.exists(destpath) and not module.check_mode:
+            os.makedirs(destpath)
+
+
+def present(module, dest, regexp, line, insertafter, insertbefore, create,
+            backup, backrefs):
+
+    ensure_dest(module, dest, create)
+
+    rule = LineRule('present', regexp, line, insertafter, insertbefore, backrefs)
+    changed, backupdest = apply_rules(module, dest, [rule], backup)
+    msg = rule.msg
 
     if module.check_mode and not os.path.exists(dest):
         module.exit_json(changed=changed, msg=msg, backup=backupdest)
@@ -289,37 +581,62 @@ def absent(module, dest, regexp, line, backup):
     if not os.path.exists(dest):
         module.exit_json(changed=False, msg="file not present")
 
-    msg = ""
+    rule = LineRule('absent', regexp, line)
+    changed, backupdest = apply_rules(module, dest, [rule], backup)
 
-    f = open(dest, 'rb')
-    lines = f.readlines()
-    f.close()
-    if regexp is not None:
-        cre = re.compile(regexp)
-    found = []
+    msg, changed = check_file_attrs(module, changed, rule.msg)
+    module.exit_json(changed=changed, found=len(rule.found), msg=msg, backup=backupdest)
 
-    def matcher(cur_line):
-        if regexp is not None:
-            match_found = cre.search(cur_line)
-        else:
-            match_found = line == cur_line.rstrip('\r\n')
-        if match_found:
-            found.append(cur_line)
-        return not match_found
 
-    lines = filter(matcher, lines)
-    changed = len(found) > 0
-    backupdest = ""
-    if changed and not module.check_mode:
-        if backup:
-            backupdest = module.backup_local(dest)
-        write_changes(module, lines, dest)
+def multiple(module, dest, items, create, backup):
 
+    rules = []
+    for item in items:
+        if not isinstance(item, dict):
+            item = dict(line=item)
+        # the module options are the defaults of every item
+        state = item.get('state', module.params['state'])
+        regexp = item.get('regexp')
+        line = item.get('line')
+        backrefs = module.boolean(item.get('backrefs', module.params['backrefs']))
+        if 'insertafter' in item or 'insertbefore' in item:
+            insertafter = item.get('insertafter')
+            insertbefore = item.get('insertbefore')
+        else:
+            insertafter = module.params['insertafter']
+            insertbefore = module.params['insertbefore']
+        if state not in ('present', 'absent'):
+            module.fail_json(msg='state must be present or absent: %s' % item)
+        if state == 'present':
+            if backrefs and regexp is None:
+                module.fail_json(msg='regexp is required with backrefs=true: %s' % item)
+            if line is None:
+                module.fail_json(msg='line is required with state=present: %s' % item)
+            if insertafter is not None and insertbefore is not None:
+                module.fail_json(msg='insertbefore and insertafter are mutually exclusive: %s' % item)
+        elif regexp is None and line is None:
+            module.fail_json(msg='one of line or regexp is required with state=absent: %s' % item)
+        try:
+            rules.append(LineRule(state, regexp, line, insertafter, insertbefore, backrefs))
+        except re.error, e:
+            module.fail_json(msg='invalid regular expression in %s: %s' % (item, str(e)))
+
+    if [ r for r in rules if r.state == 'present' ]:
+        ensure_dest(module, dest, create)
+    elif not os.path.exists(dest):
+        module.exit_json(changed=False, msg="file not present")
+
+    changed, backupdest = apply_rules(module, dest, rules, backup)
+    results = [ dict(changed=r.changed, msg=r.msg) for r in rules ]
+    msg = ''
     if changed:
-        msg = "%s line(s) removed" % len(found)
+        msg = '%d line(s) changed' % len([ r for r in rules if r.changed ])
+
+    if module.check_mode and not os.path.exists(dest):
+        module.exit_json(changed=changed, msg=msg, results=results, backup=backupdest)
 
     msg, changed = check_file_attrs(module, changed, msg)
-    module.exit_json(changed=changed, found=len(found), msg=msg, backup=backupdest)
+    module.exit_json(changed=changed, msg=msg, results=results, backup=backupdest)
 
 
 def main():
@@ -335,8 +652,9 @@ def main():
             create=dict(default=False, type='bool'),
             backup=dict(default=False, type='bool'),
             validate=dict(default=None, type='str'),
+            lines=dict(default=None, type='list'),
         ),
-        mutually_exclusive=[['insertbefore', 'insertafter']],
+        mutually_exclusive=[['insertbefore', 'insertafter'], ['lines', 'line'], ['lines', 'regexp']],
         add_file_common_args=True,
         supports_check_mode=True
     )
@@ -351,6 +669,9 @@ def main():
     if os.path.isdir(dest):
         module.fail_json(rc=256, msg='Destination %s is a directory !' % dest)
 
+    if params['lines'] is not None:
+        multiple(module, dest, params['lines'], create, backup)
+
     if params['state'] == 'present':
         if backrefs and params['regexp'] is None:
             module.fail_json(msg='regexp= is required with backrefs=true')
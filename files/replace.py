@@ -20,6 +20,7 @@
 
 import re
 import os
+import mmap
 import tempfile
 
 DOCUMENTATION = """
@@ -77,11 +78,67 @@ EXAMPLES = r"""
 - replace: dest=/etc/apache/ports regexp='^(NameVirtualHost|Listen)\s+80\s*$' replace='\1 127.0.0.1:8080' validate='/usr/sbin/apache2ctl -f %s -t'
 """
 
+def map_file(dest):
+    '''
+    Map dest read-only so the regexp can search it without reading it
+    into memory. Empty and unmappable files are read instead.
+    '''
+
+    f = open(dest, 'rb')
+    try:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            return f.read()
+    finally:
+        f.close()
+
+def substitutions(mre, replace, contents):
+    '''
+    Yield the matches re.subn would replace along with their replacement.
+    '''
+
+    last_end = None
+    for m in mre.finditer(contents):
+        # like subn, skip empty matches right after the previous match
+        if m.start() == m.end() and m.start() == last_end:
+            continue
+        last_end = m.end()
+        yield m, m.expand(replace)
+
+def count_changes(mre, replace, contents):
+    '''
+    Return the number of replacements and whether any of them changes
+    the contents, without building the new contents.
+    '''
+
+    count = 0
+    differs = False
+    for m, new in substitutions(mre, replace, contents):
+        count += 1
+        if not differs and new != m.group(0):
+            differs = True
+    return count, differs
+
+def replaced(mre, replace, contents):
+    '''
+    Yield the new contents in chunks, so they can be written out as the
+    matches are found.
+    '''
+
+    pos = 0
+    for m, new in substitutions(mre, replace, contents):
+        yield contents[pos:m.start()]
+        yield new
+        pos = m.end()
+    yield contents[pos:]
+
 def write_changes(module,contents,dest):
 
     tmpfd, tmpfile = tempfile.mkstemp()
     f = os.fdopen(tmpfd,'wb')
-    f.write(contents)
+    for chunk in contents:
+        f.write(chunk)
     f.close()
 
     validate = module.params.get('validate', None)
@@ -131,26 +188,28 @@ def main():
     if not os.path.exists(dest):
         module.fail_json(rc=257, msg='Destination %s does not exist !' % dest)
     else:
-        f = open(dest, 'rb')
-        contents = f.read()
-        f.close()
+        contents = map_file(dest)
 
     mre = re.compile(params['regexp'], re.MULTILINE)
-    result = re.subn(mre, params['replace'], contents, 0)
-
-    if result[1] > 0 and contents != result[0]:
-        msg = '%s replacements made' % result[1]
-        changed = True
-    else:
-        msg = ''
-        changed = False
-
-    if changed and not module.check_mode:
-        if params['backup'] and os.path.exists(dest):
-            module.backup_local(dest)
-        if params['follow'] and os.path.islink(dest):
-            dest = os.path.realpath(dest)
-        write_changes(module, result[0], dest)
+    try:
+        count, differs = count_changes(mre, params['replace'], contents)
+
+        if count > 0 and differs:
+            msg = '%s replacements made' % count
+            changed = True
+        else:
+            msg = ''
+            changed = False
+
+        if changed and not module.check_mode:
+            if params['backup'] and os.path.exists(dest):
+                module.backup_local(dest)
+            if params['follow'] and os.path.islink(dest):
+                dest = os.path.realpath(dest)
+            write_changes(module, replaced(mre, params['replace'], contents), dest)
+    finally:
+        if isinstance(contents, mmap.mmap):
+            contents.close()
 
     msg, changed = check_file_attrs(module, changed, msg)
     module.exit_json(changed=changed, msg=msg)
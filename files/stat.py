@@ -24,10 +24,24 @@ description:
 options:
   path:
     description:
-      - The full path of the file/object to get the facts of
-    required: true
+      - The full path of the file/object to get the facts of. Required unless C(paths) is used.
+    required: false
     default: null
     aliases: []
+  paths:
+    description:
+      - A list of paths to get the facts of in a single run, instead of C(path). The results are
+        returned in C(stats), keyed by path. The paths are examined concurrently and user and
+        group names are looked up once per id.
+    required: false
+    default: null
+    version_added: "2.1"
+  workers:
+    description:
+      - Number of threads used to examine C(paths).
+    required: false
+    default: 4
+    version_added: "2.1"
   follow:
     description:
       - Whether to follow symlinks
@@ -55,6 +69,15 @@ options:
     default: sha1
     aliases: [ 'checksum_algo' ]
     version_added: "2.0"
+  metadata_only:
+    description:
+      - Only return what a single stat call provides. No checksums are computed, regardless of
+        C(get_md5) and C(get_checksum), and owner and group names, the target of links and
+        accessibility checks are not looked up. Useful when only C(exists), C(mtime) or C(size)
+        are needed, for instance when polling large files.
+    required: false
+    default: no
+    version_added: "2.1"
 author: "Bruce Pennypacker (@bpennypacker)"
 '''
 
@@ -95,6 +118,19 @@ EXAMPLES = '''
 
 # Use sha256 to calculate checksum
 - stat: path=/path/to/something checksum_algorithm=sha256
+
+# Only check whether a large file exists and when it was last modified
+- stat: path=/path/to/myhugefile metadata_only=yes
+
+# Check several paths at once
+- stat:
+    paths:
+      - /etc/foo.conf
+      - /etc/bar.conf
+    get_md5: no
+  register: st
+- fail: msg="foo.conf is missing"
+  when: not st.stats['/etc/foo.conf'].exists
 '''
 
 RETURN = '''
@@ -278,44 +314,95 @@ stat:
             returned: success, path exists and user can read stats and installed python supports it
             type: string
             sample: www-data
+stats:
+    description: dictionary of stat results keyed by path, each with the keys described for C(stat)
+    returned: success, when paths is used
+    type: dictionary
+    sample: { "/etc/foo.conf": { "exists": true, "path": "/etc/foo.conf", ... }, "/etc/bar.conf": { "exists": false } }
 '''
 
 import os
-import sys
 from stat import *
 import pwd
 import grp
+import threading
+import Queue
 
-def main():
-    module = AnsibleModule(
-        argument_spec = dict(
-            path = dict(required=True),
-            follow = dict(default='no', type='bool'),
-            get_md5 = dict(default='yes', type='bool'),
-            get_checksum = dict(default='yes', type='bool'),
-            checksum_algorithm = dict(default='sha1', type='str', choices=['sha1', 'sha224', 'sha256', 'sha384', 'sha512'], aliases=['checksum_algo'])
-        ),
-        supports_check_mode = True
-    )
+BUFSIZE = 64 * 1024
+
+def multi_digest(path, algorithms):
+    '''
+    Compute every requested digest of path in one chunked read of the file.
+    Algorithms the host cannot use (md5 on FIPS-140 systems) map to None.
+    '''
+
+    digests = {}
+    for algorithm in algorithms:
+        try:
+            digests[algorithm] = AVAILABLE_HASH_ALGORITHMS[algorithm]()
+        except (KeyError, ValueError):
+            digests[algorithm] = None
+    hashers = [ d for d in digests.values() if d is not None ]
+
+    infile = open(path, 'rb')
+    try:
+        block = infile.read(BUFSIZE)
+        while block:
+            for hasher in hashers:
+                hasher.update(block)
+            block = infile.read(BUFSIZE)
+    finally:
+        infile.close()
+
+    result = {}
+    for algorithm, hasher in digests.items():
+        if hasher is None:
+            result[algorithm] = None
+        else:
+            result[algorithm] = hasher.hexdigest()
+    return result
 
-    path = module.params.get('path')
-    path = os.path.expanduser(path)
-    follow = module.params.get('follow')
-    get_md5 = module.params.get('get_md5')
-    get_checksum = module.params.get('get_checksum')
-    checksum_algorithm = module.params.get('checksum_algorithm')
+class NameCache(object):
+    '''
+    Memoized uid and gid to name lookups, shared by all the paths of a run.
+    Ids without a name are remembered as None.
+    '''
+
+    def __init__(self):
+        self.users = {}
+        self.groups = {}
+
+    def user(self, uid):
+        if uid not in self.users:
+            try:
+                self.users[uid] = pwd.getpwuid(uid).pw_name
+            except KeyError:
+                self.users[uid] = None
+        return self.users[uid]
+
+    def group(self, gid):
+        if gid not in self.groups:
+            try:
+                self.groups[gid] = grp.getgrgid(gid).gr_name
+            except KeyError:
+                self.groups[gid] = None
+        return self.groups[gid]
+
+def stat_path(path, params, names):
+    '''
+    Return the stat dictionary of path. Raises OSError for errors other than
+    the path not existing.
+    '''
 
     try:
-        if follow:
+        if params['follow']:
             st = os.stat(path)
         else:
             st = os.lstat(path)
     except OSError, e:
         if e.errno == errno.ENOENT:
-            d = { 'exists' : False }
-            module.exit_json(changed=False, stat=d)
-
-        module.fail_json(msg = e.strerror)
+            return { 'exists' : False }
+        raise
 
     mode = st.st_mode
 
@@ -353,33 +440,125 @@ def main():
         'isgid'    : bool(mode & stat.S_ISGID),
         }
 
+    if params['metadata_only']:
+        return d
+
     if S_ISLNK(mode):
         d['lnk_source'] = os.path.realpath(path)
 
-    if S_ISREG(mode) and get_md5 and os.access(path,os.R_OK):
-        # Will fail on FIPS-140 compliant systems
-        try:
-            d['md5']       = module.md5(path)
-        except ValueError:
-            d['md5']       = None
+    algorithms = []
+    if params['get_md5']:
+        # md5 will be None on FIPS-140 compliant systems
+        algorithms.append('md5')
+    if params['get_checksum']:
+        algorithms.append(params['checksum_algorithm'])
 
-    if S_ISREG(mode) and get_checksum and os.access(path,os.R_OK):
-        d['checksum']      = module.digest_from_file(path, checksum_algorithm)
+    if S_ISREG(mode) and algorithms and os.access(path,os.R_OK):
+        digests = multi_digest(path, algorithms)
+        if params['get_md5']:
+            d['md5']       = digests['md5']
+        if params['get_checksum']:
+            d['checksum']  = digests[params['checksum_algorithm']]
 
-    try:
-        pw = pwd.getpwuid(st.st_uid)
+    pw_name = names.user(st.st_uid)
+    if pw_name is not None:
+        d['pw_name']   = pw_name
+    gr_name = names.group(st.st_gid)
+    if gr_name is not None:
+        d['gr_name']   = gr_name
+
+    return d
+
+def run_in_pool(func, items, workers):
+    '''
+    Call func on each of the paths from up to workers threads. Results keep
+    the order of items, with any exception func raised in their place.
+    '''
+    results = [None] * len(items)
+    pending = Queue.Queue()
+    for index in range(len(items)):
+        pending.put(index)
+
+    def worker():
+        while True:
+            try:
+                index = pending.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[index] = func(items[index])
+            except Exception, e:
+                results[index] = e
 
-        d['pw_name']   = pw.pw_name
+    threads = []
+    for i in range(max(1, min(workers, len(items)))):
+        t = threading.Thread(target=worker)
+        t.setDaemon(True)
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+    return results
 
-        grp_info = grp.getgrgid(st.st_gid)
-        d['gr_name'] = grp_info.gr_name
-    except:
-        pass
+def stat_paths(paths, params, names, workers):
+    '''
+    Stat every path from a pool of threads. Returns a dictionary of the stat
+    results keyed by path, and the errors keyed by path.
+    '''
 
+    stats = {}
+    errors = {}
+    results = run_in_pool(lambda path: stat_path(os.path.expanduser(path), params, names), paths, workers)
+    for (path, result) in zip(paths, results):
+        if isinstance(result, (OSError, IOError)):
+            errors[path] = result.strerror
+        elif isinstance(result, Exception):
+            errors[path] = str(result)
+        else:
+            stats[path] = result
+    return (stats, errors)
+
+def main():
+    module = AnsibleModule(
+        argument_spec = dict(
+            path = dict(required=False),
+            paths = dict(required=False, type='list'),
+            follow = dict(default='no', type='bool'),
+            get_md5 = dict(default='yes', type='bool'),
+            get_checksum = dict(default='yes', type='bool'),
+            checksum_algorithm = dict(default='sha1', type='str', choices=['sha1', 'sha224', 'sha256', 'sha384', 'sha512'], aliases=['checksum_algo']),
+            metadata_only = dict(default='no', type='bool'),
+            workers = dict(default=4, type='int'),
+        ),
+        required_one_of = [['path', 'paths']],
+        mutually_exclusive = [['path', 'paths']],
+        supports_check_mode = True
+    )
+
+    params = module.params
+    checksum_algorithm = params['checksum_algorithm']
+    if params['get_checksum'] and not params['metadata_only'] and checksum_algorithm not in AVAILABLE_HASH_ALGORITHMS:
+        module.fail_json(msg="Could not hash file with algorithm '%s'. Available algorithms: %s" %
+                         (checksum_algorithm, ', '.join(AVAILABLE_HASH_ALGORITHMS)))
+
+    names = NameCache()
+
+    if params['paths'] is not None:
+        (stats, errors) = stat_paths(params['paths'], params, names, params['workers'])
+        if errors:
+            module.fail_json(msg="failed to stat: %s" % ', '.join([ '%s (%s)' % (p, errors[p]) for p in sorted(errors) ]), stats=stats)
+        module.exit_json(changed=False, stats=stats)
+
+    path = os.path.expanduser(params['path'])
+    try:
+        d = stat_path(path, params, names)
+    except (OSError, IOError), e:
+        module.fail_json(msg = e.strerror)
 
     module.exit_json(changed=False, stat=d)
 
 # import module snippets
 from ansible.module_utils.basic import *
 
-main()
+if __name__ == '__main__':
+    main()
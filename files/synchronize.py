@@ -164,6 +164,40 @@ options:
     default: no
     required: false
     version_added: "2.0"
+  workers:
+    description:
+      - When above 1 and C(src) is a local directory, synchronize it with one rsync for its
+        top level entries followed by this many concurrent rsync processes, each handling a
+        share of its subdirectories. Subdirectories are spread by the number of entries they
+        directly contain. C(delete) then removes extraneous top level entries in the first
+        pass and extraneous entries below each subdirectory in its worker.
+      - Each worker only sees its own subdirectories, so hard links between subdirectories
+        handled by different workers are not preserved, even with C(-H) in C(rsync_opts).
+    default: 1
+    required: false
+    version_added: "2.1"
+  bwlimit:
+    description:
+      - Limit the bandwidth used, in KBytes per second, shared between the rsync processes
+        running at the same time.
+    default: null
+    required: false
+    version_added: "2.1"
+  cache:
+    description:
+      - Path to a file on the local host recording a digest of the name, mode, owner, group,
+        size and modification time of everything below each top level subdirectory of a local
+        C(src) directory. Subdirectories whose digest did not change since the last run with the
+        same options are not synchronized again, and rsync does not run at all when nothing
+        changed, so the destination is not scanned. Each destination and set of options
+        has its own entry, so hosts can share the file.
+      - Only use this when nothing but this task modifies C(dest), as changes made there are
+        not detected while the source is unchanged.
+      - Ignored with C(checksum), as contents changed without their size and modification time
+        would be missed.
+    default: null
+    required: false
+    version_added: "2.1"
 notes:
    - rsync must be installed on both the local and remote host.
    - For the C(synchronize) module, the "local host" is the host `the synchronize task originates on`, and the "destination host" is the host `synchronize is connecting to`.
@@ -174,6 +208,9 @@ notes:
      are what was expected.
    - To exclude files and directories from being synchronized, you may add 
      C(.rsync-filter) files to the source directory.
+   - rsync is run with C(--stats). The itemized changes are returned as C(changes), one
+     record per path with its update type, file type and changed attributes, and the
+     transfer statistics (bytes sent and received, literal and matched data, rate) as C(stats).
 
 
 author: "Timothy Appnel (@tima)"
@@ -222,6 +259,15 @@ synchronize: src=some/relative/path dest=/some/absolute/path rsync_path="sudo rs
 - /var      # exclude any path starting with 'var' starting at the source directory
 + /var/conf # include /var/conf even though it was previously excluded
 
+# Synchronize a large tree with four rsync workers, at most 10 MB/s in total,
+# skipping the subdirectories that did not change since the last run
+synchronize:
+    src: /srv/www/
+    dest: /srv/www
+    workers: 4
+    bwlimit: 10240
+    cache: /var/cache/www.synchronize
+
 # Synchronize passing in extra rsync options
 synchronize:
     src: /tmp/helloworld
@@ -232,6 +278,270 @@ synchronize:
 '''
 
 
+import os
+import re
+import shlex
+import stat
+import subprocess
+import threading
+import Queue
+
+
+# update types and file types in the first two characters of %i
+ITEMIZE_UPDATES = {'<': 'sent', '>': 'received', 'c': 'created', 'h': 'hardlink', '.': 'attributes', '*': 'message'}
+ITEMIZE_TYPES = {'f': 'file', 'd': 'directory', 'L': 'symlink', 'D': 'device', 'S': 'special'}
+# the attribute each following character of %i reports a change of
+ITEMIZE_ATTRIBUTES = ('checksum', 'size', 'time', 'perms', 'owner', 'group', 'atime', 'acl', 'xattr')
+
+ITEMIZE_RE = re.compile(r'^(\S+)\s+(.*)$')
+STATS_RE = re.compile(r'^([A-Z][A-Za-z ]+): ([\d,]+(?:\.\d+)?)')
+RATE_RE = re.compile(r'^sent ([\d,]+) bytes\s+received ([\d,]+) bytes\s+([\d,]+(?:\.\d+)?) bytes/sec')
+SPEEDUP_RE = re.compile(r'^total size is ([\d,]+)\s+speedup is ([\d,]+(?:\.\d+)?)')
+
+
+def parse_number(value):
+    value = value.replace(',', '')
+    if '.' in value:
+        return float(value)
+    return int(value)
+
+
+def parse_change(line):
+    '''
+    Turn a line of --itemize-changes output into a record of the path, what
+    happened to it and which of its attributes changed.
+    '''
+
+    match = ITEMIZE_RE.match(line)
+    if not match:
+        return None
+    itemized, path = match.groups()
+    record = dict(itemized=itemized, path=path)
+    if itemized == '*deleting':
+        record.update(update='deleted', type=None, changes=[])
+        return record
+
+    record['update'] = ITEMIZE_UPDATES.get(itemized[0], itemized[0])
+    record['type'] = ITEMIZE_TYPES.get(itemized[1:2], itemized[1:2])
+    flags = itemized[2:]
+    record['created'] = len(flags) > 0 and flags.strip('+') == ''
+    record['changes'] = [ name for (name, flag) in zip(ITEMIZE_ATTRIBUTES, flags)
+                          if flag not in '.+ ' ]
+    for separator in (' -> ', ' => '):
+        if separator in path and record['type'] in ('symlink', 'file'):
+            record['path'], record['target'] = path.split(separator, 1)
+            break
+    return record
+
+
+def parse_output(out, changed_marker):
+    '''
+    Split rsync output into the itemized changes, marked with changed_marker,
+    the --stats figures and the remaining lines.
+    '''
+
+    changes = []
+    stats = {}
+    lines = []
+    in_stats = False
+    for line in out.splitlines():
+        if line.startswith(changed_marker):
+            line = line[len(changed_marker):]
+            record = parse_change(line)
+            if record is not None:
+                changes.append(record)
+            lines.append(line)
+            continue
+
+        match = STATS_RE.match(line)
+        if match and (in_stats or line.startswith('Number of files:')):
+            in_stats = True
+            name, value = match.groups()
+            stats[name.lower().replace(' ', '_')] = parse_number(value)
+            continue
+        match = RATE_RE.match(line)
+        if match:
+            stats['bytes_per_sec'] = parse_number(match.group(3))
+            continue
+        match = SPEEDUP_RE.match(line)
+        if match:
+            stats['speedup'] = parse_number(match.group(2))
+            in_stats = False
+            continue
+        if in_stats and not line.strip():
+            continue
+        lines.append(line)
+    return changes, stats, lines
+
+
+def merge_stats(total, stats):
+    '''
+    Add the figures of one rsync run to those of the others. Rates add up as
+    the runs are concurrent, the speedup is recomputed from the totals.
+    '''
+
+    for (name, value) in stats.items():
+        if name != 'speedup':
+            total[name] = total.get(name, 0) + value
+    exchanged = total.get('total_bytes_sent', 0) + total.get('total_bytes_received', 0)
+    if 'total_file_size' in total and exchanged:
+        total['speedup'] = round(float(total['total_file_size']) / exchanged, 2)
+    return total
+
+
+def run_in_pool(func, items, workers):
+    '''
+    Run func, a tree signature or an rsync command, for each item from up to
+    workers threads. Results keep the order of items, with any exception
+    func raised in their place.
+    '''
+
+    results = [None] * len(items)
+    work = Queue.Queue()
+    for index in range(len(items)):
+        work.put(index)
+
+    def worker():
+        while True:
+            try:
+                index = work.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[index] = func(items[index])
+            except Exception, e:
+                results[index] = e
+
+    threads = []
+    for i in range(max(1, min(workers, len(items)))):
+        t = threading.Thread(target=worker)
+        t.setDaemon(True)
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+    return results
+
+
+def stat_fields(st):
+    ''' the attributes of an entry rsync compares or copies by default '''
+    return '%o\0%d\0%d\0%d\0%r' % (st.st_mode, st.st_uid, st.st_gid, st.st_size, st.st_mtime)
+
+
+def tree_signature(path, recurse=True):
+    '''
+    Return a digest of the name, mode, owner, group, size and mtime of path
+    and of everything below it, or only of its entries when not recursing,
+    gathered with lstat calls only.
+    '''
+
+    digest = AVAILABLE_HASH_ALGORITHMS['sha1']()
+    st = os.lstat(path)
+    digest.update('.\0%s\n' % stat_fields(st))
+    if not recurse:
+        for name in sorted(os.listdir(path)):
+            st = os.lstat(os.path.join(path, name))
+            digest.update('%s\0%s\n' % (name, stat_fields(st)))
+    elif stat.S_ISDIR(st.st_mode):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(dirs + files):
+                full = os.path.join(root, name)
+                st = os.lstat(full)
+                digest.update('%s\0%s\n' % (full[len(path) + 1:], stat_fields(st)))
+    return digest.hexdigest()
+
+
+def cache_key(params, check_mode):
+    '''
+    Return a digest of the options the signatures are recorded for, under
+    which they are kept in the cache file. dest is one of them, so hosts
+    sharing the file keep their own entries.
+    '''
+
+    key = dict([ (k, v) for (k, v) in params.items()
+                 if k not in ('workers', 'bwlimit', 'cache') ])
+    key['check_mode'] = check_mode
+    return AVAILABLE_HASH_ALGORITHMS['sha1'](json.dumps(key, sort_keys=True)).hexdigest()
+
+
+def load_cache(path):
+    '''
+    Read the source tree cache. When it is missing or corrupt every
+    subdirectory is synced, as without a cache.
+    '''
+
+    try:
+        infile = open(path, 'r')
+        try:
+            cache = json.load(infile)
+        finally:
+            infile.close()
+    except (IOError, ValueError):
+        return {}
+    if not isinstance(cache, dict):
+        return {}
+    return cache
+
+
+def save_cache(path, cache):
+    '''
+    Write the source tree cache through a rename. Errors are ignored, the
+    next run then syncs every subdirectory again.
+    '''
+
+    try:
+        (fd, tmppath) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    except (IOError, OSError):
+        return
+    try:
+        outfile = os.fdopen(fd, 'w')
+        try:
+            json.dump(cache, outfile)
+        finally:
+            outfile.close()
+        os.rename(tmppath, path)
+    except (IOError, OSError):
+        try:
+            os.unlink(tmppath)
+        except OSError:
+            pass
+
+
+def shard(paths, shards):
+    '''
+    Spread the directories over at most shards lists, largest first, using
+    the number of entries directly below each directory as its size.
+    '''
+
+    sizes = []
+    for path in paths:
+        try:
+            sizes.append((len(os.listdir(path)), path))
+        except OSError:
+            sizes.append((0, path))
+    sizes.sort(reverse=True)
+
+    lists = [ [] for i in range(min(shards, len(paths))) ]
+    loads = [0] * len(lists)
+    for size, path in sizes:
+        index = loads.index(min(loads))
+        lists[index].append(path)
+        loads[index] += size + 1
+    return [ sorted(names) for names in lists ]
+
+
+def quote(path):
+    return '"' + path + '"'
+
+
+def bwlimit_opt(bwlimit, processes):
+    ''' the --bwlimit option sharing bwlimit between processes running at once '''
+    if not bwlimit:
+        return ''
+    return ' --bwlimit=%d' % max(1, bwlimit // processes)
+
+
 def main():
     module = AnsibleModule(
         argument_spec = dict(
@@ -261,6 +571,9 @@ def main():
             partial = dict(default='no', type='bool'),
             verify_host = dict(default='no', type='bool'),
             mode = dict(default='push', choices=['push', 'pull']),
+            workers = dict(default=1, type='int'),
+            bwlimit = dict(type='int'),
+            cache = dict(type='path'),
         ),
         supports_check_mode = True
     )
@@ -290,6 +603,9 @@ def main():
     rsync_opts = module.params['rsync_opts']
     ssh_args = module.params['ssh_args']
     verify_host = module.params['verify_host']
+    workers = module.params['workers']
+    bwlimit = module.params['bwlimit']
+    cache_path = module.params['cache']
 
     cmd = '%s --delay-updates -F' % rsync
     if compress:
@@ -365,7 +681,7 @@ def main():
         cmd = cmd + " --partial"
 
     changed_marker = '<<CHANGED>>'
-    cmd = cmd + " --out-format='" + changed_marker + "%i %n%L'"
+    cmd = cmd + " --out-format='" + changed_marker + "%i %n%L' --stats"
 
     # expand the paths
     if '@' not in source:
@@ -373,22 +689,171 @@ def main():
     if '@' not in dest:
         dest = os.path.expanduser(dest) 
 
-    cmd = ' '.join([cmd, source, dest])
+    src_dir = os.path.expanduser(module.params['src'])
+    if (workers > 1 or (cache_path and not checksum)) and os.path.isdir(src_dir):
+        sync_sharded(module, cmd, src_dir, source, dest, changed_marker)
+
+    cmd = ' '.join([cmd + bwlimit_opt(bwlimit, 1), source, dest])
     cmdstr = cmd
     (rc, out, err) = module.run_command(cmd)
     if rc:
         return module.fail_json(msg=err, rc=rc, cmd=cmdstr)
     else:
         changed = changed_marker in out
-        out_clean=out.replace(changed_marker,'')
-        out_lines=out_clean.split('\n')
+        (changes, stats, out_lines) = parse_output(out, changed_marker)
+        out_clean = '\n'.join(out_lines)
         while '' in out_lines: 
             out_lines.remove('')
         return module.exit_json(changed=changed, msg=out_clean,
-                                rc=rc, cmd=cmdstr, stdout_lines=out_lines)
+                                rc=rc, cmd=cmdstr, stdout_lines=out_lines,
+                                changes=changes, stats=stats)
+
+
+def run_rsync(args):
+    '''
+    Run one shard's rsync from a worker thread and return its rc, stdout and
+    stderr. AnsibleModule.run_command is not safe here, it changes os.environ
+    and exits the module on some errors.
+    '''
+
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True)
+    (out, err) = proc.communicate()
+    return (proc.returncode, out, err)
+
+
+def sync_sharded(module, cmd, src_dir, source, dest, changed_marker):
+    '''
+    Synchronize a local source directory with one rsync for its top level
+    entries, then concurrent rsync workers each handling a shard of its
+    subdirectories. With a cache, subdirectories whose tree did not change
+    since the last run are left out, and nothing runs when none changed.
+    '''
+
+    workers = max(1, module.params['workers'])
+    bwlimit = module.params['bwlimit']
+    cache_path = module.params['cache']
+    dest_dir = module.params['dest'].rstrip('/')
+
+    cmds = []
+    if not module.params['src'].endswith('/'):
+        # rsync copies the directory itself, so create dest/name and sync
+        # into it. Nothing is compared below dest/name, so nothing to delete.
+        prepare = cmd.replace(' --delete-after', '') + ' --no-recursive --dirs'
+        cmds.append(' '.join([prepare + bwlimit_opt(bwlimit, 1), source, dest]))
+        dest_dir = '%s/%s' % (dest_dir, os.path.basename(src_dir.rstrip('/')))
+    src_dir = src_dir.rstrip('/')
+
+    names = sorted(os.listdir(src_dir))
+    subdirs = [ name for name in names
+                if os.path.isdir(os.path.join(src_dir, name)) and not os.path.islink(os.path.join(src_dir, name)) ]
+
+    signatures = None
+    if cache_path and not module.params['checksum']:
+        key = cache_key(module.params, module.check_mode)
+        paths = [ os.path.join(src_dir, name) for name in subdirs ]
+        results = run_in_pool(tree_signature, paths, workers)
+        # entries that could not be read are left out, so they always sync
+        signatures = {}
+        for (name, result) in zip(subdirs, results):
+            if not isinstance(result, Exception):
+                signatures[name] = result
+        signatures['.'] = tree_signature(src_dir, recurse=False)
+
+        cached = load_cache(cache_path).get(key)
+        if isinstance(cached, dict):
+            subdirs = [ name for name in subdirs
+                        if name not in signatures or cached.get(name) != signatures[name] ]
+            if not subdirs and cached.get('.') == signatures['.']:
+                module.exit_json(changed=False, msg='', rc=0, cmd='', cmds=[], stdout_lines=[],
+                                 changes=[], stats={})
+
+    cmds.append(' '.join([cmd + ' --no-recursive --dirs' + bwlimit_opt(bwlimit, 1),
+                          quote(src_dir + '/'), quote(dest_dir + '/')]))
+    shards = shard([ os.path.join(src_dir, name) for name in subdirs ], workers)
+    # each shard reads its directories from a file, a command line naming
+    # them all could exceed the argument size limit
+    files_from = cmd
+    if ' --no-recursive' not in cmd and (' --archive' in cmd or ' --recursive' in cmd):
+        # --files-from keeps --archive from implying --recursive
+        files_from += ' --recursive'
+    shard_cmds = []
+    list_files = []
+    try:
+        shard_parts = []
+        for paths in shards:
+            # the list is line based, names containing line breaks keep
+            # being passed as arguments
+            listed = []
+            broken = []
+            for path in paths:
+                basename = os.path.basename(path)
+                if '\n' in basename or '\r' in basename:
+                    broken.append(quote(path))
+                else:
+                    listed.append(basename)
+            if listed:
+                (fd, list_file) = tempfile.mkstemp()
+                list_files.append(list_file)
+                outfile = os.fdopen(fd, 'w')
+                try:
+                    # ./ keeps names starting with # or ; from reading as comments
+                    outfile.writelines([ './%s\n' % name for name in listed ])
+                finally:
+                    outfile.close()
+                shard_parts.append((files_from + ' --files-from=' + quote(list_file), [quote(src_dir + '/')]))
+            if broken:
+                shard_parts.append((cmd, broken))
+        processes = min(workers, len(shard_parts))
+        for (shard_cmd, sources) in shard_parts:
+            shard_cmds.append(' '.join([shard_cmd + bwlimit_opt(bwlimit, processes)] + sources
+                                       + [quote(dest_dir + '/')]))
+
+        outs = []
+        for cmdstr in cmds:
+            (rc, out, err) = module.run_command(cmdstr)
+            if rc:
+                module.fail_json(msg=err, rc=rc, cmd=cmdstr, cmds=cmds + shard_cmds)
+            outs.append(out)
+        # split and expanded like run_command does, the workers only run them
+        shard_args = [ [ os.path.expanduser(os.path.expandvars(arg)) for arg in shlex.split(cmdstr) ]
+                       for cmdstr in shard_cmds ]
+        results = run_in_pool(run_rsync, shard_args, workers)
+        for (cmdstr, result) in zip(shard_cmds, results):
+            if isinstance(result, Exception):
+                module.fail_json(msg=str(result), cmd=cmdstr, cmds=cmds + shard_cmds)
+            (rc, out, err) = result
+            if rc:
+                module.fail_json(msg=err, rc=rc, cmd=cmdstr, cmds=cmds + shard_cmds)
+            outs.append(out)
+    finally:
+        for list_file in list_files:
+            os.unlink(list_file)
+
+    if signatures is not None and not module.check_mode:
+        # read again to keep what other hosts recorded in the meantime
+        cache = load_cache(cache_path)
+        cache[key] = signatures
+        save_cache(cache_path, cache)
+
+    changed = False
+    changes = []
+    stats = {}
+    out_lines = []
+    for out in outs:
+        changed = changed or changed_marker in out
+        (out_changes, out_stats, lines) = parse_output(out, changed_marker)
+        changes.extend(out_changes)
+        merge_stats(stats, out_stats)
+        out_lines.extend(lines)
+    out_clean = '\n'.join(out_lines)
+    while '' in out_lines:
+        out_lines.remove('')
+    module.exit_json(changed=changed, msg=out_clean, rc=0, cmd=cmds[0],
+                     cmds=cmds + shard_cmds, stdout_lines=out_lines,
+                     changes=changes, stats=stats)
 
 # import module snippets
 from ansible.module_utils.basic import *
 
-main()
-
+if __name__ == '__main__':
+    main()
@@ -59,17 +59,68 @@ options:
     choices: [ "yes", "no" ]
     default: "no"
     version_added: "2.0"
+  manifest:
+    description:
+      - Path of a file, relative to C(dest) unless absolute, in which to record the size,
+        modification time and checksum of the archive along with the members it unpacked.
+      - When the manifest matches the archive and every member still exists with its recorded
+        size, the archive is considered unpacked without being read. The archive is only hashed
+        when its size matches but its modification time does not, as with a fresh copy.
+    required: false
+    default: null
+    version_added: "2.1"
+  stream:
+    description:
+      - When C(src) is a URL, unpack the tar file while it is downloaded instead of saving
+        it first, so it is never written to disk and unpacking overlaps the download.
+      - The archive is downloaded on every run. Cannot be used with C(manifest) or C(checksum),
+        and only works with tar files.
+    required: false
+    choices: [ "yes", "no" ]
+    default: "no"
+    version_added: "2.1"
+  checksum:
+    description:
+      - 'Checksum of the archive downloaded from a URL, in the format <algorithm>:<checksum>,
+        e.g. C(sha256:D98291AC[...]B6DC7B97). The digest is computed while the archive is
+        downloaded, and the module fails when it does not match.'
+      - Cannot be used with C(stream), which would unpack the archive before it is verified.
+      - The digest of downloads is returned as C(download_checksum), sha1 unless set here.
+    required: false
+    default: null
+    version_added: "2.1"
+  include:
+    description:
+      - List of shell-style globs. When set, only the members whose path in the archive
+        matches one of them are unpacked, checked and returned in C(files). A leading C(./)
+        is ignored, and C(*) also matches C(/).
+    required: false
+    default: null
+    version_added: "2.1"
+  exclude:
+    description:
+      - List of shell-style globs of members not to unpack, matched like C(include).
+    required: false
+    default: null
+    version_added: "2.1"
 author: "Dylan Martin (@pileofrogs)"
 todo:
-    - detect changed/unchanged for .zip files
     - handle common unarchive args, like preserve owner/timestamp etc...
 notes:
-    - requires C(tar)/C(unzip) command on target host
+    - requires C(tar) command on target host for tar files Python's tarfile module cannot read
     - can handle I(gzip), I(bzip2) and I(xz) compressed as well as uncompressed tar files
     - detects type of archive automatically
-    - uses tar's C(--diff arg) to calculate if changed or not. If this C(arg) is not
-      supported, it will always unpack the archive
-    - does not detect if a .zip file is different from destination - always unzips
+    - tar files are read in-process with Python's tarfile module, decompressing the archive
+      once. Members are compared with the destination by type, size, modification time, mode
+      and (as root) ownership, and only the members that differ are extracted
+    - I(gzip), I(bzip2), I(xz) and I(zstd) compressed tar files are decompressed on several
+      cores by C(pigz), C(lbzip2) or C(pbzip2), C(pixz) or C(pzstd) when installed, falling
+      back to tarfile itself, then to C(xz) or C(zstd)
+    - other tar files use tar's C(--diff arg) to calculate if changed or not. If this
+      C(arg) is not supported, it will always unpack the archive
+    - .zip files are read in-process with Python's zipfile module. Members are compared with
+      the destination by size and modification time, then by CRC when only the modification
+      time differs, and only the members that differ are extracted
     - existing files/directories in the destination which are not in the archive
       are not touched.  This is the same behavior as a normal archive extraction
     - existing files/directories in the destination which are not in the archive
@@ -85,61 +136,267 @@ EXAMPLES = '''
 
 # Unarchive a file that needs to be downloaded (added in 2.0)
 - unarchive: src=https://example.com/example.zip dest=/usr/local/bin copy=no
+
+# Unpack a release while it is downloaded
+- unarchive: src=https://example.com/release.tar.gz dest=/opt/app copy=no stream=yes
+
+# Verify a release before it is unpacked
+- unarchive: src=https://example.com/release.tar.gz dest=/opt/app copy=no checksum=sha256:b1b6cbb8[...]d3f4c0b6
+
+# Only unpack the binaries and configuration out of a large bundle
+- unarchive: src=/srv/bundle.tar.xz dest=/opt/app copy=no
+  args:
+    include: [ "bin/*", "etc/*" ]
+    exclude: [ "*.debug" ]
+
+# Skip reading a large release tarball again while it and its files are unchanged
+- unarchive: src=/srv/releases/app.tar.gz dest=/opt/app copy=no manifest=.unarchive-manifest
 '''
 
 import re
 import os
+import binascii
+import fnmatch
+import grp
+import pwd
+import shutil
+import signal
+import stat
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
 from zipfile import ZipFile
 
+# compressions tarfile can read in-process
+TARFILE_MODES = set([''])
+try:
+    __import__('zlib')
+    TARFILE_MODES.add('gz')
+except ImportError:
+    pass
+try:
+    __import__('bz2')
+    TARFILE_MODES.add('bz2')
+except ImportError:
+    pass
+try:
+    __import__('lzma')
+    TARFILE_MODES.add('xz')
+except ImportError:
+    pass
+
 # String from tar that shows the tar contents are different from the
 # filesystem
 DIFFERENCE_RE = re.compile(r': (.*) differs$')
 # When downloading an archive, how much of the archive to download before
 # saving to a tempfile (64k)
 BUFSIZE = 65536
+# Compressed tar files by magic number: the commands decompressing them on
+# several cores, the tarfile mode reading them in-process, and the commands
+# to fall back to when tarfile cannot read them. Commands read the archive
+# on stdin and write the tar stream to stdout.
+TAR_COMPRESSIONS = (
+    ('\x1f\x8b', [['pigz', '-dc']], 'gz', []),
+    ('BZh', [['lbzip2', '-dc'], ['pbzip2', '-dc']], 'bz2', []),
+    ('\xfd7zXZ\x00', [['pixz', '-d']], 'xz', [['xz', '-dc']]),
+    ('\x28\xb5\x2f\xfd', [['pzstd', '-dc']], None, [['zstd', '-dc']]),
+)
 
 class UnarchiveError(Exception):
     pass
 
-# class to handle .zip files
+def member_selected(name, include, exclude):
+    ''' whether a member matches the include globs and none of the exclude globs '''
+    name = name.lstrip('/')
+    while name.startswith('./'):
+        name = name[2:]
+    name = name.rstrip('/')
+    if include and not [ p for p in include if fnmatch.fnmatch(name, p) ]:
+        return False
+    return not [ p for p in exclude if fnmatch.fnmatch(name, p) ]
+
+def resolves_inside(dest, path):
+    ''' whether path stays inside dest once symbolic links are resolved '''
+    dest = os.path.realpath(dest)
+    path = os.path.realpath(path)
+    return path == dest or path.startswith(os.path.join(dest, ''))
+
+# class to handle .zip files in-process with zipfile. The central directory
+# is read once, and members are compared with dest by size and mtime, then
+# by CRC when only the mtime differs. Only the members that differ are
+# extracted.
 class ZipArchive(object):
 
     def __init__(self, src, dest, module):
         self.src = src
         self.dest = dest
         self.module = module
-        self.cmd_path = self.module.get_bin_path('unzip')
+        self.include = module.params['include'] or []
+        self.exclude = module.params['exclude'] or []
         self._files_in_archive = []
+        self._infolist = None
+        self._differ = None
+        self._deferred = []
 
     @property
     def files_in_archive(self, force_refresh=False):
         if self._files_in_archive and not force_refresh:
             return self._files_in_archive
 
-        archive = ZipFile(self.src)
+        self._files_in_archive = [ info.filename for info in self.infolist ]
+        return self._files_in_archive
+
+    @property
+    def infolist(self):
+        ''' the selected members, read from the central directory once '''
+        if self._infolist is None:
+            try:
+                archive = ZipFile(self.src)
+                try:
+                    infolist = archive.infolist()
+                finally:
+                    archive.close()
+            except:
+                raise UnarchiveError('Unable to list files in the archive')
+            self._infolist = [ info for info in infolist
+                               if member_selected(info.filename, self.include, self.exclude) ]
+        return self._infolist
+
+    def _path(self, info):
+        ''' strip leading slashes like unzip does and refuse members outside dest '''
+        dest = os.path.normpath(self.dest)
+        path = os.path.normpath(os.path.join(dest, info.filename.lstrip('/')))
+        if path != dest and not path.startswith(os.path.join(dest, '')):
+            raise UnarchiveError('Archive member %s would be extracted outside of %s' % (info.filename, self.dest))
+        return path
+
+    def _unix_mode(self, info):
+        # only archives made on unix keep the file type and permissions
+        if info.create_system == 3:
+            return info.external_attr >> 16
+        return 0
+
+    def _crc(self, path):
+        crc = 0
+        f = open(path, 'rb')
         try:
-            self._files_in_archive = archive.namelist()
-        except:
-            raise UnarchiveError('Unable to list files in the archive')
+            data = f.read(BUFSIZE)
+            while data:
+                crc = binascii.crc32(data, crc)
+                data = f.read(BUFSIZE)
+        finally:
+            f.close()
+        return crc & 0xffffffff
 
-        return self._files_in_archive
+    def _differs(self, archive, info, path, mode):
+        try:
+            st = os.lstat(path)
+        except OSError:
+            return True
+
+        unix_mode = self._unix_mode(info)
+        if info.filename.endswith('/'):
+            if not stat.S_ISDIR(st.st_mode):
+                return True
+        elif stat.S_ISLNK(unix_mode):
+            return not stat.S_ISLNK(st.st_mode) or os.readlink(path) != archive.read(info)
+        else:
+            if not stat.S_ISREG(st.st_mode) or st.st_size != info.file_size:
+                return True
+            mtime = int(time.mktime(info.date_time + (0, 0, -1)))
+            if int(st.st_mtime) != mtime and self._crc(path) != info.CRC:
+                return True
+
+        # Differences in what we're setting anyway do not count
+        if mode is None and unix_mode & 0777 and not stat.S_ISLNK(unix_mode) \
+           and stat.S_IMODE(st.st_mode) != unix_mode & 0777:
+            return True
+        return False
 
     def is_unarchived(self, mode, owner, group):
-        return dict(unarchived=False)
+        try:
+            archive = ZipFile(self.src)
+            try:
+                self._differ = [ info for info in self.infolist
+                                 if self._differs(archive, info, self._path(info), mode) ]
+            finally:
+                archive.close()
+        except Exception, e:
+            self._differ = None
+            return dict(unarchived=False, err=str(e))
+        if self._differ:
+            return dict(unarchived=False, differs=self._differ[0].filename)
+        return dict(unarchived=True)
+
+    def _extract(self, archive, info, path, last=False):
+        unix_mode = self._unix_mode(info)
+        if not resolves_inside(self.dest, os.path.dirname(path)):
+            raise UnarchiveError('Archive member %s would be extracted outside of %s through a symbolic link' % (info.filename, self.dest))
+        if stat.S_ISLNK(unix_mode) and not last \
+           and not resolves_inside(self.dest, os.path.join(os.path.dirname(path), archive.read(info))):
+            # made last, so that no later member is written through it
+            self._deferred.append(info)
+            return False
+        if os.path.lexists(path) and not (info.filename.endswith('/') and os.path.isdir(path)
+                                          and not os.path.islink(path)):
+            if os.path.isdir(path) and not os.path.islink(path):
+                os.rmdir(path)
+            else:
+                os.unlink(path)
+
+        if info.filename.endswith('/'):
+            if not os.path.isdir(path):
+                os.makedirs(path)
+        else:
+            parent = os.path.dirname(path)
+            if not os.path.isdir(parent):
+                os.makedirs(parent)
+            if stat.S_ISLNK(unix_mode):
+                os.symlink(archive.read(info), path)
+                return True
+            source = archive.open(info)
+            try:
+                target = open(path, 'wb')
+                try:
+                    shutil.copyfileobj(source, target, BUFSIZE)
+                finally:
+                    target.close()
+            finally:
+                source.close()
+            mtime = time.mktime(info.date_time + (0, 0, -1))
+            os.utime(path, (mtime, mtime))
+        if unix_mode & 0777:
+            os.chmod(path, unix_mode & 0777)
+        return True
 
     def unarchive(self):
-        cmd = '%s -o "%s" -d "%s"' % (self.cmd_path, self.src, self.dest)
-        rc, out, err = self.module.run_command(cmd)
-        return dict(cmd=cmd, rc=rc, out=out, err=err)
+        extracted = []
+        try:
+            archive = ZipFile(self.src)
+            try:
+                members = self._differ
+                if members is None:
+                    members = self.infolist
+                for info in members:
+                    if self._extract(archive, info, self._path(info)):
+                        extracted.append(info.filename)
+                for info in self._deferred:
+                    self._extract(archive, info, self._path(info), last=True)
+                    extracted.append(info.filename)
+            finally:
+                archive.close()
+        except Exception, e:
+            return dict(cmd='zipfile', rc=1, out='', err=str(e), extracted=extracted)
+        return dict(cmd='zipfile', rc=0, out='', err='', extracted=extracted)
 
     def can_handle_archive(self):
-        if not self.cmd_path:
+        try:
+            return zipfile.is_zipfile(self.src) and self.infolist is not None
+        except (IOError, UnarchiveError):
             return False
-        cmd = '%s -l "%s"' % (self.cmd_path, self.src)
-        rc, out, err = self.module.run_command(cmd)
-        if rc == 0:
-            return True
-        return False
 
 
 # class to handle gzipped tar files
@@ -155,7 +412,11 @@ class TgzArchive(object):
             # Fallback to tar
             self.cmd_path = self.module.get_bin_path('tar')
         self.zipflag = 'z'
+        self.include = module.params['include'] or []
+        self.exclude = module.params['exclude'] or []
         self._files_in_archive = []
+        self._listed = 0
+        self._member_args = None
 
     @property
     def files_in_archive(self, force_refresh=False):
@@ -169,11 +430,27 @@ class TgzArchive(object):
 
         for filename in out.splitlines():
             if filename:
-                self._files_in_archive.append(filename)
+                self._listed += 1
+                if member_selected(filename, self.include, self.exclude):
+                    self._files_in_archive.append(filename)
         return self._files_in_archive
 
+    @property
+    def member_args(self):
+        ''' tar arguments restricting it to the selected members '''
+        if self._member_args is None:
+            self._member_args = ''
+            if self.include or self.exclude:
+                fd, listfile = tempfile.mkstemp()
+                self.module.add_cleanup_file(listfile)
+                f = os.fdopen(fd, 'w')
+                f.write(''.join([ '%s\n' % name for name in self.files_in_archive ]))
+                f.close()
+                self._member_args = ' --no-recursion -T "%s"' % listfile
+        return self._member_args
+
     def is_unarchived(self, mode, owner, group):
-        cmd = '%s -C "%s" --diff -%sf "%s"' % (self.cmd_path, self.dest, self.zipflag, self.src)
+        cmd = '%s -C "%s" --diff -%sf "%s"%s' % (self.cmd_path, self.dest, self.zipflag, self.src, self.member_args)
         rc, out, err = self.module.run_command(cmd)
         unarchived = (rc == 0)
         if not unarchived:
@@ -204,7 +481,7 @@ class TgzArchive(object):
         return dict(unarchived=unarchived, rc=rc, out=out, err=err, cmd=cmd)
 
     def unarchive(self):
-        cmd = '%s -x%sf "%s"' % (self.cmd_path, self.zipflag, self.src)
+        cmd = '%s -x%sf "%s"%s' % (self.cmd_path, self.zipflag, self.src, self.member_args)
         rc, out, err = self.module.run_command(cmd, cwd=self.dest)
         return dict(cmd=cmd, rc=rc, out=out, err=err)
 
@@ -213,7 +490,7 @@ class TgzArchive(object):
             return False
 
         try:
-            if self.files_in_archive:
+            if self.files_in_archive or self._listed:
                 return True
         except UnarchiveError:
             pass
@@ -243,9 +520,540 @@ class TarXzArchive(TgzArchive):
         self.zipflag = 'J'
 
 
+# class to handle tar files in-process with tarfile. The archive is
+# decompressed once: members are compared with dest until one differs, and
+# extraction carries on from that member in the same stream, writing only
+# the members that differ.
+class TarFileArchive(object):
+
+    def __init__(self, src, dest, module):
+        self.src = src
+        self.dest = dest
+        self.module = module
+        self.include = module.params['include'] or []
+        self.exclude = module.params['exclude'] or []
+        self.decompress_cmd = None
+        self.mode = ''
+        self._files_in_archive = []
+        self._tar = None
+        self._members = None
+        self._fileobj = None
+        self._proc = None
+        self._errors = None
+        self._pending = None
+        self._deferred = []
+        self._complete = False
+        self._wanted = (None, None, None)
+        self._is_root = os.geteuid() == 0
+
+    @property
+    def files_in_archive(self, force_refresh=False):
+        if self._complete and not force_refresh:
+            return self._files_in_archive
+
+        self._files_in_archive = []
+        try:
+            self._open()
+            try:
+                member = self._next_selected()
+                while member is not None:
+                    self._path(member)
+                    self._record(member)
+                    member = self._next_selected()
+            except:
+                self._close(False)
+                raise
+            self._close(True)
+        except Exception:
+            raise UnarchiveError('Unable to list files in the archive')
+        self._complete = True
+        return self._files_in_archive
+
+    def _open(self):
+        infile = open(self.src, 'rb')
+        if self.decompress_cmd:
+            try:
+                self._errors = tempfile.TemporaryFile()
+                self._proc = subprocess.Popen(self.decompress_cmd, stdin=infile,
+                                              stdout=subprocess.PIPE,
+                                              stderr=self._errors,
+                                              close_fds=True)
+            finally:
+                infile.close()
+            self._fileobj = self._proc.stdout
+        else:
+            self._fileobj = infile
+        self._tar = tarfile.open(fileobj=self._fileobj, mode='r|' + self.mode)
+        # the same iterator must be kept, a new one would start over
+        self._members = iter(self._tar)
+
+    def _close(self, finished):
+        '''
+        close the archive. When finished, the decompressor is left to exit on
+        its own and its failures are raised.
+        '''
+        if self._tar is not None:
+            self._tar.close()
+        proc, fileobj = self._proc, self._fileobj
+        self._tar = self._members = self._proc = self._fileobj = None
+        if proc is None:
+            if fileobj is not None:
+                fileobj.close()
+            return
+
+        if finished:
+            # tar stops reading at its end of archive marker
+            while proc.stdout.read(BUFSIZE):
+                pass
+        else:
+            try:
+                os.kill(proc.pid, signal.SIGTERM)
+            except OSError:
+                pass
+        proc.stdout.close()
+        rc = proc.wait()
+        self._errors.seek(0)
+        errors = self._errors.read()
+        self._errors.close()
+        if finished and rc != 0:
+            raise UnarchiveError('%s failed: %s' % (' '.join(self.decompress_cmd), errors))
+
+    def _next_member(self):
+        try:
+            return self._members.next()
+        except StopIteration:
+            return None
+
+    def _next_selected(self):
+        member = self._next_member()
+        while member is not None and not member_selected(member.name, self.include, self.exclude):
+            member = self._next_member()
+        return member
+
+    def _record(self, member):
+        name = member.name
+        if member.isdir() and not name.endswith('/'):
+            name += '/'
+        self._files_in_archive.append(name)
+
+    def _path(self, member):
+        ''' strip leading slashes like tar does and refuse members outside dest '''
+        member.name = member.name.lstrip('/')
+        if member.islnk():
+            member.linkname = member.linkname.lstrip('/')
+        dest = os.path.normpath(self.dest)
+        path = os.path.normpath(os.path.join(dest, member.name))
+        if path != dest and not path.startswith(os.path.join(dest, '')):
+            raise UnarchiveError('Archive member %s would be extracted outside of %s' % (member.name, self.dest))
+        return path
+
+    def _owner_ids(self, member):
+        ''' the uid and gid tarfile gives the extracted member '''
+        try:
+            uid = pwd.getpwnam(member.uname)[2]
+        except KeyError:
+            uid = member.uid
+        try:
+            gid = grp.getgrnam(member.gname)[2]
+        except KeyError:
+            gid = member.gid
+        return uid, gid
+
+    def _differs(self, member, path):
+        mode, owner, group = self._wanted
+        try:
+            st = os.lstat(path)
+        except OSError:
+            return True
+
+        if member.isdir():
+            if not stat.S_ISDIR(st.st_mode):
+                return True
+        elif member.issym():
+            return not stat.S_ISLNK(st.st_mode) or os.readlink(path) != member.linkname
+        elif member.islnk():
+            try:
+                target = os.lstat(os.path.join(self.dest, member.linkname))
+            except OSError:
+                return True
+            if (st.st_dev, st.st_ino) != (target.st_dev, target.st_ino):
+                return True
+        elif member.isreg():
+            if not stat.S_ISREG(st.st_mode) or st.st_size != member.size \
+               or int(st.st_mtime) != int(member.mtime):
+                return True
+        elif member.ischr():
+            if not stat.S_ISCHR(st.st_mode):
+                return True
+        elif member.isblk():
+            if not stat.S_ISBLK(st.st_mode):
+                return True
+        elif member.isfifo():
+            if not stat.S_ISFIFO(st.st_mode):
+                return True
+
+        # Differences in what we're setting anyway do not count
+        if mode is None and stat.S_IMODE(st.st_mode) != member.mode & 07777:
+            return True
+        if self._is_root and (owner is None or group is None):
+            uid, gid = self._owner_ids(member)
+            if owner is None and st.st_uid != uid:
+                return True
+            if group is None and st.st_gid != gid:
+                return True
+        return False
+
+    def _extract(self, member, path, last=False):
+        if not resolves_inside(self.dest, os.path.dirname(path)):
+            raise UnarchiveError('Archive member %s would be extracted outside of %s through a symbolic link' % (member.name, self.dest))
+        if member.islnk():
+            target = os.path.join(self.dest, member.linkname)
+            if not resolves_inside(self.dest, target):
+                raise UnarchiveError('Hard link %s points to %s, outside of %s' % (member.name, member.linkname, self.dest))
+            if not os.path.lexists(target):
+                # the stream cannot go back to the data of the target
+                raise UnarchiveError('Hard link %s points to %s, which is not unpacked' % (member.name, member.linkname))
+        if member.issym() and not last \
+           and not resolves_inside(self.dest, os.path.join(os.path.dirname(path), member.linkname)):
+            # made last, so that no later member is written through it
+            self._deferred.append(member)
+            return False
+        if os.path.lexists(path) and not (member.isdir() and os.path.isdir(path)
+                                          and not os.path.islink(path)):
+            if os.path.isdir(path) and not os.path.islink(path):
+                os.rmdir(path)
+            else:
+                os.unlink(path)
+        self._tar.extract(member, self.dest)
+        return True
+
+    def is_unarchived(self, mode, owner, group):
+        self._wanted = (mode, owner, group)
+        self._files_in_archive = []
+        try:
+            self._open()
+            member = self._next_selected()
+            while member is not None:
+                path = self._path(member)
+                self._record(member)
+                if self._differs(member, path):
+                    self._pending = member
+                    return dict(unarchived=False, differs=member.name)
+                member = self._next_selected()
+            self._close(True)
+        except Exception, e:
+            self._close(False)
+            return dict(unarchived=False, err=str(e))
+        self._complete = True
+        return dict(unarchived=True)
+
+    def unarchive(self):
+        cmd = 'tarfile'
+        if self.decompress_cmd:
+            cmd = '%s | tarfile' % ' '.join(self.decompress_cmd)
+        extracted = []
+        try:
+            try:
+                if self._pending is not None:
+                    # is_unarchived stopped at the first member that differs
+                    member = self._pending
+                    self._pending = None
+                    if self._extract(member, self._path(member)):
+                        extracted.append(member.name)
+                else:
+                    # is_unarchived was not run or failed, start over
+                    self._files_in_archive = []
+                    self._open()
+                member = self._next_selected()
+                while member is not None:
+                    path = self._path(member)
+                    self._record(member)
+                    if self._differs(member, path) and self._extract(member, path):
+                        extracted.append(member.name)
+                    member = self._next_selected()
+                for member in self._deferred:
+                    self._extract(member, self._path(member), last=True)
+                    extracted.append(member.name)
+                self._close(True)
+            except:
+                self._close(False)
+                raise
+        except Exception, e:
+            return dict(cmd=cmd, rc=1, out='', err=str(e), extracted=extracted)
+        self._complete = True
+        return dict(cmd=cmd, rc=0, out='', err='', extracted=extracted)
+
+    def can_handle_archive(self):
+        try:
+            infile = open(self.src, 'rb')
+            try:
+                magic = infile.read(6)
+            finally:
+                infile.close()
+        except IOError:
+            return False
+
+        if not self._pick_decompressor(magic):
+            return False
+
+        # make sure it is a tar file
+        try:
+            self._open()
+            self._close(False)
+        except Exception:
+            self._close(False)
+            return False
+        return True
+
+    def _pick_decompressor(self, magic):
+        parallel, mode, serial = [], '', []
+        for prefix, parallel_cmds, tarfile_mode, serial_cmds in TAR_COMPRESSIONS:
+            if magic.startswith(prefix):
+                parallel, mode, serial = parallel_cmds, tarfile_mode, serial_cmds
+                break
+
+        # decompress on several cores when possible, then in-process
+        self.decompress_cmd = None
+        for cmd in parallel + [None] + serial:
+            if cmd is None:
+                if mode in TARFILE_MODES:
+                    self.mode = mode
+                    break
+            elif self.module.get_bin_path(cmd[0]):
+                self.decompress_cmd = [self.module.get_bin_path(cmd[0])] + cmd[1:]
+                break
+        else:
+            return False
+        return True
+
+
+# class to handle tar files while they are downloaded, without saving them
+# first. The download can only be read once, so it is compared and unpacked
+# in the single pass TarFileArchive makes anyway.
+class TarStreamArchive(TarFileArchive):
+
+    def __init__(self, src, dest, module, reader):
+        super(TarStreamArchive, self).__init__(src, dest, module)
+        self.reader = reader
+        self._opened = False
+        self._feeder = None
+        self._feed_error = None
+
+    @property
+    def files_in_archive(self, force_refresh=False):
+        if not self._complete or force_refresh:
+            raise UnarchiveError('The download of %s can only be read once' % self.src)
+        return self._files_in_archive
+
+    def _open(self):
+        if self._opened:
+            raise UnarchiveError('The download of %s can only be read once' % self.src)
+        self._opened = True
+        if self.decompress_cmd:
+            self._errors = tempfile.TemporaryFile()
+            self._proc = subprocess.Popen(self.decompress_cmd, stdin=subprocess.PIPE,
+                                          stdout=subprocess.PIPE, stderr=self._errors,
+                                          close_fds=True)
+            self._feeder = threading.Thread(target=self._feed, args=(self._proc.stdin,))
+            self._feeder.setDaemon(True)
+            self._feeder.start()
+            self._fileobj = self._proc.stdout
+        else:
+            self._fileobj = self.reader
+        self._tar = tarfile.open(fileobj=self._fileobj, mode='r|' + self.mode)
+        self._members = iter(self._tar)
+
+    def _feed(self, stdin):
+        try:
+            try:
+                data = self.reader.read(BUFSIZE)
+                while data:
+                    stdin.write(data)
+                    data = self.reader.read(BUFSIZE)
+            finally:
+                stdin.close()
+        except Exception, e:
+            self._feed_error = e
+
+    def _close(self, finished):
+        if finished and self._proc is None and self._fileobj is not None:
+            # the digest covers the whole download
+            self.reader.drain()
+        super(TarStreamArchive, self)._close(finished)
+        feeder, self._feeder = self._feeder, None
+        if finished and feeder is not None:
+            feeder.join()
+            if self._feed_error is not None:
+                raise UnarchiveError('Failure downloading %s, %s' % (self.src, self._feed_error))
+
+    def can_handle_archive(self):
+        header = self.reader.peek(262)
+        if not self._pick_decompressor(header):
+            return False
+        # without trying to open it, an uncompressed tar file is only
+        # recognized by the magic of POSIX and GNU headers
+        return self.decompress_cmd is not None or self.mode != '' or header[257:262] == 'ustar'
+
+
+class DownloadReader(object):
+    '''
+    File-like reader of a download, hashing the bytes that go through it.
+    Bytes looked at with peek are returned again by the next reads.
+    '''
+
+    def __init__(self, rsp, algorithm):
+        self.rsp = rsp
+        self.digest = AVAILABLE_HASH_ALGORITHMS[algorithm]()
+        self.size = 0
+        self._buffered = ''
+
+    def peek(self, size):
+        while len(self._buffered) < size:
+            data = self.rsp.read(size - len(self._buffered))
+            if not data:
+                break
+            self._buffered += data
+        return self._buffered[:size]
+
+    def read(self, size=-1):
+        if self._buffered:
+            if size < 0 or size >= len(self._buffered):
+                data, self._buffered = self._buffered, ''
+            else:
+                data, self._buffered = self._buffered[:size], self._buffered[size:]
+        elif size < 0:
+            data = self.rsp.read()
+        else:
+            data = self.rsp.read(size)
+        self.digest.update(data)
+        self.size += len(data)
+        return data
+
+    def drain(self):
+        while self.read(BUFSIZE):
+            pass
+
+    def close(self):
+        self.rsp.close()
+
+
+def parse_checksum(module, checksum):
+    ''' split algorithm:digest, defaulting to sha1 with nothing to verify '''
+    if not checksum:
+        return 'sha1', None
+    try:
+        algorithm, expected = checksum.rsplit(':', 1)
+    except ValueError:
+        module.fail_json(msg="The checksum parameter has to be in format <algorithm>:<checksum>")
+    if algorithm not in AVAILABLE_HASH_ALGORITHMS:
+        module.fail_json(msg="Unsupported checksum algorithm %s" % algorithm)
+    return algorithm, expected.lower()
+
+
+def download(module, src, algorithm):
+    ''' open src, returning a reader hashing the download as it is read '''
+    rsp, info = fetch_url(module, src)
+    if rsp is None or info['status'] != 200:
+        module.fail_json(msg="Failure downloading %s, %s" % (src, info['msg']))
+    return DownloadReader(rsp, algorithm)
+
+
+def archive_identity(st):
+    return dict(size=st.st_size, mtime=st.st_mtime)
+
+def load_manifest(path):
+    ''' read the manifest, returning an empty one if it is missing or unreadable '''
+    try:
+        infile = open(path, 'r')
+        try:
+            manifest = json.load(infile)
+        finally:
+            infile.close()
+    except (IOError, ValueError):
+        return {}
+    if not isinstance(manifest, dict):
+        return {}
+    return manifest
+
+def save_manifest(path, manifest):
+    ''' atomically replace the manifest, ignoring errors as the next run reads the archive again '''
+    try:
+        (fd, tmppath) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    except (IOError, OSError):
+        return
+    try:
+        outfile = os.fdopen(fd, 'w')
+        try:
+            json.dump(manifest, outfile)
+        finally:
+            outfile.close()
+        os.rename(tmppath, path)
+    except (IOError, OSError):
+        try:
+            os.unlink(tmppath)
+        except OSError:
+            pass
+
+def manifest_files(module, manifest_path, src, dest, selection):
+    '''
+    Return the members recorded in the manifest if they were unpacked from
+    this archive and are all still in dest with their recorded size, or
+    None if the archive has to be looked at.
+    '''
+    manifest = load_manifest(manifest_path)
+    archive = manifest.get('archive')
+    members = manifest.get('members')
+    if not isinstance(archive, dict) or not isinstance(members, list):
+        return None
+    if manifest.get('selection') != selection:
+        return None
+
+    identity = archive_identity(os.stat(src))
+    if identity['size'] != archive.get('size'):
+        return None
+    touched = identity['mtime'] != archive.get('mtime')
+    if touched and module.sha1(src) != archive.get('checksum'):
+        return None
+
+    files = []
+    for member in members:
+        try:
+            name, size = member
+            st = os.lstat(os.path.join(dest, name))
+        except (TypeError, ValueError, OSError):
+            return None
+        if size is not None and st.st_size != size:
+            return None
+        files.append(name)
+
+    if touched:
+        # same contents, remember the new mtime to skip hashing next time
+        archive['mtime'] = identity['mtime']
+        try:
+            save_manifest(manifest_path, manifest)
+        except (IOError, OSError):
+            pass
+    return files
+
+def build_manifest(module, src, dest, files, selection):
+    members = []
+    for name in files:
+        size = None
+        try:
+            st = os.lstat(os.path.join(dest, name))
+            if stat.S_ISREG(st.st_mode):
+                size = st.st_size
+        except OSError:
+            pass
+        members.append([name, size])
+    archive = archive_identity(os.stat(src))
+    archive['checksum'] = module.sha1(src)
+    return dict(archive=archive, members=members, selection=selection)
+
+
 # try handlers in order and return the one that works or bail if none work
 def pick_handler(src, dest, module):
-    handlers = [TgzArchive, ZipArchive, TarArchive, TarBzipArchive, TarXzArchive]
+    handlers = [TarFileArchive, ZipArchive, TgzArchive, TarArchive, TarBzipArchive, TarXzArchive]
     for handler in handlers:
         obj = handler(src, dest, module)
         if obj.can_handle_archive():
@@ -253,6 +1061,32 @@ def pick_handler(src, dest, module):
     module.fail_json(msg='Failed to find handler to unarchive. Make sure the required command to extract the file is installed.')
 
 
+def unpack(module, src, dest, file_args, handler=None):
+    if handler is None:
+        handler = pick_handler(src, dest, module)
+
+    res_args = dict(handler=handler.__class__.__name__, dest=dest, src=src)
+
+    # do we need to do unpack?
+    res_args['check_results'] = handler.is_unarchived(file_args['mode'],
+            file_args['owner'], file_args['group'])
+    if res_args['check_results']['unarchived']:
+        res_args['changed'] = False
+    else:
+        # do the unpack
+        try:
+            res_args['extract_results'] = handler.unarchive()
+            if res_args['extract_results']['rc'] != 0:
+                module.fail_json(msg="failed to unpack %s to %s" % (src, dest), **res_args)
+        except IOError:
+            module.fail_json(msg="failed to unpack %s to %s" % (src, dest))
+        else:
+            res_args['changed'] = True
+
+    res_args['files_in_archive'] = handler.files_in_archive
+    return res_args
+
+
 def main():
     module = AnsibleModule(
         # not checking because of daisy chain to file module
@@ -263,6 +1097,11 @@ def main():
             copy              = dict(default=True, type='bool'),
             creates           = dict(required=False),
             list_files          = dict(required=False, default=False, type='bool'),
+            manifest          = dict(required=False, type='path'),
+            include           = dict(required=False, type='list'),
+            exclude           = dict(required=False, type='list'),
+            stream            = dict(default=False, type='bool'),
+            checksum          = dict(required=False),
         ),
         add_file_common_args=True,
     )
@@ -271,21 +1110,36 @@ def main():
     dest   = os.path.expanduser(module.params['dest'])
     copy   = module.params['copy']
     file_args = module.load_file_common_arguments(module.params)
+    algorithm, expected_checksum = parse_checksum(module, module.params['checksum'])
+    reader = None
+    stream = False
+
+    # is dest OK to receive tar file?
+    if not os.path.isdir(dest):
+        module.fail_json(msg="Destination '%s' is not a directory" % dest)
 
     # did tar file arrive?
     if not os.path.exists(src):
         if copy:
             module.fail_json(msg="Source '%s' failed to transfer" % src)
         # If copy=false, and src= contains ://, try and download the file to a temp directory.
+        elif '://' in src and module.params['stream']:
+            if module.params['manifest']:
+                module.fail_json(msg="manifest cannot be used with stream, the archive is not kept")
+            if expected_checksum:
+                module.fail_json(msg="checksum cannot be used with stream, the archive would be unpacked before it is verified")
+            # unpack the archive while it is downloaded
+            reader = download(module, src, algorithm)
+            stream = True
         elif '://' in src:
             tempdir = os.path.dirname(__file__)
             package = os.path.join(tempdir, str(src.rsplit('/', 1)[1]))
             try:
-                rsp, info = fetch_url(module, src)
+                reader = download(module, src, algorithm)
                 f = open(package, 'w')
                 # Read 1kb at a time to save on ram
                 while True:
-                    data = rsp.read(BUFSIZE)
+                    data = reader.read(BUFSIZE)
 
                     if data == "":
                         break # End of file, break while loop
@@ -295,44 +1149,49 @@ def main():
                 src = package
             except Exception, e:
                 module.fail_json(msg="Failure downloading %s, %s" % (src, e))
+            if expected_checksum and reader.digest.hexdigest() != expected_checksum:
+                module.fail_json(msg="The checksum of %s did not match %s: %s" % (module.params['src'], expected_checksum, reader.digest.hexdigest()))
         else:
             module.fail_json(msg="Source '%s' does not exist" % src)
-    if not os.access(src, os.R_OK):
-        module.fail_json(msg="Source '%s' not readable" % src)
 
-    # skip working with 0 size archives
-    try:
-        if os.path.getsize(src) == 0:
-            module.fail_json(msg="Invalid archive '%s', the file is 0 bytes" % src)
-    except Exception, e:
-        module.fail_json(msg="Source '%s' not readable" % src)
+    if not stream:
+        if not os.access(src, os.R_OK):
+            module.fail_json(msg="Source '%s' not readable" % src)
 
-    # is dest OK to receive tar file?
-    if not os.path.isdir(dest):
-        module.fail_json(msg="Destination '%s' is not a directory" % dest)
-
-    handler = pick_handler(src, dest, module)
+        # skip working with 0 size archives
+        try:
+            if os.path.getsize(src) == 0:
+                module.fail_json(msg="Invalid archive '%s', the file is 0 bytes" % src)
+        except Exception, e:
+            module.fail_json(msg="Source '%s' not readable" % src)
 
-    res_args = dict(handler=handler.__class__.__name__, dest=dest, src=src)
+    selection = dict(include=module.params['include'] or [], exclude=module.params['exclude'] or [])
+    manifest_path = module.params['manifest']
+    files_in_archive = None
+    if manifest_path:
+        manifest_path = os.path.join(dest, manifest_path)
+        files_in_archive = manifest_files(module, manifest_path, src, dest, selection)
 
-    # do we need to do unpack?
-    res_args['check_results'] = handler.is_unarchived(file_args['mode'],
-            file_args['owner'], file_args['group'])
-    if res_args['check_results']['unarchived']:
-        res_args['changed'] = False
+    if files_in_archive is not None:
+        # unpacked by an earlier run, no need to read the archive
+        res_args = dict(handler='manifest', dest=dest, src=src, changed=False,
+                        check_results=dict(unarchived=True, manifest=manifest_path))
     else:
-        # do the unpack
-        try:
-            res_args['extract_results'] = handler.unarchive()
-            if res_args['extract_results']['rc'] != 0:
-                module.fail_json(msg="failed to unpack %s to %s" % (src, dest), **res_args)
-        except IOError:
-            module.fail_json(msg="failed to unpack %s to %s" % (src, dest))
-        else:
-            res_args['changed'] = True
+        handler = None
+        if stream:
+            handler = TarStreamArchive(src, dest, module, reader)
+            if not handler.can_handle_archive():
+                module.fail_json(msg="Only tar files can be unpacked while they are downloaded")
+        res_args = unpack(module, src, dest, file_args, handler)
+        files_in_archive = res_args.pop('files_in_archive')
+        if manifest_path:
+            save_manifest(manifest_path, build_manifest(module, src, dest, files_in_archive, selection))
+
+    if reader is not None:
+        res_args['download_checksum'] = reader.digest.hexdigest()
 
     # do we need to change perms?
-    for filename in handler.files_in_archive:
+    for filename in files_in_archive:
         file_args['path'] = os.path.join(dest, filename)
         try:
             res_args['changed'] = module.set_fs_attributes_if_different(file_args, res_args['changed'])
@@ -340,7 +1199,7 @@ def main():
             module.fail_json(msg="Unexpected error when accessing exploded file: %s" % str(e))
 
     if module.params['list_files']:
-        res_args['files'] = handler.files_in_archive
+        res_args['files'] = files_in_archive
 
     module.exit_json(**res_args)
 
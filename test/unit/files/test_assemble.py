@@ -0,0 +1,46 @@
+import imp
+import os
+
+assemble = imp.load_source('files_assemble', os.path.join(
+    os.path.dirname(__file__), '..', '..', '..', 'files', 'assemble.py'))
+
+
+class TestUnchangedFragments(object):
+    def fragments(self, tmpdir):
+        fragments = assemble.list_fragments(str(tmpdir))
+        recorded = [ assemble.fragment_entry(name, st, assemble.fragment_digest(path))
+                     for (name, path, st) in fragments ]
+        return fragments, recorded
+
+    def test_unchanged(self, tmpdir):
+        tmpdir.join('01-base').write('base\n')
+        tmpdir.join('02-extra').write('extra\n')
+        fragments, recorded = self.fragments(tmpdir)
+        assert assemble.unchanged_fragments(fragments, recorded) == recorded
+
+    def test_touched(self, tmpdir):
+        tmpdir.join('01-base').write('base\n')
+        fragments, recorded = self.fragments(tmpdir)
+        os.utime(str(tmpdir.join('01-base')), (0, 0))
+        fragments = assemble.list_fragments(str(tmpdir))
+        entries = assemble.unchanged_fragments(fragments, recorded)
+        assert entries[0][3] == recorded[0][3]
+        assert entries[0][2] != recorded[0][2]
+
+    def test_changed(self, tmpdir):
+        tmpdir.join('01-base').write('base\n')
+        fragments, recorded = self.fragments(tmpdir)
+        tmpdir.join('01-base').write('BASE\n')
+        os.utime(str(tmpdir.join('01-base')), (0, 0))
+        assert assemble.unchanged_fragments(assemble.list_fragments(str(tmpdir)), recorded) is None
+        tmpdir.join('02-new').write('new\n')
+        assert assemble.unchanged_fragments(assemble.list_fragments(str(tmpdir)), recorded) is None
+
+
+class TestManifest(object):
+    def test_round_trip(self, tmpdir):
+        path = str(tmpdir.join('manifest.json'))
+        assert assemble.load_manifest(path) == {}
+        assemble.save_manifest(path, {'dest': [1, 2]})
+        assert assemble.load_manifest(path) == {'dest': [1, 2]}
+        assemble.save_manifest(str(tmpdir.join('missing', 'manifest.json')), {})
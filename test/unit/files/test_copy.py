@@ -0,0 +1,196 @@
+import imp
+import json
+import os
+
+import mock
+import pytest
+from ansible.module_utils import basic
+
+copy = imp.load_source('files_copy', os.path.join(
+    os.path.dirname(__file__), '..', '..', '..', 'files', 'copy.py'))
+
+
+class AnsibleFail(Exception):
+    pass
+
+
+class AnsibleExit(Exception):
+    pass
+
+
+class TestCopyFiles(object):
+    def setup_method(self, method):
+        self.module = mock.MagicMock()
+        self.module.check_mode = False
+        self.module.params = dict(force=True, workers=2, backup=False, mode=None, remote_src=True,
+                                  validate='visudo -cf %s', checksum_cache=None)
+        self.module.atomic_move.side_effect = os.rename
+        self.module.fail_json.side_effect = AnsibleFail()
+        self.module.exit_json.side_effect = AnsibleExit()
+
+    def test_validate(self, tmpdir):
+        tmpdir.join('good').write('good')
+        tmpdir.join('bad').write('bad')
+        self.module.params.update(src=str(tmpdir), dest=str(tmpdir), files=[
+            dict(src='good', dest='good.conf'),
+            dict(src='bad', dest=str(tmpdir.join('bad.conf'))),
+        ])
+        self.module.run_command.side_effect = \
+            lambda cmd: (open(cmd.split()[-1]).read() == 'good' and (0, '', '') or (1, '', 'syntax error'))
+
+        with pytest.raises(AnsibleFail):
+            copy.copy_files(self.module, ['sha1', 'md5'], None)
+        results = self.module.fail_json.call_args[1]['results']
+        assert not results[0].get('failed')
+        assert results[1]['failed']
+        assert 'syntax error' in results[1]['msg']
+        assert tmpdir.join('good.conf').read() == 'good'
+        assert not tmpdir.join('bad.conf').check()
+        assert sorted(os.listdir(str(tmpdir))) == ['bad', 'good', 'good.conf']
+
+    def test_requires_remote_src(self, tmpdir):
+        self.module.params.update(src=str(tmpdir), dest=str(tmpdir), remote_src=False,
+                                  files=[dict(src='good')])
+        with pytest.raises(AnsibleFail):
+            copy.copy_files(self.module, ['sha1', 'md5'], None)
+        assert 'remote_src' in self.module.fail_json.call_args[1]['msg']
+
+    def test_task_arguments(self, tmpdir, capsys):
+        # the combination the copy action plugin hands to the module unchanged
+        tmpdir.mkdir('staging').join('a.conf').write('a')
+        tmpdir.join('staging', 'b.conf').write('b')
+        tmpdir.mkdir('etc')
+        args = dict(src=str(tmpdir.join('staging')), dest=str(tmpdir.join('etc')), remote_src=True,
+                    files=[dict(src='a.conf'), dict(src='b.conf', dest='c.conf')])
+        basic._ANSIBLE_ARGS = json.dumps(dict(ANSIBLE_MODULE_ARGS=args))
+        with pytest.raises(SystemExit):
+            copy.main()
+        results = json.loads(capsys.readouterr()[0])['results']
+        assert [ r['dest'] for r in results ] == [str(tmpdir.join('etc', 'a.conf')), str(tmpdir.join('etc', 'c.conf'))]
+        assert all(r['changed'] for r in results)
+        assert tmpdir.join('etc', 'c.conf').read() == 'b'
+
+
+class TestChecksumCache(object):
+    def test_round_trip(self, tmpdir):
+        path = str(tmpdir.join('checksums.json'))
+        assert copy.load_checksum_cache(path) == {}
+        copy.save_checksum_cache(path, {'/etc/motd': ['abc']})
+        assert copy.load_checksum_cache(path) == {'/etc/motd': ['abc']}
+        assert os.listdir(str(tmpdir)) == ['checksums.json']
+
+    def test_relative_path(self, tmpdir):
+        with tmpdir.as_cwd():
+            copy.save_checksum_cache('checksums.json', {'a': 1})
+            assert copy.load_checksum_cache('checksums.json') == {'a': 1}
+
+    def test_unusable(self, tmpdir):
+        tmpdir.join('corrupt.json').write('{"a"')
+        assert copy.load_checksum_cache(str(tmpdir.join('corrupt.json'))) == {}
+        copy.save_checksum_cache(str(tmpdir.join('missing', 'checksums.json')), {'a': 1})
+
+    def test_not_written_in_check_mode(self, tmpdir, capsys):
+        tmpdir.join('src').write('same')
+        tmpdir.join('dest').write('same')
+        args = dict(src=str(tmpdir.join('src')), dest=str(tmpdir.join('dest')), remote_src=True,
+                    checksum_cache=str(tmpdir.join('checksums.json')), _ansible_check_mode=True)
+        basic._ANSIBLE_ARGS = json.dumps(dict(ANSIBLE_MODULE_ARGS=args))
+        with pytest.raises(SystemExit):
+            copy.main()
+        assert not json.loads(capsys.readouterr()[0])['changed']
+        assert not tmpdir.join('checksums.json').check()
+
+        args['_ansible_check_mode'] = False
+        basic._ANSIBLE_ARGS = json.dumps(dict(ANSIBLE_MODULE_ARGS=args))
+        with pytest.raises(SystemExit):
+            copy.main()
+        assert tmpdir.join('checksums.json').check()
+
+
+class TestCheckMode(object):
+    def test_remote_src_dest_untouched(self, tmpdir, capsys):
+        tmpdir.join('src').write('new contents')
+        tmpdir.join('dest').write('old')
+        args = dict(src=str(tmpdir.join('src')), dest=str(tmpdir.join('dest')), remote_src=True,
+                    _ansible_check_mode=True)
+        basic._ANSIBLE_ARGS = json.dumps(dict(ANSIBLE_MODULE_ARGS=args))
+        with pytest.raises(SystemExit):
+            copy.main()
+        result = json.loads(capsys.readouterr()[0])
+        assert result['changed']
+        assert result['checksum'] == copy.multi_digest(str(tmpdir.join('src')), ['sha1'])['sha1']
+        assert tmpdir.join('dest').read() == 'old'
+        assert sorted(os.listdir(str(tmpdir))) == ['dest', 'src']
+
+    def test_remote_src_missing_dest(self, tmpdir, capsys):
+        tmpdir.join('src').write('new contents')
+        args = dict(src=str(tmpdir.join('src')), dest=str(tmpdir.join('dest')), remote_src=True,
+                    mode='0600', _ansible_check_mode=True)
+        basic._ANSIBLE_ARGS = json.dumps(dict(ANSIBLE_MODULE_ARGS=args))
+        with pytest.raises(SystemExit):
+            copy.main()
+        assert json.loads(capsys.readouterr()[0])['changed']
+        assert not tmpdir.join('dest').check()
+
+
+class TestRunInPool(object):
+    def test_results_in_order(self):
+        def func(item):
+            if item == 3:
+                raise ValueError(item)
+            return item * 2
+        results = copy.run_in_pool(func, range(6), 3)
+        assert results[:3] == [0, 2, 4] and results[4:] == [8, 10]
+        assert isinstance(results[3], ValueError)
+
+
+class TestDeltaUpdate(object):
+    def files(self, tmpdir, src, dest):
+        tmpdir.join('src').write(src)
+        tmpdir.join('dest').write(dest)
+        return str(tmpdir.join('src')), str(tmpdir.join('dest'))
+
+    def test_changed_block(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(copy, 'BUFSIZE', 4)
+        (src, dest) = self.files(tmpdir, 'aaaabbbbcccc', 'aaaaXbbbcccc')
+        (tmpdest, digests, stats) = copy.delta_update(src, dest, ['sha1'])
+        assert open(dest).read() == 'aaaaXbbbcccc'
+        assert open(tmpdest).read() == 'aaaabbbbcccc'
+        assert os.path.dirname(tmpdest) == str(tmpdir)
+        assert stats == dict(blocks=3, changed_blocks=1, truncated=False)
+        assert digests['sha1'] == copy.multi_digest(src, ['sha1'])['sha1']
+
+    def test_unchanged(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(copy, 'BUFSIZE', 4)
+        (src, dest) = self.files(tmpdir, 'aaaabbbbcc', 'aaaabbbbcc')
+        (tmpdest, digests, stats) = copy.delta_update(src, dest, ['sha1'])
+        assert tmpdest is None
+        assert stats == dict(blocks=3, changed_blocks=0, truncated=False)
+        assert sorted(os.listdir(str(tmpdir))) == ['dest', 'src']
+
+    def test_sizes_differ(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(copy, 'BUFSIZE', 4)
+        (src, dest) = self.files(tmpdir, 'aaaabb', 'aaaabbbbcccc')
+        (tmpdest, digests, stats) = copy.delta_update(src, dest, ['sha1'])
+        assert open(tmpdest).read() == 'aaaabb'
+        assert stats == dict(blocks=2, changed_blocks=0, truncated=True)
+        os.unlink(tmpdest)
+
+        (src, dest) = self.files(tmpdir, 'aaaabbbbcc', 'aaaa')
+        (tmpdest, digests, stats) = copy.delta_update(src, dest, ['sha1'])
+        assert open(tmpdest).read() == 'aaaabbbbcc'
+        assert stats == dict(blocks=3, changed_blocks=2, truncated=False)
+
+    def test_hard_links_untouched(self, tmpdir, capsys):
+        (src, dest) = self.files(tmpdir, 'new contents', 'old contents')
+        os.link(dest, str(tmpdir.join('link')))
+        args = dict(src=src, dest=dest, remote_src=True, delta=True)
+        basic._ANSIBLE_ARGS = json.dumps(dict(ANSIBLE_MODULE_ARGS=args))
+        with pytest.raises(SystemExit):
+            copy.main()
+        result = json.loads(capsys.readouterr()[0])
+        assert result['changed']
+        assert result['delta'] == dict(blocks=1, changed_blocks=1, truncated=False)
+        assert open(dest).read() == 'new contents'
+        assert tmpdir.join('link').read() == 'old contents'
+        assert sorted(os.listdir(str(tmpdir))) == ['dest', 'link', 'src']
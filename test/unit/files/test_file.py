@@ -0,0 +1,178 @@
+import imp
+import json
+import os
+import threading
+import time
+
+import mock
+import pytest
+from ansible.module_utils import basic
+
+file_module = imp.load_source('files_file', os.path.join(
+    os.path.dirname(__file__), '..', '..', '..', 'files', 'file.py'))
+
+
+class TestParallelWalk(object):
+    def test_visit_raises(self):
+        visited = []
+        def visit(dirpath):
+            visited.append(dirpath)
+            if dirpath == '/':
+                return ['/a', '/b']
+            if dirpath == '/a':
+                raise OSError('permission denied')
+            return []
+
+        outcome = []
+        def walk():
+            try:
+                file_module.parallel_walk(['/'], visit, 1)
+            except OSError, e:
+                outcome.append(e)
+        t = threading.Thread(target=walk)
+        t.setDaemon(True)
+        t.start()
+        t.join(10)
+        assert not t.isAlive()
+        assert str(outcome[0]) == 'permission denied'
+        assert sorted(visited) == ['/', '/a', '/b']
+
+
+class TestRemoveTree(object):
+    def tree(self, tmpdir):
+        outside = tmpdir.mkdir('outside')
+        outside.join('keep').write('keep')
+        root = tmpdir.mkdir('root')
+        deep = root.mkdir('a').mkdir('b').mkdir('c')
+        deep.join('file').write('data')
+        deep.join('file').chmod(0400)
+        root.join('a', 'readonly').write('data')
+        root.join('a', 'readonly').chmod(0444)
+        root.join('a').mkdir('empty').chmod(0555)
+        root.join('a', 'b', 'to_file').mksymlinkto(outside.join('keep'))
+        root.join('to_dir').mksymlinkto(outside)
+        root.join('dangling').mksymlinkto(tmpdir.join('missing'))
+        return root, outside
+
+    def test_parallel_rmtree(self, tmpdir):
+        root, outside = self.tree(tmpdir)
+        assert file_module.parallel_rmtree(str(root), 3) == []
+        assert not root.check()
+        assert outside.join('keep').read() == 'keep'
+
+    def test_in_background(self, tmpdir):
+        root, outside = self.tree(tmpdir)
+        tmppath = file_module.rmtree_in_background(str(root), 2)
+        assert not root.check()
+        assert os.path.dirname(tmppath) == str(tmpdir)
+        for i in range(100):
+            if not os.path.exists(tmppath):
+                break
+            time.sleep(0.1)
+        assert not os.path.exists(tmppath)
+        assert sorted(os.listdir(str(tmpdir))) == ['outside']
+        assert outside.join('keep').read() == 'keep'
+
+
+class TestRecursiveAttributes(object):
+    def setup_method(self, method):
+        self.calls = []
+
+    def tree(self, tmpdir, monkeypatch):
+        root = tmpdir.mkdir('root')
+        root.join('a').write('a')
+        root.join('a').chmod(0644)
+        root.join('b').write('b')
+        root.join('b').chmod(0600)
+        root.mkdir('sub').chmod(0700)
+        root.join('sub', 'c').write('c')
+        root.join('sub', 'c').chmod(0600)
+        root.join('l').mksymlinkto('a')
+        monkeypatch.setattr(file_module.os, 'lchown',
+                            lambda path, uid, gid: self.calls.append(('lchown', path, uid, gid)))
+        monkeypatch.setattr(file_module.os, 'chmod',
+                            lambda path, mode: self.calls.append(('chmod', path, mode)))
+        return root
+
+    def test_only_mismatched_modes(self, tmpdir, monkeypatch):
+        root = self.tree(tmpdir, monkeypatch)
+        engine = file_module.RecursiveAttributes(None, os.getgid(), 0600, False, False)
+        engine.run(str(root), 2)
+        assert engine.examined == 5
+        assert engine.changed == 2
+        assert engine.errors == []
+        assert sorted(self.calls) == [('chmod', str(root.join('a')), 0600),
+                                      ('chmod', str(root.join('sub')), 0600)]
+
+    def test_owner(self, tmpdir, monkeypatch):
+        root = self.tree(tmpdir, monkeypatch)
+        uid = os.getuid() + 1
+        engine = file_module.RecursiveAttributes(uid, None, None, False, False)
+        engine.run(str(root), 2)
+        assert engine.changed == 5
+        assert sorted(self.calls) == [ ('lchown', str(root.join(*name)), uid, -1)
+                                       for name in (['a'], ['b'], ['l'], ['sub'], ['sub', 'c']) ]
+
+    def test_check_mode(self, tmpdir, monkeypatch):
+        root = self.tree(tmpdir, monkeypatch)
+        engine = file_module.RecursiveAttributes(os.getuid() + 1, None, 0600, False, True)
+        engine.run(str(root), 2)
+        assert engine.examined == 5
+        assert engine.changed == 5
+        assert self.calls == []
+        assert oct(root.join('a').stat().mode & 07777) == '0644'
+
+    def test_generic_path_for_symbolic_modes(self):
+        module = mock.MagicMock()
+        file_args = dict(path='/srv', mode='u+rwx', owner=None, group=None, secontext=None)
+        assert file_module.fast_recursive_attributes(module, file_args) is None
+        file_args['mode'] = '0750'
+        engine = file_module.fast_recursive_attributes(module, file_args)
+        assert engine.mode == 0750
+
+
+class TestBatchPaths(object):
+    def test_items_keep_their_order(self, tmpdir, capsys):
+        base = tmpdir.join('pp')
+        paths = [dict(path=str(base.join('x', 'y')), state='directory'),
+                 dict(path=str(base.join('l')), state='link', src='x')]
+        basic._ANSIBLE_ARGS = json.dumps(dict(ANSIBLE_MODULE_ARGS=dict(paths=paths)))
+        with pytest.raises(SystemExit):
+            file_module.main()
+        result = json.loads(capsys.readouterr()[0])
+        assert not result.get('failed'), result
+        assert [ r['path'] for r in result['results'] ] == [ p['path'] for p in paths ]
+        assert base.join('x', 'y').check(dir=1)
+        assert base.join('l').readlink() == 'x'
+
+    def run(self, capsys, paths):
+        basic._ANSIBLE_ARGS = json.dumps(dict(ANSIBLE_MODULE_ARGS=dict(paths=paths)))
+        with pytest.raises(SystemExit):
+            file_module.main()
+        return json.loads(capsys.readouterr()[0])
+
+    def test_retarget_symlink(self, tmpdir, capsys):
+        tmpdir.mkdir('releases').mkdir('v1')
+        tmpdir.join('releases').mkdir('v2')
+        current = tmpdir.join('current')
+        current.mksymlinkto('releases/v1')
+        paths = [dict(path=str(current), state='link', src='releases/v2')]
+        result = self.run(capsys, paths)
+        assert not result.get('failed'), result
+        assert result['changed']
+        assert current.readlink() == 'releases/v2'
+        assert not self.run(capsys, paths)['changed']
+
+    def test_no_link_over_file_without_force(self, tmpdir, capsys):
+        tmpdir.join('target').write('target')
+        tmpdir.join('file').write('file')
+        result = self.run(capsys, [dict(path=str(tmpdir.join('file')), state='link', src='target')])
+        assert result['failed']
+        assert 'refusing to convert between file and link' in result['results'][0]['msg']
+        assert tmpdir.join('file').read() == 'file'
+
+    def test_src_relative_to_directory_path(self, tmpdir, capsys):
+        tmpdir.mkdir('dir').join('target').write('target')
+        # src is found inside the directory, which is then not replaced without force
+        result = self.run(capsys, [dict(path=str(tmpdir.join('dir')), state='link', src='target')])
+        assert result['results'][0]['msg'].startswith('refusing to convert between directory and link')
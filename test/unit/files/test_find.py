@@ -0,0 +1,180 @@
+import imp
+import json
+import os
+import re
+
+import mock
+import pytest
+from ansible.module_utils import basic
+
+find = imp.load_source('files_find', os.path.join(
+    os.path.dirname(__file__), '..', '..', '..', 'files', 'find.py'))
+
+
+def contains(pattern):
+    return re.compile(pattern), re.compile('^(?:%s)' % pattern, re.M)
+
+
+class TestPatterns(object):
+    def matches(self, patterns, use_regex, name):
+        return find.pfilter(name, find.compile_patterns(patterns, use_regex))
+
+    def test_regex_flags_as_given(self):
+        assert self.matches(['.*\\.log$'], True, 'app.log')
+        # no extra flags, "." does not match a newline and "$" only the end
+        assert not self.matches(['a.b'], True, 'a\nb')
+        assert not self.matches(['.*log$'], True, 'app.log\nx')
+
+    def test_inline_flags_stay_with_their_pattern(self):
+        assert self.matches(['(?i)APP', 'b.*'], True, 'app.log')
+        assert not self.matches(['(?i)APP', 'B.*'], True, 'b.log')
+
+    def test_backreferences(self):
+        assert self.matches(['x', r'(a)\1'], True, 'aa')
+        assert not self.matches(['(x)', r'(a)\1'], True, 'ax')
+
+    def test_globs(self):
+        assert self.matches(['*.log', '*.txt'], False, 'app.txt')
+        assert not self.matches(['*.log'], False, 'app.log.1')
+        assert find.compile_patterns(['*.log', '*'], False) is None
+
+
+class TestParallelWalk(object):
+    def test_every_directory_visited(self):
+        tree = {'/': ['/a', '/b'], '/a': ['/a/c', '/a/d'], '/a/c': ['/a/c/e']}
+        visited = []
+        def visit(dirpath, depth):
+            visited.append((dirpath, depth))
+            return [ (subdir, depth + 1) for subdir in tree.get(dirpath, []) ]
+        find.parallel_walk(['/'], visit, 3)
+        assert sorted(visited) == [('/', 1), ('/a', 2), ('/a/c', 3), ('/a/c/e', 4),
+                                   ('/a/d', 3), ('/b', 2)]
+
+    def test_visit_raises(self):
+        def visit(dirpath, depth):
+            if dirpath == '/a':
+                raise OSError('permission denied')
+            return [('/a', 2)]
+        with pytest.raises(OSError):
+            find.parallel_walk(['/'], visit, 2)
+
+
+class TestContentFilter(object):
+    def test_lines_are_matched_on_their_own(self, tmpdir):
+        log = tmpdir.join('app.log')
+        log.write('foo\nbar\nbaz')
+        for (pattern, matched) in ((r'bar', True), (r'baz$', True), (r'foo\s+bar', False),
+                                   (r'[^x]+bar', False), (r'ba\Z', False), (r'\s*$', False)):
+            prog, quick = contains(pattern)
+            assert find.contentfilter(str(log), prog, quick) is matched, pattern
+            assert find.contentfilter(str(log), prog) is matched, pattern
+
+    def test_lines_across_chunks(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(find, 'CHUNK_SIZE', 4)
+        log = tmpdir.join('app.log')
+        log.write('first line\nsecond line\n')
+        prog, quick = contains(r'second line$')
+        assert find.contentfilter(str(log), prog, quick)
+        prog, quick = contains(r'line\nsecond')
+        assert not find.contentfilter(str(log), prog, quick)
+
+    def test_binary(self, tmpdir):
+        log = tmpdir.join('bin.log')
+        log.write('\0\nerror\n')
+        prog, quick = contains('error')
+        assert find.contentfilter(str(log), prog, quick)
+        assert not find.contentfilter(str(log), prog, quick, skip_binary=True)
+
+    def test_binary_files_searched_by_default(self, tmpdir, capsys):
+        tmpdir.join('bin.log').write('\0\nerror\n')
+        tmpdir.join('text.log').write('fine\n')
+        args = dict(paths=[str(tmpdir)], contains='error', workers=1)
+        basic._ANSIBLE_ARGS = json.dumps(dict(ANSIBLE_MODULE_ARGS=args))
+        with pytest.raises(SystemExit):
+            find.main()
+        files = json.loads(capsys.readouterr()[0])['files']
+        assert [ os.path.basename(f['path']) for f in files ] == ['bin.log']
+
+    def test_directories_not_searched(self, tmpdir, capsys):
+        tmpdir.mkdir('logs').join('app.log').write('fine\n')
+        tmpdir.join('error.log').write('error\n')
+        args = dict(paths=[str(tmpdir)], contains='error', file_type='directory', workers=1)
+        basic._ANSIBLE_ARGS = json.dumps(dict(ANSIBLE_MODULE_ARGS=args))
+        with pytest.raises(SystemExit):
+            find.main()
+        files = json.loads(capsys.readouterr()[0])['files']
+        assert [ os.path.basename(f['path']) for f in files ] == ['logs']
+
+
+class TestChecksums(object):
+    def test_run_in_pool(self):
+        def func(item):
+            if item == 2:
+                raise IOError(item)
+            return item
+        results = find.run_in_pool(func, range(5), 2)
+        assert results[:2] == [0, 1] and results[3:] == [3, 4]
+        assert isinstance(results[2], IOError)
+
+    def test_checksum(self, tmpdir, monkeypatch):
+        tmpdir.join('app.log').write('data')
+        monkeypatch.setattr(find, 'HASH_BLOCK_SIZE', 1)
+        digest = find.checksum(str(tmpdir.join('app.log')), 'sha1')
+        assert digest == ('a17c9aaa61e80a1bf71d0d850af4e5baa9800bbd', False)
+        assert find.checksum(str(tmpdir.join('app.log')), 'sha1', 2) == (None, False)
+        assert find.checksum(str(tmpdir.join('app.log')), 'sha1', 2, True)[1]
+        assert find.checksum(str(tmpdir.join('missing')), 'sha1') == (None, False)
+
+
+class TestCollector(object):
+    def found(self):
+        return [ ('/srv/%s' % name, mock.Mock(st_size=size))
+                 for (name, size) in (('b', 30), ('a', 10), ('d', 40), ('c', 20)) ]
+
+    def test_limit_without_sort(self):
+        # the walk threads may hand over their matches in any order
+        for order in ((0, 1, 2, 3), (3, 2, 1, 0), (2, 0, 3, 1)):
+            collector = find.Collector(limit=2)
+            for index in order:
+                collector.add([self.found()[index]])
+            assert collector.matched == 4
+            assert [ path for (path, st) in collector.results() ] == ['/srv/a', '/srv/b']
+
+    def test_limit_with_sort(self):
+        collector = find.Collector(limit=2, sort_by='size')
+        collector.add(self.found()[:2])
+        collector.add(self.found()[2:])
+        assert collector.matched == 4
+        assert [ path for (path, st) in collector.results() ] == ['/srv/a', '/srv/c']
+
+        collector = find.Collector(limit=2, sort_by='size', descending=True)
+        collector.add(self.found())
+        assert [ path for (path, st) in collector.results() ] == ['/srv/d', '/srv/b']
+
+    def test_limit_zero(self):
+        for descending in (False, True):
+            collector = find.Collector(limit=0, sort_by='size', descending=descending)
+            collector.add(self.found())
+            assert collector.matched == 4
+            assert collector.results() == []
+
+    def test_negative_limit(self, tmpdir, capsys):
+        args = dict(paths=[str(tmpdir)], limit=-1)
+        basic._ANSIBLE_ARGS = json.dumps(dict(ANSIBLE_MODULE_ARGS=args))
+        with pytest.raises(SystemExit):
+            find.main()
+        result = json.loads(capsys.readouterr()[0])
+        assert result['failed']
+        assert result['msg'] == 'limit must not be negative'
+
+    def test_matched_before_limit(self, tmpdir, capsys):
+        for name in ('a.log', 'b.log', 'c.log'):
+            tmpdir.join(name).write('error\n')
+        for contains in (None, 'error'):
+            args = dict(paths=[str(tmpdir)], contains=contains, limit=2, workers=2)
+            basic._ANSIBLE_ARGS = json.dumps(dict(ANSIBLE_MODULE_ARGS=args))
+            with pytest.raises(SystemExit):
+                find.main()
+            result = json.loads(capsys.readouterr()[0])
+            assert result['matched'] == 3
+            assert [ os.path.basename(f['path']) for f in result['files'] ] == ['a.log', 'b.log']
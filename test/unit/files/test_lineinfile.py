@@ -0,0 +1,133 @@
+import imp
+import os
+import shutil
+
+import mock
+import pytest
+
+lineinfile = imp.load_source('files_lineinfile', os.path.join(
+    os.path.dirname(__file__), '..', '..', '..', 'files', 'lineinfile.py'))
+
+
+class TestApplyRules(object):
+    def setup_method(self, method):
+        self.module = mock.MagicMock()
+        self.module.check_mode = False
+        self.module.params = dict(validate=None)
+        self.module.atomic_move.side_effect = shutil.move
+
+    def apply(self, tmpdir, content, items):
+        dest = tmpdir.join('sshd_config')
+        dest.write(content)
+        rules = [ lineinfile.LineRule(**item) for item in items ]
+        changed, backupdest = lineinfile.apply_rules(self.module, str(dest), rules, False)
+        return changed, dest.read()
+
+    def test_append_after_replaced_last_line(self, tmpdir):
+        for items in ([dict(line='X11Forwarding no'), dict(regexp='^UseDNS ', line='UseDNS no')],
+                      [dict(regexp='^UseDNS ', line='UseDNS no'), dict(line='X11Forwarding no')]):
+            changed, content = self.apply(tmpdir, 'Port 22\nUseDNS yes', items)
+            assert changed
+            assert content == 'Port 22\nUseDNS no\nX11Forwarding no\n'
+
+    def test_append_after_removed_last_line(self, tmpdir):
+        items = [dict(line='X11Forwarding no'), dict(regexp='^UseDNS ', state='absent')]
+        changed, content = self.apply(tmpdir, 'Port 22\nUseDNS yes', items)
+        assert content == 'Port 22\nX11Forwarding no\n'
+
+    def test_append_to_unterminated_last_line(self, tmpdir):
+        items = [dict(line='X11Forwarding no'), dict(line='UseDNS no')]
+        changed, content = self.apply(tmpdir, 'Port 22', items)
+        assert content == 'Port 22\nX11Forwarding no\nUseDNS no\n'
+
+    def test_insert_before_and_after(self, tmpdir):
+        items = [dict(line='UseDNS no', insertafter='^Port'), dict(line='# sshd', insertbefore='BOF')]
+        changed, content = self.apply(tmpdir, 'Port 22\n', items)
+        assert content == '# sshd\nPort 22\nUseDNS no\n'
+
+    def test_insert_after_unterminated_last_line(self, tmpdir):
+        for items in ([dict(line='UseDNS no', insertafter='^Port'), dict(line='X11Forwarding no')],
+                      [dict(line='X11Forwarding no'), dict(line='UseDNS no', insertafter='^Port')]):
+            changed, content = self.apply(tmpdir, 'Port 22', items)
+            assert content == 'Port 22\nUseDNS no\nX11Forwarding no\n'
+
+    def test_inline_flags(self, tmpdir):
+        items = [dict(regexp='(?x) c', line='C'), dict(regexp='a b', line='A B')]
+        changed, content = self.apply(tmpdir, 'a b\nc\n', items)
+        assert content == 'A B\nC\n'
+
+    def test_last_matching_line_counts(self, tmpdir):
+        changed, content = self.apply(tmpdir, 'foo\nbar\nfoo\r\n', [dict(line='foo')])
+        assert changed
+        assert content == 'foo\nbar\nfoo\n'
+
+    def test_last_item_wins(self, tmpdir):
+        items = [dict(regexp='^a=', line='a=1'), dict(regexp='^a=', line='a=2')]
+        changed, content = self.apply(tmpdir, 'a=0\nb=0\n', items)
+        assert changed
+        assert content == 'a=2\nb=0\n'
+        changed, content = self.apply(tmpdir, content, items)
+        assert not changed
+        assert content == 'a=2\nb=0\n'
+
+    def test_absent_then_present(self, tmpdir):
+        items = [dict(regexp='^a=', state='absent'), dict(line='a=1')]
+        changed, content = self.apply(tmpdir, 'a=0\nb=0\n', items)
+        assert changed
+        assert content == 'b=0\na=1\n'
+        changed, content = self.apply(tmpdir, content, items)
+        assert not changed
+        assert content == 'b=0\na=1\n'
+
+    def test_present_then_absent(self, tmpdir):
+        items = [dict(line='a=1'), dict(regexp='^a=', state='absent')]
+        changed, content = self.apply(tmpdir, 'a=1\nb=0\n', items)
+        assert changed
+        assert content == 'b=0\n'
+        changed, content = self.apply(tmpdir, content, items)
+        assert not changed
+        assert content == 'b=0\n'
+
+    def test_item_sees_lines_added_before_it(self, tmpdir):
+        items = [dict(line='a=1'), dict(regexp='^a=', line='a=2')]
+        changed, content = self.apply(tmpdir, 'b=0\n', items)
+        assert content == 'b=0\na=2\n'
+
+    def test_same_insertion_point(self, tmpdir):
+        items = [dict(line='# one', insertbefore='BOF'), dict(line='# two', insertbefore='BOF')]
+        changed, content = self.apply(tmpdir, 'a=0\n', items)
+        assert content == '# two\n# one\na=0\n'
+        changed, content = self.apply(tmpdir, content, items)
+        assert not changed
+
+
+class AnsibleExit(Exception):
+    pass
+
+
+class TestMultiple(object):
+    def setup_method(self, method):
+        self.module = mock.MagicMock()
+        self.module.check_mode = False
+        self.module.params = dict(validate=None, state='present', insertafter=None,
+                                  insertbefore=None, backrefs=False)
+        self.module.atomic_move.side_effect = shutil.move
+        self.module.boolean.side_effect = bool
+        self.module.exit_json.side_effect = AnsibleExit()
+        self.module.set_fs_attributes_if_different.return_value = False
+
+    def run(self, tmpdir, content, items):
+        dest = tmpdir.join('hosts')
+        dest.write(content)
+        with pytest.raises(AnsibleExit):
+            lineinfile.multiple(self.module, str(dest), items, False, False)
+        return dest.read()
+
+    def test_module_state_is_the_default(self, tmpdir):
+        self.module.params['state'] = 'absent'
+        assert self.run(tmpdir, 'a\nb\n', ['b']) == 'a\n'
+
+    def test_module_insertbefore_is_the_default(self, tmpdir):
+        self.module.params['insertbefore'] = 'BOF'
+        assert self.run(tmpdir, 'a\n', ['b', dict(line='c', insertafter='EOF')]) == 'b\na\nc\n'
+
@@ -0,0 +1,34 @@
+import imp
+import os
+import re
+
+replace = imp.load_source('files_replace', os.path.join(
+    os.path.dirname(__file__), '..', '..', '..', 'files', 'replace.py'))
+
+CASES = [
+    (r'^(ListenAddress[ ]+)[^\n]+$', r'\g<1>0.0.0.0'),
+    (r'x*', '-'),
+    (r'(?m)^', '# '),
+    (r'\s*$', ''),
+    (r'Port 22', 'Port 22'),
+]
+CONTENTS = 'ListenAddress 127.0.0.1\nPort 22\nxxab\n'
+
+
+class TestSubstitutions(object):
+    def test_same_as_subn(self):
+        for (pattern, repl) in CASES:
+            mre = re.compile(pattern, re.MULTILINE)
+            (expected, count) = mre.subn(repl, CONTENTS)
+            assert ''.join(replace.replaced(mre, repl, CONTENTS)) == expected, pattern
+            assert replace.count_changes(mre, repl, CONTENTS) == (count, expected != CONTENTS), pattern
+
+    def test_map_file(self, tmpdir):
+        tmpdir.join('sshd_config').write(CONTENTS)
+        tmpdir.join('empty').write('')
+        contents = replace.map_file(str(tmpdir.join('sshd_config')))
+        try:
+            assert contents[:] == CONTENTS
+        finally:
+            contents.close()
+        assert replace.map_file(str(tmpdir.join('empty'))) == ''
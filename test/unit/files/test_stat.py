@@ -0,0 +1,33 @@
+import imp
+import os
+
+stat_module = imp.load_source('files_stat', os.path.join(
+    os.path.dirname(__file__), '..', '..', '..', 'files', 'stat.py'))
+
+
+class TestStatPaths(object):
+    params = dict(follow=False, get_md5=True, get_checksum=True,
+                  checksum_algorithm='sha1', metadata_only=False)
+
+    def test_stats_and_errors(self, tmpdir):
+        tmpdir.join('motd').write('data')
+        paths = [str(tmpdir.join('motd')), str(tmpdir.join('missing'))]
+        (stats, errors) = stat_module.stat_paths(paths, self.params, stat_module.NameCache(), 2)
+        assert stats[paths[0]]['checksum'] == 'a17c9aaa61e80a1bf71d0d850af4e5baa9800bbd'
+        assert stats[paths[0]]['md5'] == '8d777f385d3dfec8815d20f7496026dc'
+        assert stats[paths[1]]['exists'] is False
+        assert errors == {}
+
+    def test_unexpected_error(self, tmpdir, monkeypatch):
+        def stat_path(path, params, names):
+            raise ValueError('bad owner')
+        monkeypatch.setattr(stat_module, 'stat_path', stat_path)
+        path = str(tmpdir)
+        (stats, errors) = stat_module.stat_paths([path], self.params, stat_module.NameCache(), 2)
+        assert stats == {} and errors == {path: 'bad owner'}
+
+    def test_multi_digest(self, tmpdir):
+        tmpdir.join('motd').write('data')
+        digests = stat_module.multi_digest(str(tmpdir.join('motd')), ['sha1', 'md5', 'nope'])
+        assert digests == dict(sha1='a17c9aaa61e80a1bf71d0d850af4e5baa9800bbd',
+                               md5='8d777f385d3dfec8815d20f7496026dc', nope=None)
@@ -0,0 +1,156 @@
+import imp
+import os
+
+import mock
+import pytest
+
+synchronize = imp.load_source('files_synchronize', os.path.join(
+    os.path.dirname(__file__), '..', '..', '..', 'files', 'synchronize.py'))
+
+OUTPUT = '''<<CHANGED>>>f+++++++++ app/new.conf
+<<CHANGED>>.d..t...... app/
+<<CHANGED>>cL+++++++++ app/current -> releases/2
+<<CHANGED>>*deleting   app/old.conf
+
+Number of files: 3 (reg: 2, dir: 1)
+Total file size: 1,234 bytes
+Literal data: 800 bytes
+Matched data: 200 bytes
+File list generation time: 0.001 seconds
+Total bytes sent: 1,100
+Total bytes received: 35
+
+sent 1,100 bytes  received 35 bytes  2,270.00 bytes/sec
+total size is 1,234  speedup is 1.09
+'''
+
+
+class TestParseOutput(object):
+    def test_changes_and_stats(self):
+        (changes, stats, lines) = synchronize.parse_output(OUTPUT, '<<CHANGED>>')
+        assert [ (c['path'], c['update'], c['type']) for c in changes ] == [
+            ('app/new.conf', 'received', 'file'), ('app/', 'attributes', 'directory'),
+            ('app/current', 'created', 'symlink'), ('app/old.conf', 'deleted', None)]
+        assert changes[0]['created'] and not changes[1]['created']
+        assert changes[1]['changes'] == ['time']
+        assert changes[2]['target'] == 'releases/2'
+        assert stats['total_bytes_sent'] == 1100
+        assert stats['literal_data'] == 800 and stats['matched_data'] == 200
+        assert stats['file_list_generation_time'] == 0.001
+        assert stats['bytes_per_sec'] == 2270.0 and stats['speedup'] == 1.09
+        assert [ l for l in lines if l ] == [
+            '>f+++++++++ app/new.conf', '.d..t...... app/',
+            'cL+++++++++ app/current -> releases/2', '*deleting   app/old.conf']
+
+    def test_merge_stats(self):
+        (changes, stats, lines) = synchronize.parse_output(OUTPUT, '<<CHANGED>>')
+        total = synchronize.merge_stats(synchronize.merge_stats({}, stats), stats)
+        assert total['total_bytes_sent'] == 2200
+        assert total['speedup'] == 1.09
+
+
+class TestShard(object):
+    def test_balanced(self, tmpdir):
+        paths = []
+        for (name, entries) in (('big', 6), ('mid', 3), ('small', 2), ('tiny', 1)):
+            path = tmpdir.mkdir(name)
+            for i in range(entries):
+                path.join(str(i)).write('')
+            paths.append(str(path))
+        shards = synchronize.shard(paths, 2)
+        assert shards == [[ str(tmpdir.join(n)) for n in ('big', 'tiny') ],
+                          [ str(tmpdir.join(n)) for n in ('mid', 'small') ]]
+
+    def test_fewer_paths_than_shards(self, tmpdir):
+        assert synchronize.shard([str(tmpdir)], 4) == [[str(tmpdir)]]
+
+
+class TestCache(object):
+    def test_round_trip(self, tmpdir):
+        path = str(tmpdir.join('tree.json'))
+        assert synchronize.load_cache(path) == {}
+        synchronize.save_cache(path, {'key': {}, 'signatures': {'.': 'abc'}})
+        assert synchronize.load_cache(path)['signatures'] == {'.': 'abc'}
+        synchronize.save_cache(str(tmpdir.join('missing', 'tree.json')), {})
+
+    def test_signature_covers_ownership(self, tmpdir, monkeypatch):
+        tmpdir.mkdir('a').join('index.html').write('')
+        before = synchronize.tree_signature(str(tmpdir))
+        lstat = os.lstat
+        def chowned(path):
+            st = lstat(path)
+            if not path.endswith('index.html'):
+                return st
+            return mock.Mock(st_mode=st.st_mode, st_uid=st.st_uid + 1, st_gid=st.st_gid,
+                             st_size=st.st_size, st_mtime=st.st_mtime)
+        monkeypatch.setattr(synchronize.os, 'lstat', chowned)
+        assert synchronize.tree_signature(str(tmpdir)) != before
+
+
+class AnsibleExit(Exception):
+    pass
+
+
+class TestSyncSharded(object):
+    def setup_method(self, method):
+        self.module = mock.MagicMock()
+        self.module.check_mode = False
+        self.module.run_command.return_value = (0, '', '')
+        self.module.fail_json.side_effect = AnsibleExit()
+        self.module.exit_json.side_effect = AnsibleExit()
+
+    def sync(self, tmpdir, cmd):
+        tmpdir.mkdir('src').mkdir('a')
+        tmpdir.join('src').mkdir('b')
+        self.module.params = dict(workers=2, bwlimit=0, cache=None,
+                                  src=str(tmpdir.join('src')) + '/', dest=str(tmpdir.join('dest')))
+        with pytest.raises(AnsibleExit):
+            synchronize.sync_sharded(self.module, cmd, str(tmpdir.join('src')),
+                                     str(tmpdir.join('src')), str(tmpdir.join('dest')), '<<CHANGED>>')
+
+    def test_shards_run_outside_the_module(self, tmpdir):
+        self.sync(tmpdir, 'echo "<<CHANGED>>>f+++++++++"')
+        # only the top level rsync goes through run_command
+        assert self.module.run_command.call_count == 1
+        result = self.module.exit_json.call_args[1]
+        assert result['changed']
+        assert len(result['changes']) == 2
+
+    def test_shards_read_their_directories_from_a_file(self, tmpdir, monkeypatch):
+        lists = {}
+        def run_rsync(args):
+            list_file = [ arg for arg in args if arg.startswith('--files-from=') ][0][len('--files-from='):]
+            lists[list_file] = open(list_file).read()
+            return (0, '', '')
+        monkeypatch.setattr(synchronize, 'run_rsync', run_rsync)
+        self.sync(tmpdir, 'rsync --archive')
+        assert sorted(lists.values()) == ['./a\n', './b\n']
+        cmds = self.module.exit_json.call_args[1]['cmds']
+        assert len(cmds) == 3
+        for cmdstr in cmds[1:]:
+            assert ' --recursive --files-from=' in cmdstr
+            assert cmdstr.endswith(' "%s/" "%s/"' % (tmpdir.join('src'), tmpdir.join('dest')))
+        # the lists are removed once the shards ran
+        assert not [ path for path in lists if os.path.exists(path) ]
+
+    def test_failed_shard_reported_once(self, tmpdir):
+        self.sync(tmpdir, "sh -c 'echo no space left >&2; exit 11'")
+        assert self.module.fail_json.call_count == 1
+        result = self.module.fail_json.call_args[1]
+        assert result['rc'] == 11
+        assert result['msg'] == 'no space left\n'
+
+    def test_hosts_share_the_cache(self, tmpdir):
+        tmpdir.mkdir('src').mkdir('a')
+        cache = str(tmpdir.join('tree.json'))
+        for run in range(2):
+            for host in ('web1', 'web2'):
+                self.module.run_command.reset_mock()
+                self.module.params = dict(workers=1, bwlimit=0, cache=cache, checksum=False,
+                                          src=str(tmpdir.join('src')) + '/', dest='%s:/srv/www' % host)
+                with pytest.raises(AnsibleExit):
+                    synchronize.sync_sharded(self.module, 'true', str(tmpdir.join('src')),
+                                             str(tmpdir.join('src')), self.module.params['dest'], '<<CHANGED>>')
+                # the second run of each host finds its own entry
+                assert self.module.run_command.called == (run == 0)
+        assert len(synchronize.load_cache(cache)) == 2
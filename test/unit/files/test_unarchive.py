@@ -0,0 +1,246 @@
+import imp
+import json
+import os
+import tarfile
+import zipfile
+
+import mock
+import pytest
+from ansible.module_utils import basic
+
+# importing through the files package would make python 2 resolve the
+# module's own "import stat" to files/stat.py
+unarchive = imp.load_source('files_unarchive', os.path.join(
+    os.path.dirname(__file__), '..', '..', '..', 'files', 'unarchive.py'))
+
+
+def add_symlink(tar, name, target):
+    info = tarfile.TarInfo(name)
+    info.type = tarfile.SYMTYPE
+    info.linkname = target
+    tar.addfile(info)
+
+
+def add_hardlink(tar, name, target):
+    info = tarfile.TarInfo(name)
+    info.type = tarfile.LNKTYPE
+    info.linkname = target
+    tar.addfile(info)
+
+
+def add_file(tar, name, data='data'):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mode = 0644
+    tar.addfile(info, mock.MagicMock(read=lambda size=None: data))
+
+
+def zip_symlink(archive, name, target):
+    info = zipfile.ZipInfo(name)
+    info.create_system = 3
+    info.external_attr = 0120777 << 16
+    archive.writestr(info, target)
+
+
+class TestManifest(object):
+    def test_round_trip(self, tmpdir):
+        path = str(tmpdir.join('manifest.json'))
+        unarchive.save_manifest(path, {'members': [['a', 1]]})
+        assert unarchive.load_manifest(path) == {'members': [['a', 1]]}
+
+    def test_unwritable(self, tmpdir):
+        unarchive.save_manifest(str(tmpdir.join('missing', 'manifest.json')), {})
+        tmpdir.join('manifest.json').mkdir()
+        unarchive.save_manifest(str(tmpdir.join('manifest.json')), {})
+        assert os.listdir(str(tmpdir)) == ['manifest.json']
+
+
+class TestMemberSelected(object):
+    def test_include_and_exclude(self):
+        assert unarchive.member_selected('./etc/app.conf', ['etc/*'], [])
+        assert not unarchive.member_selected('etc/app.conf', ['usr/*'], [])
+        assert not unarchive.member_selected('/etc/app.conf', [], ['etc/*.conf'])
+
+
+class TestTarFileArchive(object):
+    def setup_method(self, method):
+        self.module = mock.MagicMock()
+        self.module.params = dict(include=None, exclude=None)
+
+    def handler(self, tmpdir, build):
+        src = str(tmpdir.join('archive.tar'))
+        tar = tarfile.open(src, 'w')
+        try:
+            build(tar)
+        finally:
+            tar.close()
+        handler = unarchive.TarFileArchive(src, str(tmpdir.join('dest')), self.module)
+        assert handler.can_handle_archive()
+        return handler
+
+    def test_stop_decompressor(self, tmpdir):
+        src = str(tmpdir.join('archive.tar.gz'))
+        tar = tarfile.open(src, 'w:gz')
+        try:
+            for i in range(200):
+                add_file(tar, 'file%d' % i, os.urandom(4096))
+        finally:
+            tar.close()
+        handler = unarchive.TarFileArchive(src, str(tmpdir.join('dest')), self.module)
+        handler.decompress_cmd = ['gzip', '-dc']
+        handler._open()
+        proc = handler._proc
+        # stopped half way, without raising for the decompressor it killed
+        handler._close(False)
+        assert proc.returncode is not None
+
+    def test_symlink_escape(self, tmpdir):
+        outside = tmpdir.mkdir('outside')
+        tmpdir.mkdir('dest')
+        def build(tar):
+            add_symlink(tar, 'evil', str(outside))
+            add_file(tar, 'evil/pwn')
+        result = self.handler(tmpdir, build).unarchive()
+        assert result['rc'] != 0
+        assert not outside.join('pwn').check()
+        assert 'evil' not in result['extracted']
+
+    def test_existing_symlink_escape(self, tmpdir):
+        outside = tmpdir.mkdir('outside')
+        tmpdir.mkdir('dest').join('evil').mksymlinkto(outside)
+        result = self.handler(tmpdir, lambda tar: add_file(tar, 'evil/pwn')).unarchive()
+        assert result['rc'] != 0
+        assert not outside.join('pwn').check()
+
+    def test_hardlink_escape(self, tmpdir):
+        tmpdir.join('secret').write('secret')
+        tmpdir.mkdir('dest')
+        result = self.handler(tmpdir, lambda tar: add_hardlink(tar, 'copy', '../secret')).unarchive()
+        assert result['rc'] != 0
+        assert not tmpdir.join('dest', 'copy').check()
+
+    def test_links(self, tmpdir):
+        dest = tmpdir.mkdir('dest')
+        def build(tar):
+            add_file(tar, 'lib/libapp.so.1')
+            add_symlink(tar, 'lib/libapp.so', 'libapp.so.1')
+            add_hardlink(tar, 'lib/libapp.hard', 'lib/libapp.so.1')
+            add_symlink(tar, 'tmp', '/tmp')
+        result = self.handler(tmpdir, build).unarchive()
+        assert result['rc'] == 0, result['err']
+        assert dest.join('lib', 'libapp.so').readlink() == 'libapp.so.1'
+        assert dest.join('lib', 'libapp.hard').read() == 'data'
+        assert dest.join('tmp').readlink() == '/tmp'
+        # links out of dest are created last
+        assert result['extracted'] == ['lib/libapp.so.1', 'lib/libapp.so', 'lib/libapp.hard', 'tmp']
+
+    def test_is_unarchived(self, tmpdir):
+        dest = tmpdir.mkdir('dest')
+        def build(tar):
+            add_file(tar, 'etc/app.conf', 'v1')
+            add_symlink(tar, 'etc/current.conf', 'app.conf')
+        assert self.handler(tmpdir, build).is_unarchived(None, None, None)['unarchived'] is False
+        assert self.handler(tmpdir, build).unarchive()['rc'] == 0
+        assert self.handler(tmpdir, build).is_unarchived(None, None, None)['unarchived'] is True
+
+        dest.join('etc', 'app.conf').write('v2')
+        handler = self.handler(tmpdir, build)
+        result = handler.is_unarchived(None, None, None)
+        assert result == dict(unarchived=False, differs='etc/app.conf')
+        result = handler.unarchive()
+        assert result['extracted'] == ['etc/app.conf']
+        assert dest.join('etc', 'app.conf').read() == 'v1'
+
+
+class TestTarStreamArchive(object):
+    def setup_method(self, method):
+        self.module = mock.MagicMock()
+        self.module.params = dict(include=None, exclude=['docs/*'])
+        self.module.get_bin_path.return_value = None
+
+    def test_unpack_while_reading(self, tmpdir):
+        src = str(tmpdir.join('archive.tar.gz'))
+        tar = tarfile.open(src, 'w:gz')
+        try:
+            add_file(tar, 'bin/app', 'app')
+            add_file(tar, 'docs/README', 'readme')
+        finally:
+            tar.close()
+        dest = tmpdir.mkdir('dest')
+
+        reader = unarchive.DownloadReader(open(src, 'rb'), 'sha1')
+        handler = unarchive.TarStreamArchive(src, str(dest), self.module, reader)
+        assert handler.can_handle_archive()
+        assert handler.is_unarchived(None, None, None)['unarchived'] is False
+        result = handler.unarchive()
+        reader.close()
+        assert result['rc'] == 0, result['err']
+        assert result['extracted'] == ['bin/app']
+        assert handler.files_in_archive == ['bin/app']
+        assert dest.join('bin', 'app').read() == 'app'
+        assert not dest.join('docs').check()
+        assert reader.size == os.path.getsize(src)
+        assert reader.digest.hexdigest() == unarchive.AVAILABLE_HASH_ALGORITHMS['sha1'](open(src, 'rb').read()).hexdigest()
+
+    def test_no_checksum(self, tmpdir, capsys, monkeypatch):
+        download = mock.Mock()
+        monkeypatch.setattr(unarchive, 'download', download)
+        args = dict(src='https://example.com/release.tar.gz', dest=str(tmpdir), copy=False, stream=True,
+                    checksum='sha1:da39a3ee5e6b4b0d3255bfef95601890afd80709')
+        basic._ANSIBLE_ARGS = json.dumps(dict(ANSIBLE_MODULE_ARGS=args))
+        with pytest.raises(SystemExit):
+            unarchive.main()
+        result = json.loads(capsys.readouterr()[0])
+        assert result['failed']
+        assert result['msg'].startswith('checksum cannot be used with stream')
+        assert not download.called
+        assert tmpdir.listdir() == []
+
+
+class TestZipArchive(object):
+    def setup_method(self, method):
+        self.module = mock.MagicMock()
+        self.module.params = dict(include=None, exclude=None)
+
+    def handler(self, tmpdir, build):
+        src = str(tmpdir.join('archive.zip'))
+        archive = zipfile.ZipFile(src, 'w')
+        try:
+            build(archive)
+        finally:
+            archive.close()
+        handler = unarchive.ZipArchive(src, str(tmpdir.join('dest')), self.module)
+        assert handler.can_handle_archive()
+        return handler
+
+    def test_symlink_escape(self, tmpdir):
+        outside = tmpdir.mkdir('outside')
+        tmpdir.mkdir('dest')
+        def build(archive):
+            zip_symlink(archive, 'evil', str(outside))
+            archive.writestr('evil/pwn', 'data')
+        result = self.handler(tmpdir, build).unarchive()
+        assert result['rc'] != 0
+        assert not outside.join('pwn').check()
+        assert 'evil' not in result['extracted']
+
+    def test_existing_symlink_escape(self, tmpdir):
+        outside = tmpdir.mkdir('outside')
+        tmpdir.mkdir('dest').join('evil').mksymlinkto(outside)
+        result = self.handler(tmpdir, lambda archive: archive.writestr('evil/pwn', 'data')).unarchive()
+        assert result['rc'] != 0
+        assert not outside.join('pwn').check()
+
+    def test_symlinks(self, tmpdir):
+        dest = tmpdir.mkdir('dest')
+        def build(archive):
+            archive.writestr('lib/libapp.so.1', 'data')
+            zip_symlink(archive, 'lib/libapp.so', 'libapp.so.1')
+            zip_symlink(archive, 'tmp', '/tmp')
+        handler = self.handler(tmpdir, build)
+        assert handler.is_unarchived(None, None, None)['unarchived'] is False
+        result = handler.unarchive()
+        assert result['rc'] == 0, result['err']
+        assert dest.join('lib', 'libapp.so').readlink() == 'libapp.so.1'
+        assert dest.join('tmp').readlink() == '/tmp'
+        assert handler.is_unarchived(None, None, None)['unarchived'] is True